@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures the cost of dispatching parsed requests to methods, directly and
+through nested subdispatchers.
+
+Run from the repository root::
+
+    python benchmarks/bench_dispatch.py
+"""
+
+import common
+
+from tinyrpc.dispatch import RPCDispatcher
+from tinyrpc.dispatch.metrics import DispatchMetrics
+from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+
+
+def _dispatcher():
+    dispatcher = RPCDispatcher()
+    api = RPCDispatcher()
+    v1 = RPCDispatcher()
+    dispatcher.add_subdispatch(api, 'api.')
+    api.add_subdispatch(v1, 'v1.')
+
+    for d in (dispatcher, api, v1):
+        d.add_method(lambda a, b: a - b, 'subtract')
+        # methods that are never called make the routing table realistic
+        for i in xrange(50):
+            d.add_method(lambda: None, 'unused%d' % i)
+
+    def fail():
+        raise ValueError('failed')
+    dispatcher.add_method(fail, 'fail')
+
+    return dispatcher
+
+
+def _request(method, params=(42, 23), batch=1):
+    request = ('{"jsonrpc": "2.0", "method": "%s", "params": %s, "id": 1}'
+               % (method, list(params)))
+    if batch > 1:
+        request = '[%s]' % ', '.join([request] * batch)
+    return JSONRPCProtocol().parse_request(request)
+
+
+BENCHMARKS = [
+    ('dispatch.method', _request('subtract')),
+    ('dispatch.subdispatcher', _request('api.subtract')),
+    ('dispatch.nested_subdispatcher', _request('api.v1.subtract')),
+    ('dispatch.batch_of_10', _request('api.v1.subtract', batch=10)),
+    ('dispatch.method_not_found', _request('missing')),
+    ('dispatch.method_raises', _request('fail', ())),
+]
+
+
+def run(args):
+    dispatcher = _dispatcher()
+    for name, request in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        yield name, common.measure(lambda: dispatcher.dispatch(request),
+                                   args.duration)
+
+    name = 'dispatch.with_metrics'
+    if args.filter in name:
+        metrics = DispatchMetrics()
+        dispatcher.add_hook(post_dispatch=metrics.record)
+        request = _request('subtract')
+        yield name, common.measure(lambda: dispatcher.dispatch(request),
+                                   args.duration)
+
+
+if __name__ == '__main__':
+    common.main('dispatch', run, __doc__)
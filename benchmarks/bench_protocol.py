@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures the per-message cost of parsing and serializing with the JSON based
+protocols.
+
+Run from the repository root::
+
+    python benchmarks/bench_protocol.py
+"""
+
+import common
+
+from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+from tinyrpc.protocols.stratum import StratumRPCProtocol
+
+JSONRPC_REQUEST = ('{"jsonrpc": "2.0", "method": "subtract", '
+                   '"params": [42, 23], "id": 1}')
+JSONRPC_REPLY = '{"jsonrpc": "2.0", "result": 19, "id": 1}'
+JSONRPC_BATCH = '[%s]' % ', '.join([JSONRPC_REQUEST] * 10)
+STRATUM_REQUEST = ('{"id": 4, "method": "mining.submit", "params": '
+                   '["worker", "job", "00000000", "504e86ed", "b2957c02"]}\n')
+STRATUM_REPLY = '{"id": 4, "result": true, "error": null}\n'
+
+
+def _response(protocol, result):
+    request = protocol.create_request('method')
+    return request.respond(result).serialize
+
+
+def _create_request(protocol):
+    return lambda: protocol.create_request('subtract', [42, 23]).serialize()
+
+
+BENCHMARKS = [
+    ('jsonrpc.parse_request', JSONRPCProtocol().parse_request,
+     JSONRPC_REQUEST),
+    ('jsonrpc.parse_batch', JSONRPCProtocol().parse_request, JSONRPC_BATCH),
+    ('jsonrpc.parse_reply', JSONRPCProtocol().parse_reply, JSONRPC_REPLY),
+    ('stratum.parse_request', StratumRPCProtocol().parse_request,
+     STRATUM_REQUEST),
+    ('stratum.parse_reply', StratumRPCProtocol().parse_reply, STRATUM_REPLY),
+    ('jsonrpc.create_request', _create_request(JSONRPCProtocol()), None),
+    ('stratum.create_request', _create_request(StratumRPCProtocol()), None),
+    ('jsonrpc.serialize', _response(JSONRPCProtocol(), 19), None),
+    ('stratum.serialize', _response(StratumRPCProtocol(), True), None),
+]
+
+
+def run(args):
+    for name, func, data in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        call = func if data is None else lambda: func(data)
+        yield name, common.measure(call, args.duration)
+
+
+if __name__ == '__main__':
+    common.main('protocol', run, __doc__)
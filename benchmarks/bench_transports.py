@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures full round trips of JSON-RPC calls over loopback transports.
+
+Each benchmark runs an :py:class:`~tinyrpc.server.gevent.RPCServerGreenlets`
+and calls a method returning its argument from a number of greenlets, each
+using a connection of its own. Transports whose libraries are not installed
+are skipped.
+
+Run from the repository root::
+
+    python benchmarks/bench_transports.py -c 1,8,64
+"""
+
+from gevent import monkey
+# the HTTP and WebSocket clients use blocking sockets
+monkey.patch_all()
+
+import socket
+
+import gevent
+import gevent.queue
+from gevent.pywsgi import WSGIServer
+
+import common
+
+from tinyrpc.client import RPCClient
+from tinyrpc.dispatch import RPCDispatcher
+from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+from tinyrpc.server.gevent import RPCServerGreenlets
+from tinyrpc.transports import ClientTransport
+
+MESSAGE = 'x' * 100
+
+
+def _dispatcher():
+    dispatcher = RPCDispatcher()
+    dispatcher.add_method(lambda value: value, 'echo')
+    return dispatcher
+
+
+def _serve(transport):
+    server = RPCServerGreenlets(transport, JSONRPCProtocol(), _dispatcher())
+    return gevent.spawn(server.serve_forever)
+
+
+def tcp():
+    from gevent.server import StreamServer
+    from tinyrpc.transports.tcp import StreamServerTransport, \
+        StreamClientTransport
+
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+    greenlet = _serve(transport)
+
+    def stop():
+        greenlet.kill()
+        server.stop()
+
+    return lambda: StreamClientTransport(server.address), stop
+
+
+class _NoDelayWSGIServer(WSGIServer):
+    # the headers and the body of a response are written separately, without
+    # TCP_NODELAY the body waits for the delayed ACK of the headers
+    def handle(self, sock, address):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super(_NoDelayWSGIServer, self).handle(sock, address)
+
+
+def wsgi():
+    from tinyrpc.transports.http import HttpPostClientTransport
+    from tinyrpc.transports.wsgi import WsgiServerTransport
+
+    transport = WsgiServerTransport(queue_class=gevent.queue.Queue)
+    server = _NoDelayWSGIServer(('127.0.0.1', 0), transport.handle, log=None)
+    server.start()
+    greenlet = _serve(transport)
+
+    def stop():
+        greenlet.kill()
+        server.stop()
+
+    url = 'http://%s:%d/' % server.address
+    return lambda: HttpPostClientTransport(url), stop
+
+
+class _WSClientTransport(ClientTransport):
+    def __init__(self, url):
+        import websocket
+        self.ws = websocket.create_connection(url)
+
+    def send_message(self, message, expect_reply=True):
+        self.ws.send(message)
+        if expect_reply:
+            return self.ws.recv()
+
+
+def websocket():
+    from geventwebsocket import WebSocketServer
+    from tinyrpc.transports.websocket import WSServerTransport
+
+    transport = WSServerTransport(queue_class=gevent.queue.Queue)
+    server = WebSocketServer(('127.0.0.1', 0), transport.handle, log=None)
+    server.start()
+    greenlet = _serve(transport)
+
+    def stop():
+        greenlet.kill()
+        server.stop()
+
+    url = 'ws://%s:%d/ws' % server.address
+    return lambda: _WSClientTransport(url), stop
+
+
+def zmq():
+    import zmq.green
+    from tinyrpc.transports.zmq import ZmqServerTransport, ZmqClientTransport
+
+    ctx = zmq.green.Context()
+    transport = ZmqServerTransport.create(ctx, 'inproc://bench')
+    greenlet = _serve(transport)
+
+    def stop():
+        greenlet.kill()
+        ctx.destroy(linger=0)
+
+    return lambda: ZmqClientTransport.create(ctx, 'inproc://bench'), stop
+
+
+def http2():
+    from gevent.server import StreamServer
+    from tinyrpc.transports.http2 import Http2ServerTransport, \
+        Http2ClientTransport
+
+    transport = Http2ServerTransport(queue_class=gevent.queue.Queue)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+    greenlet = _serve(transport)
+
+    def stop():
+        greenlet.kill()
+        server.stop()
+
+    url = 'http://%s:%d/' % server.address
+    return lambda: Http2ClientTransport(url), stop
+
+
+TRANSPORTS = [tcp, wsgi, websocket, zmq, http2]
+
+
+def run(args):
+    for setup in TRANSPORTS:
+        name = 'roundtrip.' + setup.__name__
+        if args.filter not in name:
+            continue
+
+        try:
+            make_transport, stop = setup()
+        except ImportError as e:
+            print '%-40s skipped: %s' % (name, e)
+            continue
+
+        def make_call():
+            client = RPCClient(JSONRPCProtocol(), make_transport())
+            return lambda: client.call('echo', [MESSAGE], None)
+
+        try:
+            for concurrency in args.concurrency:
+                yield '%s[c=%d]' % (name, concurrency), \
+                    common.measure_concurrent(make_call, concurrency,
+                                              args.duration)
+        finally:
+            stop()
+
+
+if __name__ == '__main__':
+    common.main('transports', run, __doc__, concurrency=True)
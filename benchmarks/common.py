@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measurement, reporting and baselines shared by the benchmark scripts.
+
+Every script measures a list of benchmarks and prints one line per benchmark
+and concurrency level: the throughput in calls per second and the median and
+99th percentile latency of a call in microseconds.
+
+Results can be saved as a JSON baseline. When a baseline exists, the change
+of throughput and p99 latency against it is printed next to each result.
+Baselines depend on the machine they were recorded on, so record one before
+changing the code and compare against it on the same machine::
+
+    python benchmarks/bench_protocol.py --save
+    # change the code
+    python benchmarks/bench_protocol.py
+"""
+
+import argparse
+import json
+import os
+import platform
+import time
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'baselines')
+
+
+def percentile(sorted_values, fraction):
+    """Return the value below which ``fraction`` of ``sorted_values`` lie."""
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(latencies, calls, seconds):
+    """Summarize a measurement.
+
+    :param latencies: Latencies of single calls in seconds.
+    :param calls: The number of calls made.
+    :param seconds: The time all calls took.
+    :return: A dict with the throughput in calls per second and the p50 and
+             p99 latencies in microseconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        'throughput': calls / seconds,
+        'p50': percentile(latencies, 0.5) * 1e6,
+        'p99': percentile(latencies, 0.99) * 1e6,
+    }
+
+
+def measure(call, duration):
+    """Call ``call`` repeatedly for ``duration`` seconds.
+
+    Every call is timed on its own. The clock resolves microseconds, so the
+    latencies of calls taking a few microseconds are coarse. Reading the
+    clock adds to both the latencies and the time the throughput is based
+    on, which matters only for the fastest calls.
+    """
+    timer = time.time
+
+    # warm up caches and the CPU clock
+    deadline = timer() + duration / 10
+    while timer() < deadline:
+        call()
+
+    latencies = []
+    append = latencies.append
+    start = now = timer()
+    deadline = start + duration
+    while now < deadline:
+        call()
+        then, now = now, timer()
+        append(now - then)
+
+    return summarize(latencies, len(latencies), now - start)
+
+
+def measure_concurrent(make_call, concurrency, duration):
+    """Call from ``concurrency`` greenlets for ``duration`` seconds.
+
+    :param make_call: Called once per greenlet, returns the function the
+                      greenlet calls, usually bound to a connection of its
+                      own.
+    """
+    import gevent
+
+    calls = [make_call() for _ in xrange(concurrency)]
+    for call in calls:
+        call()
+
+    latencies = []
+    deadline = time.time() + duration
+
+    def run(call):
+        now = time.time()
+        while now < deadline:
+            call()
+            then, now = now, time.time()
+            latencies.append(now - then)
+
+    start = time.time()
+    gevent.joinall([gevent.spawn(run, call) for call in calls],
+                   raise_error=True)
+
+    return summarize(latencies, len(latencies), time.time() - start)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def save_baseline(path, results):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    data = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, separators=(',', ': '), sort_keys=True)
+        f.write('\n')
+
+
+def _change(value, baseline):
+    return '%+6.1f%%' % ((value / baseline - 1) * 100)
+
+
+def report(key, result, baseline):
+    line = '%-40s %10.0f/s %9.1f us %9.1f us' % (
+        key, result['throughput'], result['p50'], result['p99']
+    )
+    if key in baseline:
+        line += '   throughput %s, p99 %s' % (
+            _change(result['throughput'], baseline[key]['throughput']),
+            _change(result['p99'], baseline[key]['p99']),
+        )
+    print line
+
+
+def main(suite, run, description, concurrency=False):
+    """Parse the command line, run a suite and report its results.
+
+    :param suite: The name of the suite, naming its baseline file.
+    :param run: Called with the parsed arguments, yields ``(key, result)``
+                tuples.
+    :param description: Shown by ``--help``.
+    :param concurrency: Whether the suite accepts concurrency levels.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-d', '--duration', type=float, default=1.0,
+                        help='seconds to measure each benchmark for')
+    parser.add_argument('-k', '--filter', default='',
+                        help='only run benchmarks whose name contains this')
+    if concurrency:
+        parser.add_argument('-c', '--concurrency', default='1,8,64',
+                            help='comma separated concurrency levels')
+    parser.add_argument('--baseline',
+                        default=os.path.join(BASELINE_DIR, suite + '.json'),
+                        help='the baseline file to compare against')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baseline')
+    args = parser.parse_args()
+    if concurrency:
+        args.concurrency = [int(c) for c in args.concurrency.split(',')]
+
+    baseline = load_baseline(args.baseline)
+    print '%-40s %12s %12s %12s' % ('benchmark', 'throughput', 'p50', 'p99')
+
+    results = {}
+    for key, result in run(args):
+        report(key, result, baseline)
+        results[key] = result
+
+    if args.save:
+        # keep the results of benchmarks that were filtered out
+        baseline.update(results)
+        save_baseline(args.baseline, baseline)
+        print 'Saved baseline to %s' % args.baseline
@@ -5,7 +5,7 @@ import pytest
 from mock import Mock
 
 from tinyrpc.exc import RPCError
-from tinyrpc.client import RPCClient, RPCProxy
+from tinyrpc.client import RPCClient, RPCProxy, RPCClientMultiplexed
 from tinyrpc.protocols import RPCProtocol, RPCResponse, RPCErrorResponse
 from tinyrpc.transports import ClientTransport
 
@@ -112,3 +112,131 @@ def test_client_raises_error_replies(client, mock_protocol, method_name,
 
     with pytest.raises(RPCError):
         client.call(method_name, method_args, method_kwargs, one_way_setting)
+
+
+@pytest.fixture
+def jsonrpc_protocol():
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+    return JSONRPCProtocol()
+
+
+@pytest.fixture
+def multiplexed_client(jsonrpc_protocol, mock_transport):
+    return RPCClientMultiplexed(jsonrpc_protocol, mock_transport)
+
+
+def _sent_request(mock_transport, protocol, n):
+    return protocol.parse_request(mock_transport.send_message.call_args_list[n][0][0])
+
+
+def test_multiplexed_client_requires_out_of_order_protocol(mock_protocol,
+                                                           mock_transport):
+    mock_protocol.supports_out_of_order = False
+
+    with pytest.raises(ValueError):
+        RPCClientMultiplexed(mock_protocol, mock_transport)
+
+
+def test_multiplexed_client_matches_replies_out_of_order(multiplexed_client,
+                                                         jsonrpc_protocol,
+                                                         mock_transport):
+    first = multiplexed_client.call_async('foo', [1], None)
+    second = multiplexed_client.call_async('bar', [2], None)
+
+    for call in mock_transport.send_message.call_args_list:
+        assert call[1] == {'expect_reply': False}
+
+    req1 = _sent_request(mock_transport, jsonrpc_protocol, 0)
+    req2 = _sent_request(mock_transport, jsonrpc_protocol, 1)
+
+    multiplexed_client.handle_reply(req2.respond('second').serialize())
+    assert not first.ready()
+    assert second.get() == 'second'
+
+    multiplexed_client.handle_reply(req1.respond('first').serialize())
+    assert first.get() == 'first'
+
+
+def test_multiplexed_client_raises_error_replies(multiplexed_client,
+                                                 jsonrpc_protocol,
+                                                 mock_transport):
+    result = multiplexed_client.call_async('foo', [], None)
+    req = _sent_request(mock_transport, jsonrpc_protocol, 0)
+
+    multiplexed_client.handle_reply(
+        req.error_respond(Exception('foo')).serialize()
+    )
+
+    with pytest.raises(RPCError):
+        result.get()
+
+
+def test_multiplexed_client_drops_unknown_replies(multiplexed_client,
+                                                  jsonrpc_protocol):
+    req = jsonrpc_protocol.create_request('foo', [])
+
+    multiplexed_client.handle_reply(req.respond(1).serialize())
+    multiplexed_client.handle_reply('garbage')
+
+
+def test_multiplexed_client_fails_pending_on_transport_error(
+        multiplexed_client, mock_transport):
+    result = multiplexed_client.call_async('foo', [], None)
+
+    mock_transport.receive_reply = Mock(side_effect=IOError('closed'))
+    multiplexed_client.receive_forever()
+
+    with pytest.raises(IOError):
+        result.get()
+
+
+def test_multiplexed_client_one_way_call(multiplexed_client, mock_transport):
+    result = multiplexed_client.call_async('foo', [], None, one_way=True)
+
+    assert result.get(timeout=0) is None
+    assert not multiplexed_client._pending
+
+
+def test_multiplexed_client_call_times_out(multiplexed_client):
+    with pytest.raises(RPCError):
+        multiplexed_client.call('foo', [], None, timeout=0.01)
+
+    # a late reply is dropped
+    assert not multiplexed_client._pending
+
+
+def test_multiplexed_client_is_closed_once_transport_fails(
+        multiplexed_client, mock_transport):
+    mock_transport.receive_reply = Mock(side_effect=IOError('closed'))
+    multiplexed_client.receive_forever()
+
+    with pytest.raises(RPCError):
+        multiplexed_client.call_async('foo', [], None)
+    assert not multiplexed_client._pending
+
+
+def test_multiplexed_client_batch_call(multiplexed_client, jsonrpc_protocol,
+                                       mock_transport):
+    def reply(message, expect_reply):
+        batch = jsonrpc_protocol.parse_request(message)
+        response = batch.create_batch_response()
+        for req in batch:
+            if req.method == 'fail':
+                response.append(req.error_respond(Exception('failed')))
+            elif req.unique_id is not None:
+                response.append(req.respond(req.method))
+        multiplexed_client.handle_reply(response.serialize())
+
+    mock_transport.send_message = Mock(side_effect=reply)
+
+    results = multiplexed_client.batch_call([
+        ('foo', [], None, False),
+        ('fail', [], None, False),
+        ('notify', [], None, True),
+        ('bar', [], None, False),
+    ])
+
+    assert results[0] == 'foo'
+    assert isinstance(results[1], RPCError)
+    assert results[2:] == [None, 'bar']
+    assert not multiplexed_client._pending
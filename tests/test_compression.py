@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from tinyrpc.transports.compression import get_encodings, negotiate, \
+    DecompressionError, GzipEncoding, DeflateEncoding
+
+DATA = '{"jsonrpc":"2.0","id":1,"result":[%s]}' % ','.join(['1234'] * 1000)
+
+
+@pytest.fixture(params=get_encodings(), ids=lambda e: e.name)
+def encoding(request):
+    return request.param
+
+
+def test_compression_roundtrip(encoding):
+    compressed = encoding.compress(DATA)
+
+    assert len(compressed) < len(DATA) / 10
+    assert encoding.decompress(compressed) == DATA
+
+
+def test_incremental_compression_is_decodable_per_chunk(encoding):
+    compressor = encoding.compressor()
+    decompressor = encoding.decompressor()
+
+    for chunk in [DATA[:100], DATA[100:2000], DATA[2000:]]:
+        assert decompressor.decompress(compressor.compress(chunk)) == chunk
+    assert decompressor.decompress(compressor.flush()) == ''
+
+
+def test_decompression_is_limited(encoding):
+    compressed = encoding.compress(DATA)
+
+    with pytest.raises(DecompressionError):
+        encoding.decompress(compressed, max_size=1000)
+
+
+@pytest.mark.parametrize('encoding_class', [GzipEncoding, DeflateEncoding])
+def test_zlib_decompression_stops_at_limit(encoding_class):
+    # a few kilobytes inflating to 10 MB
+    compressed = encoding_class().compress('\0' * 10 * 1024 * 1024)
+    assert len(compressed) < 20 * 1024
+
+    class Recording(encoding_class):
+        def decompressor(self):
+            decompressor = super(Recording, self).decompressor()
+            decompress = decompressor.decompress
+
+            def recording(data, *args):
+                result = decompress(data, *args)
+                sizes.append(len(result))
+                return result
+            decompressor.decompress = recording
+            return decompressor
+
+    sizes = []
+    with pytest.raises(DecompressionError):
+        Recording().decompress(compressed, max_size=1000)
+    assert sum(sizes) == 1001
+
+    sizes = []
+    chunks = [compressed[i:i + 100] for i in xrange(0, len(compressed), 100)]
+    with pytest.raises(DecompressionError):
+        list(Recording().decompress_iter(chunks, max_size=5000))
+    assert sum(sizes) == 5001
+
+
+def test_invalid_data_raises(encoding):
+    with pytest.raises(DecompressionError):
+        encoding.decompress('not compressed' * 10)
+
+
+def test_get_encodings_rejects_unknown_names():
+    with pytest.raises(ValueError):
+        get_encodings(['gzip', 'lzma'])
+
+
+@pytest.mark.parametrize(('accept', 'expected'), [
+    (None, None),
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('deflate, gzip', 'gzip'),
+    ('deflate, gzip;q=0.5', 'deflate'),
+    ('gzip;q=0, deflate', 'deflate'),
+    ('*', 'gzip'),
+    ('*, gzip;q=0', 'deflate'),
+    ('GZIP', 'gzip'),
+])
+def test_negotiate(accept, expected):
+    encoding = negotiate(accept, [GzipEncoding(), DeflateEncoding()])
+
+    assert (encoding and encoding.name) == expected
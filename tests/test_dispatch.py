@@ -5,7 +5,7 @@ from mock import Mock, MagicMock
 import pytest
 
 from tinyrpc.dispatch import RPCDispatcher, public
-from tinyrpc import RPCRequest, RPCBatchRequest, RPCBatchResponse
+from tinyrpc import RPCRequest, RPCBatchRequest, RPCBatchResponse, RPCError
 
 
 @pytest.fixture
@@ -206,3 +206,443 @@ def test_batch_dispatch(dispatch):
 def test_dispatch_raises_key_error(dispatch):
     with pytest.raises(KeyError):
         dispatch.get_method('foo')
+
+
+def _worker_pid(fail=False):
+    import os
+
+    if fail:
+        raise ValueError('failed in worker')
+    return os.getpid()
+
+
+@pytest.fixture(params=['threads', 'gevent'])
+def process_pool(request):
+    if request.param == 'threads':
+        from tinyrpc.dispatch import ProcessPool
+        pool = ProcessPool(1)
+    else:
+        from tinyrpc.dispatch.gevent import GeventProcessPool
+        pool = GeventProcessPool(1)
+
+    request.addfinalizer(pool.close)
+    return pool
+
+
+def test_cpu_bound_marking():
+    @public(cpu_bound=True)
+    def foo():
+        pass
+
+    @public
+    def bar():
+        pass
+
+    assert foo._rpc_cpu_bound
+    assert not hasattr(bar, '_rpc_cpu_bound')
+
+
+def test_cpu_bound_methods_run_in_process_pool(process_pool):
+    import os
+
+    dispatch = RPCDispatcher(process_pool=process_pool)
+    dispatch.add_method(_worker_pid, 'cpu_pid', cpu_bound=True)
+    dispatch.add_method(os.getpid, 'pid')
+
+    request = mock_request('cpu_pid', args=[False])
+    dispatch.dispatch(request)
+    worker_pid = request.respond.call_args[0][0]
+
+    request = mock_request('pid', args=[])
+    request.args = []
+    dispatch.dispatch(request)
+    local_pid = request.respond.call_args[0][0]
+
+    assert local_pid == os.getpid()
+    assert worker_pid != local_pid
+
+
+def test_cpu_bound_method_errors_are_responded(process_pool):
+    dispatch = RPCDispatcher(process_pool=process_pool)
+    dispatch.add_method(_worker_pid, 'cpu_pid', cpu_bound=True)
+
+    request = mock_request('cpu_pid', args=[True])
+    dispatch.dispatch(request)
+
+    error = request.error_respond.call_args[0][0]
+    assert isinstance(error, ValueError)
+
+
+def test_cpu_bound_methods_run_directly_without_pool(dispatch):
+    import os
+
+    dispatch.add_method(_worker_pid, 'cpu_pid', cpu_bound=True)
+
+    request = mock_request('cpu_pid', args=[False])
+    dispatch.dispatch(request)
+
+    assert request.respond.call_args[0][0] == os.getpid()
+
+
+class _Worker(object):
+    def __init__(self, offset):
+        self.offset = offset
+
+    @public(cpu_bound=True)
+    def pid_plus(self, value):
+        import os
+        return os.getpid() + self.offset + value
+
+
+def test_cpu_bound_instance_methods_run_in_process_pool(process_pool):
+    import os
+
+    dispatch = RPCDispatcher(process_pool=process_pool)
+    dispatch.register_instance(_Worker(10), 'worker.')
+
+    request = mock_request('worker.pid_plus', args=[5])
+    dispatch.dispatch(request)
+    result = request.respond.call_args[0][0]
+
+    assert result - 15 != os.getpid()
+
+
+def test_cpu_bound_marking_is_kept_per_dispatcher(process_pool):
+    import os
+
+    cpu_dispatch = RPCDispatcher(process_pool=process_pool)
+    cpu_dispatch.add_method(_worker_pid, 'pid', cpu_bound=True)
+    direct_dispatch = RPCDispatcher(process_pool=process_pool)
+    direct_dispatch.add_method(_worker_pid, 'pid')
+
+    assert not hasattr(_worker_pid, '_rpc_cpu_bound')
+
+    request = mock_request('pid', args=[False])
+    direct_dispatch.dispatch(request)
+    assert request.respond.call_args[0][0] == os.getpid()
+
+    request = mock_request('pid', args=[False])
+    cpu_dispatch.dispatch(request)
+    assert request.respond.call_args[0][0] != os.getpid()
+
+
+def test_cpu_bound_methods_of_subdispatchers_run_in_process_pool(
+        process_pool):
+    import os
+
+    dispatch = RPCDispatcher(process_pool=process_pool)
+    subdispatch = RPCDispatcher()
+    subdispatch.add_method(_worker_pid, 'pid', cpu_bound=True)
+    dispatch.add_subdispatch(subdispatch, 'sub.')
+
+    request = mock_request('sub.pid', args=[False])
+    dispatch.dispatch(request)
+
+    assert request.respond.call_args[0][0] != os.getpid()
+
+
+def test_unpicklable_cpu_bound_methods_are_rejected(dispatch):
+    with pytest.raises(RPCError):
+        dispatch.add_method(lambda: None, 'lambda', cpu_bound=True)
+
+    with pytest.raises(KeyError):
+        dispatch.get_method('lambda')
+
+
+def test_subdispatcher_methods_added_after_registration(dispatch,
+                                                        subdispatch):
+    dispatch.add_subdispatch(subdispatch, 'sub.')
+
+    with pytest.raises(KeyError):
+        dispatch.get_method('sub.foo')
+
+    @subdispatch.public
+    def foo():
+        pass
+
+    assert dispatch.get_method('sub.foo') == foo
+
+
+def test_nested_subdispatchers_are_invalidated(dispatch, subdispatch):
+    nested = RPCDispatcher()
+    subdispatch.add_subdispatch(nested, 'nested.')
+    dispatch.add_subdispatch(subdispatch, 'sub.')
+
+    with pytest.raises(KeyError):
+        dispatch.get_method('sub.nested.foo')
+
+    @nested.public
+    def foo():
+        pass
+
+    assert dispatch.get_method('sub.nested.foo') == foo
+
+
+def test_own_methods_take_precedence_over_subdispatchers(dispatch,
+                                                         subdispatch):
+    @subdispatch.public(name='foo')
+    def subfoo():
+        pass
+
+    dispatch.add_subdispatch(subdispatch, 'sub.')
+
+    @dispatch.public(name='sub.foo')
+    def foo():
+        pass
+
+    assert dispatch.get_method('sub.foo') == foo
+
+
+def test_first_subdispatcher_takes_precedence(dispatch):
+    first = RPCDispatcher()
+    second = RPCDispatcher()
+
+    @first.public
+    def foo():
+        pass
+
+    @second.public(name='foo')
+    def other_foo():
+        pass
+
+    @second.public
+    def bar():
+        pass
+
+    dispatch.add_subdispatch(first, 'x.')
+    dispatch.add_subdispatch(second, 'x.')
+
+    assert dispatch.get_method('x.foo') == foo
+    assert dispatch.get_method('x.bar') == bar
+
+
+@pytest.fixture(params=['greenlets', 'threads'])
+def batch_pool(request):
+    if request.param == 'greenlets':
+        import gevent.pool
+        return gevent.pool.Pool(10)
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(10)
+    request.addfinalizer(pool.terminate)
+    return pool
+
+
+def test_batch_dispatch_with_pool_keeps_order(batch_pool):
+    import time
+    import gevent
+
+    dispatch = RPCDispatcher(batch_pool=batch_pool)
+    sleep = gevent.sleep if hasattr(batch_pool, 'spawn') else time.sleep
+
+    @dispatch.public
+    def delayed(delay):
+        sleep(delay)
+        return delay
+
+    batch_request = RPCBatchRequest()
+    delays = [0.2, 0.1, 0.2, 0, 0.1]
+    for delay in delays:
+        req = mock_request('delayed', args=[delay])
+        req.respond = lambda result: result
+        batch_request.append(req)
+    batch_request.create_batch_response = lambda: RPCBatchResponse()
+
+    start = time.time()
+    response = dispatch.dispatch(batch_request)
+
+    assert time.time() - start < sum(delays)
+    assert response == delays
+
+
+def test_batch_stream_dispatch(batch_pool):
+    import json
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+
+    dispatch = RPCDispatcher(batch_pool=batch_pool)
+
+    @dispatch.public
+    def double(value):
+        return 2 * value
+
+    data = json.dumps([{'jsonrpc': '2.0', 'method': 'double', 'params': [i],
+                        'id': i} for i in xrange(1, 11)])
+    chunks = [data[i:i + 7] for i in xrange(0, len(data), 7)]
+
+    response = dispatch.dispatch(
+        JSONRPCProtocol().parse_request_stream(chunks)
+    )
+
+    assert [rep.result for rep in response] == range(2, 22, 2)
+
+
+def test_batch_stream_dispatch_raises_parse_errors(batch_pool):
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol, JSONRPCParseError
+
+    dispatch = RPCDispatcher(batch_pool=batch_pool)
+    stream = JSONRPCProtocol().parse_request_stream(
+        ['[{"jsonrpc": "2.0", "method": "foo", "id": 1}, ', 'garbage]']
+    )
+
+    with pytest.raises(JSONRPCParseError):
+        dispatch.dispatch(stream)
+
+
+MIXED_BATCH = ('[{"jsonrpc": "2.0", "method": "double", "params": [1], '
+               '"id": 1}, {"foo": 1}, {"jsonrpc": "2.0", '
+               '"method": "double", "params": [2]}, {"jsonrpc": "2.0", '
+               '"method": "double", "params": [3], "id": 3}]')
+
+
+@pytest.mark.parametrize('streamed', [False, True])
+def test_batch_with_invalid_requests_and_notifications(batch_pool, streamed):
+    import json
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+
+    dispatch = RPCDispatcher(batch_pool=batch_pool)
+    calls = []
+
+    @dispatch.public
+    def double(value):
+        calls.append(value)
+        return 2 * value
+
+    protocol = JSONRPCProtocol()
+    if streamed:
+        request = protocol.parse_request_stream(
+            [MIXED_BATCH[i:i + 7] for i in xrange(0, len(MIXED_BATCH), 7)]
+        )
+    else:
+        request = protocol.parse_request(MIXED_BATCH)
+
+    response = json.loads(dispatch.dispatch(request).serialize())
+
+    assert sorted(calls) == [1, 2, 3]
+    assert [rep.get('result') for rep in response] == [2, None, 6]
+    assert response[1]['error']['code'] == -32600
+
+
+def test_dispatch_iter_answers_invalid_requests(batch_pool):
+    import json
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+
+    dispatch = RPCDispatcher(batch_pool=batch_pool)
+
+    @dispatch.public
+    def double(value):
+        return 2 * value
+
+    request = JSONRPCProtocol().parse_request_stream([MIXED_BATCH])
+    chunks = request.create_batch_response_stream(
+        dispatch.dispatch_iter(request)
+    ).serialize_iter()
+    response = json.loads(''.join(chunks))
+
+    assert [rep.get('id') for rep in response] == [1, None, 3]
+    assert response[1]['error']['code'] == -32600
+
+
+def test_dispatch_iter_yields_responses_in_order(batch_pool):
+    import json
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+
+    dispatch = RPCDispatcher(batch_pool=batch_pool)
+
+    @dispatch.public
+    def double(value):
+        return 2 * value
+
+    data = json.dumps([{'jsonrpc': '2.0', 'method': 'double', 'params': [i],
+                        'id': i} for i in xrange(1, 11)])
+    responses = dispatch.dispatch_iter(JSONRPCProtocol().parse_request(data))
+
+    assert [rep.result for rep in responses] == range(2, 22, 2)
+
+
+def test_dispatch_iter_raises_parse_errors_after_responses():
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol, JSONRPCParseError
+
+    dispatch = RPCDispatcher()
+
+    @dispatch.public
+    def foo():
+        return 'foo'
+
+    responses = dispatch.dispatch_iter(JSONRPCProtocol().parse_request_stream(
+        ['[{"jsonrpc": "2.0", "method": "foo", "id": 1}, ', 'garbage]']
+    ))
+
+    assert next(responses).result == 'foo'
+    with pytest.raises(JSONRPCParseError):
+        next(responses)
+
+
+def test_hooks_are_called_around_dispatch(dispatch, mock_request):
+    from tinyrpc.dispatch import OUTCOME_OK
+
+    calls = []
+    dispatch.add_method(lambda a, b: a - b, 'subtract')
+    dispatch.add_hook(
+        pre_dispatch=lambda req: calls.append(('pre', req)),
+        post_dispatch=lambda req, rep, outcome, seconds: calls.append(
+            ('post', req, rep, outcome, seconds >= 0)
+        ),
+    )
+
+    response = dispatch.dispatch(mock_request)
+
+    mock_request.respond.assert_called_with(-2)
+    assert calls == [('pre', mock_request),
+                     ('post', mock_request, response, OUTCOME_OK, True)]
+
+
+@pytest.mark.parametrize('method, outcome', [
+    ('missing', 'not_found'),
+    ('fail', 'method_error'),
+])
+def test_post_dispatch_hooks_receive_outcome(dispatch, mock_request, method,
+                                             outcome):
+    @dispatch.public
+    def fail(a, b):
+        raise ValueError()
+
+    outcomes = []
+    dispatch.add_hook(post_dispatch=lambda req, rep, outcome, seconds:
+                      outcomes.append(outcome))
+    mock_request.method = method
+
+    dispatch.dispatch(mock_request)
+
+    assert outcomes == [outcome]
+
+
+def test_failing_hooks_cause_server_errors(dispatch, mock_request):
+    from tinyrpc.exc import ServerError
+
+    def hook(request):
+        raise RuntimeError()
+
+    dispatch.add_method(lambda a, b: a - b, 'subtract')
+    dispatch.add_hook(pre_dispatch=hook)
+
+    dispatch.dispatch(mock_request)
+
+    assert not mock_request.respond.called
+    assert isinstance(mock_request.error_respond.call_args[0][0], ServerError)
+
+
+def test_hooks_run_for_requests_of_batches(batch_pool):
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+
+    dispatch = RPCDispatcher(batch_pool=batch_pool)
+    dispatch.add_method(lambda: 'x', 'x')
+    methods = []
+    dispatch.add_hook(pre_dispatch=lambda req: methods.append(req.method))
+
+    protocol = JSONRPCProtocol()
+    batch = protocol.create_batch_request(
+        [protocol.create_request('x') for _ in xrange(3)]
+    )
+    dispatch.dispatch(batch)
+
+    assert methods == ['x'] * 3
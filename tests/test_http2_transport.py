@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+import gevent
+import gevent.queue
+from gevent.server import StreamServer
+
+pytest.importorskip('h2')
+
+from tinyrpc.transports.http2 import Http2ServerTransport, \
+    Http2ClientTransport
+
+
+@pytest.fixture()
+def http2_server(request):
+    transport = Http2ServerTransport(queue_class=gevent.queue.Queue,
+                                     max_concurrent_streams=5)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    request.addfinalizer(server.stop)
+
+    return transport, 'http://%s:%d/rpc' % server.address
+
+
+@pytest.fixture()
+def client(request, http2_server):
+    transport, addr = http2_server
+    client = Http2ClientTransport(addr, timeout=5)
+
+    request.addfinalizer(client.close)
+
+    return client
+
+
+def _echo_replies(transport):
+    while True:
+        context, msg = transport.receive_message()
+        transport.send_reply(context, 'reply:' + msg)
+
+
+@pytest.mark.parametrize('msg', ['foo', '', '\x00\r\n', 'x' * 200000],
+                         ids=['short', 'empty', 'binary', 'large'])
+def test_server_receives_messages(http2_server, client, msg):
+    transport, addr = http2_server
+    gevent.spawn(_echo_replies, transport)
+
+    assert client.send_message(msg) == 'reply:' + msg
+
+
+def test_sequential_calls_do_not_wait_for_delayed_acks(http2_server, client):
+    transport, addr = http2_server
+    gevent.spawn(_echo_replies, transport)
+
+    # without TCP_NODELAY every call waits about 40 ms for the delayed ACK
+    start = time.time()
+    for i in xrange(20):
+        assert client.send_message(str(i)) == 'reply:%d' % i
+    assert time.time() - start < 0.5
+
+
+def test_requests_share_one_connection(http2_server, client):
+    transport, addr = http2_server
+    gevent.sleep(0.01)  # the settings of the server have to arrive first
+
+    calls = [gevent.spawn(client.send_message, str(i)) for i in xrange(20)]
+    received = [transport.receive_message() for _ in xrange(5)]
+
+    # no more streams than the server allows are in flight
+    gevent.sleep(0.01)
+    assert transport.messages.empty()
+
+    for context, msg in reversed(received):
+        transport.send_reply(context, 'reply:' + msg)
+    gevent.spawn(_echo_replies, transport)
+
+    gevent.joinall(calls, timeout=5)
+    assert [call.value for call in calls] == \
+        ['reply:%d' % i for i in xrange(20)]
+    assert len(set(id(context.connection) for context, msg in received)) == 1
+
+
+def test_replies_arrive_out_of_order(http2_server, client):
+    transport, addr = http2_server
+
+    client.send_message('slow', expect_reply=False)
+    client.send_message('fast', expect_reply=False)
+    slow_context, slow_msg = transport.receive_message()
+    fast_context, fast_msg = transport.receive_message()
+
+    transport.send_reply(fast_context, 'reply:' + fast_msg)
+    assert client.receive_reply() == 'reply:fast'
+
+    transport.send_reply(slow_context, 'reply:' + slow_msg)
+    assert client.receive_reply() == 'reply:slow'
+
+
+def test_server_sends_streamed_replies(http2_server, client):
+    transport, addr = http2_server
+
+    def consumer():
+        context, msg = transport.receive_message()
+        transport.send_reply_stream(context, iter(['[1', ',2', ']']))
+
+    gevent.spawn(consumer)
+
+    assert client.send_message('[]') == '[1,2]'
+
+
+def test_pending_calls_fail_when_connection_closes(http2_server, client):
+    transport, addr = http2_server
+
+    call = gevent.spawn(client.send_message, 'foo')
+    context, msg = transport.receive_message()
+    context.connection.close()
+
+    with pytest.raises(IOError):
+        call.get(timeout=1)
+
+
+def _raw_post(address, chunks, headers=()):
+    # sends a request without content-length, returns the response status
+    import h2.config
+    import h2.connection
+    import h2.events
+    from gevent import socket
+
+    sock = socket.create_connection(address)
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(
+        header_encoding='utf-8'
+    ))
+    conn.initiate_connection()
+    stream_id = conn.get_next_available_stream_id()
+    conn.send_headers(stream_id, [
+        (':method', 'POST'), (':scheme', 'http'),
+        (':authority', 'localhost'), (':path', '/'),
+    ] + list(headers))
+    for chunk in chunks:
+        conn.send_data(stream_id, chunk)
+    sock.sendall(conn.data_to_send())
+
+    status = None
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return status
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.ResponseReceived):
+                    status = dict(event.headers)[':status']
+                elif isinstance(event, (h2.events.StreamEnded,
+                                        h2.events.StreamReset)):
+                    return status
+            sock.sendall(conn.data_to_send())
+    finally:
+        sock.close()
+
+
+@pytest.fixture()
+def limited_server(request):
+    transport = Http2ServerTransport(queue_class=gevent.queue.Queue,
+                                     max_content_length=1000)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    request.addfinalizer(server.stop)
+
+    return transport, server.address
+
+
+def test_server_refuses_large_content_length(limited_server):
+    transport, address = limited_server
+
+    status = gevent.spawn(_raw_post, address, [],
+                          [('content-length', '1001')]).get(timeout=1)
+
+    assert status == '413'
+    assert transport.messages.empty()
+
+
+def test_server_refuses_large_bodies(limited_server):
+    transport, address = limited_server
+
+    status = gevent.spawn(_raw_post, address,
+                          ['x' * 600, 'x' * 600]).get(timeout=1)
+
+    assert status == '413'
+    assert transport.messages.empty()
+
+
+def test_refused_streams_leave_connection_usable(limited_server):
+    transport, address = limited_server
+    gevent.spawn(_echo_replies, transport)
+    client = Http2ClientTransport('http://%s:%d/' % address, timeout=1)
+
+    try:
+        # the body is dropped, the stream ends without a reply
+        assert client.send_message('x' * 1001) == ''
+        assert client.send_message('x' * 1000) == 'reply:' + 'x' * 1000
+    finally:
+        client.close()
+
+
+def test_multiplexed_client():
+    import gevent.event
+    from tinyrpc.client import RPCClientMultiplexed
+    from tinyrpc.dispatch import RPCDispatcher
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+    from tinyrpc.server.gevent import RPCServerGreenlets
+
+    dispatcher = RPCDispatcher()
+
+    @dispatcher.public
+    def sleep_and_echo(delay, value):
+        gevent.sleep(delay)
+        return value
+
+    transport = Http2ServerTransport(queue_class=gevent.queue.Queue)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+    rpc_server = RPCServerGreenlets(transport, JSONRPCProtocol(), dispatcher)
+    server_greenlet = gevent.spawn(rpc_server.serve_forever)
+
+    client_transport = Http2ClientTransport('http://%s:%d/' % server.address)
+    client = RPCClientMultiplexed(JSONRPCProtocol(), client_transport,
+                                  result_class=gevent.event.AsyncResult)
+    receiver = gevent.spawn(client.receive_forever)
+
+    try:
+        slow = client.call_async('sleep_and_echo', [0.2, 'slow'], None)
+        fast = client.call_async('sleep_and_echo', [0, 'fast'], None)
+
+        assert fast.get(timeout=1) == 'fast'
+        assert not slow.ready()
+        assert slow.get(timeout=1) == 'slow'
+    finally:
+        receiver.kill()
+        client_transport.close()
+        server_greenlet.kill()
+        server.stop()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import pytest
+
+from tinyrpc.transports.http import HttpPostClientTransport
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        reply = 'reply:' + body
+        self.server.ports.add(self.client_address[1])
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture()
+def http_server(request):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+    server.ports = set()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def fin():
+        server.shutdown()
+        server.server_close()
+
+    request.addfinalizer(fin)
+    return server, 'http://%s:%d/' % server.server_address
+
+
+def test_client_reuses_connections(http_server):
+    server, addr = http_server
+    transport = HttpPostClientTransport(addr)
+
+    for i in xrange(5):
+        assert transport.send_message('%d' % i) == 'reply:%d' % i
+
+    assert len(server.ports) == 1
+    transport.close()
+
+
+def test_client_closes_connections_without_keep_alive(http_server):
+    server, addr = http_server
+    transport = HttpPostClientTransport(addr, keep_alive=False)
+
+    for i in xrange(3):
+        assert transport.send_message('%d' % i) == 'reply:%d' % i
+
+    assert len(server.ports) == 3
+
+
+def test_client_is_shared_across_threads(http_server):
+    server, addr = http_server
+    transport = HttpPostClientTransport(addr, pool_size=4)
+    replies = []
+
+    def call(i):
+        for j in xrange(10):
+            replies.append(transport.send_message('%d.%d' % (i, j)))
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in xrange(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(replies) == sorted('reply:%d.%d' % (i, j)
+                                     for i in xrange(4) for j in xrange(10))
+    assert len(server.ports) <= 4
+    transport.close()
+
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from tinyrpc.protocols.ids import CounterIdGenerator, PrefixedIdGenerator
+from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+from tinyrpc.protocols.stratum import StratumRPCProtocol
+
+
+@pytest.fixture(params=['counter', 'prefixed'])
+def generator(request):
+    if request.param == 'counter':
+        return CounterIdGenerator()
+    return PrefixedIdGenerator()
+
+
+def test_generators_are_thread_safe(generator):
+    ids = []
+
+    def generate():
+        ids.extend([generator() for _ in xrange(10000)])
+
+    threads = [threading.Thread(target=generate) for _ in xrange(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(ids)) == 80000
+
+
+def test_counter_generates_consecutive_ids():
+    generator = CounterIdGenerator(5)
+
+    assert [generator(), generator()] == [5, 6]
+    assert generator.value == 6
+    assert generator() == 7
+
+
+def test_prefixed_ids_differ_between_processes(monkeypatch):
+    generator = PrefixedIdGenerator()
+    first = generator()
+
+    assert 0 <= first < 2 ** 63
+    assert generator() == first + 1
+
+    import os
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    assert generator() >> 32 != first >> 32
+
+
+@pytest.mark.parametrize('protocol_class',
+                         [JSONRPCProtocol, StratumRPCProtocol])
+def test_protocols_use_id_generator(protocol_class):
+    protocol = protocol_class(id_generator=iter(['a', 'b']).next)
+
+    assert protocol.create_request('foo').unique_id == 'a'
+    assert protocol.create_request('foo', one_way=True).unique_id is None
+    assert protocol.create_request('foo').unique_id == 'b'
+
+
+@pytest.mark.parametrize('protocol_class',
+                         [JSONRPCProtocol, StratumRPCProtocol])
+def test_protocols_id_counter_can_be_set(protocol_class):
+    protocol = protocol_class()
+    protocol.create_request('foo')
+    assert protocol._id_counter == 1
+
+    protocol._id_counter = 41
+    assert protocol.create_request('foo').unique_id == 42
+    assert protocol._id_counter == 42
+
+
+@pytest.mark.parametrize('protocol_class',
+                         [JSONRPCProtocol, StratumRPCProtocol])
+@pytest.mark.parametrize('id_generator', [PrefixedIdGenerator(),
+                                          iter(['a', 'b']).next])
+def test_protocols_id_counter_requires_counter(protocol_class, id_generator):
+    protocol = protocol_class(id_generator=id_generator)
+
+    with pytest.raises(TypeError):
+        protocol._id_counter
+    with pytest.raises(TypeError):
+        protocol._id_counter = 41
+    assert protocol.id_generator is id_generator
+
+
+def test_counter_value_before_first_id():
+    assert CounterIdGenerator(5).value == 4
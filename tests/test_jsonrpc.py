@@ -11,7 +11,8 @@ from tinyrpc.protocols.jsonrpc import JSONRPCParseError, \
                                       JSONRPCInvalidRequestError, \
                                       JSONRPCMethodNotFoundError, \
                                       JSONRPCInvalidParamsError, \
-                                      JSONRPCInternalError
+                                      JSONRPCInternalError, \
+                                      JSONRPCBatchResponse
 
 
 def _json_equal(a, b):
@@ -83,6 +84,47 @@ def test_parsing_invalid_arguments(prot):
         )
 
 
+@pytest.mark.parametrize('invalid_request', [
+    '1',
+    '"subtract"',
+    '{"jsonrpc": "2.0", "method": "subtract", "foo": 1}',
+    '{"jsonrpc": "2.0", "params": [1, 2], "id": 1}',
+    '{"jsonrpc": "1.0", "method": "subtract", "id": 1}',
+    '{"method": "subtract", "id": 1}',
+    '{"jsonrpc": "2.0", "method": 1, "id": 1}',
+])
+def test_parsing_invalid_requests(prot, invalid_request):
+    with pytest.raises(JSONRPCInvalidRequestError):
+        prot.parse_request(invalid_request)
+
+
+@pytest.mark.parametrize('invalid_reply', [
+    '[]',
+    '{"jsonrpc": "2.0", "result": 19, "id": 1, "foo": 1}',
+    '{"result": 19, "id": 1}',
+    '{"jsonrpc": "1.0", "result": 19, "id": 1}',
+    '{"jsonrpc": "2.0", "result": 19}',
+    '{"jsonrpc": "2.0", "id": 1}',
+])
+def test_parsing_invalid_replies(prot, invalid_reply):
+    with pytest.raises(InvalidReplyError):
+        prot.parse_reply(invalid_reply)
+
+
+def test_parsing_batch_reply(prot):
+    reply = prot.parse_reply(
+        '[{"jsonrpc": "2.0", "result": 19, "id": 1}, '
+        '{"jsonrpc": "2.0", "error": {"code": -32601, '
+        '"message": "Method not found"}, "id": 2}]'
+    )
+
+    assert isinstance(reply, JSONRPCBatchResponse)
+    assert reply[0].unique_id == 1
+    assert reply[0].result == 19
+    assert reply[1].unique_id == 2
+    assert reply[1].error == 'Method not found'
+
+
 @pytest.mark.parametrize(('data', 'id', 'result'), [
     ("""{"jsonrpc": "2.0", "result": 19, "id": 1}""",
      1,
@@ -199,6 +241,128 @@ def test_batch_good_examples(prot):
     assert results[5].unique_id == "9"
 
 
+BATCH_DATA = json.dumps(
+    [{'jsonrpc': '2.0', 'method': 'a"]\\', 'params': [i, {'b': '[,{'}],
+      'id': i} for i in xrange(1, 6)] +
+    [1, {'foo': 'boo'}, {'jsonrpc': '2.0', 'method': 'notify'}]
+)
+
+
+def _chunked(data, size):
+    return [data[i:i + size] for i in xrange(0, len(data), size)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 100000])
+def test_batch_stream_matches_batch(prot, chunk_size):
+    expected = prot.parse_request(BATCH_DATA)
+    results = list(prot.parse_request_stream(_chunked(BATCH_DATA,
+                                                      chunk_size)))
+
+    assert len(results) == len(expected)
+    for result, req in zip(results, expected):
+        assert type(result) == type(req)
+        if isinstance(req, Exception):
+            continue
+        assert (result.method, result.args, result.unique_id) == \
+            (req.method, req.args, req.unique_id)
+
+
+def test_batch_stream_yields_requests_while_reading(prot):
+    chunks = _chunked(BATCH_DATA, 10)
+    read = []
+
+    def reader():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    stream = prot.parse_request_stream(reader())
+    first = next(iter(stream))
+
+    assert first.unique_id == 1
+    assert len(read) < len(chunks)
+
+
+@pytest.mark.parametrize('data', ['[', '[1,]', '[,1]', '[1] x', '[{"a": tru}]',
+                                  '[1 2]', '[}', '[{"a": 1]'])
+def test_batch_stream_raises_parse_errors(prot, data):
+    with pytest.raises(JSONRPCParseError):
+        list(prot.parse_request_stream(_chunked(data, 2)))
+
+
+def test_batch_stream_empty_array(prot):
+    with pytest.raises(JSONRPCInvalidRequestError):
+        list(prot.parse_request_stream(['[ ', ' ]']))
+
+
+def test_batch_stream_of_notifications_expects_no_response(prot):
+    stream = prot.parse_request_stream(
+        ['[{"jsonrpc": "2.0", "method": "a"}, ',
+         '{"jsonrpc": "2.0", "method": "b"}]']
+    )
+
+    assert len(list(stream)) == 2
+    assert stream.create_batch_response() is None
+
+
+def _respond_all(batch):
+    return [None if isinstance(req, Exception) or req.unique_id is None
+            else req.respond(req.method) for req in batch]
+
+
+def test_batch_response_stream_matches_batch_response(prot):
+    batch = prot.parse_request(BATCH_DATA)
+    response = batch.create_batch_response()
+    response.extend(
+        req.error_respond() if isinstance(req, Exception) else resp
+        for req, resp in zip(batch, _respond_all(batch))
+    )
+    stream = batch.create_batch_response_stream(iter(response))
+
+    chunks = list(stream.serialize_iter())
+
+    assert json.loads(''.join(chunks)) == json.loads(response.serialize())
+    assert len(chunks) == len([r for r in response if r is not None]) + 1
+
+
+def test_batch_response_stream_without_responses(prot):
+    batch = prot.parse_request('[{"jsonrpc": "2.0", "method": "a"}]')
+    stream = batch.create_batch_response_stream(iter(_respond_all(batch)))
+
+    assert list(stream.serialize_iter()) == []
+
+
+def _respond_stream(prot, chunks):
+    batch = prot.parse_request_stream(chunks)
+    responses = (req.respond(req.method) for req in batch)
+    return json.loads(
+        batch.create_batch_response_stream(responses).serialize()
+    )
+
+
+def test_batch_response_stream_appends_parse_errors(prot):
+    reply = _respond_stream(
+        prot, ['[{"jsonrpc": "2.0", "method": "a", "id": 1}, ', 'garbage]']
+    )
+
+    assert reply[0]['result'] == 'a'
+    assert reply[1]['error']['code'] == -32700
+
+
+def test_batch_response_stream_sends_early_errors_alone(prot):
+    reply = _respond_stream(prot, ['[garbage]'])
+
+    assert reply['error']['code'] == -32700
+
+
+def test_request_stream_parses_single_requests(prot):
+    req = prot.parse_request_stream(
+        ['  ', '{"jsonrpc": "2.0", ', '"method": "foo", "id": 1}']
+    )
+
+    assert (req.method, req.unique_id) == ('foo', 1)
+
+
 def test_unique_ids(prot):
     req1 = prot.create_request('foo', [1, 2])
     req2 = prot.create_request('foo', [1, 2])
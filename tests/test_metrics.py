@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from tinyrpc.dispatch import RPCDispatcher
+from tinyrpc.dispatch.metrics import LatencyHistogram, DispatchMetrics
+from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+
+
+@pytest.mark.parametrize('microseconds', [0, 1, 255, 256, 1000, 123456,
+                                          10 ** 9])
+def test_histogram_error_is_below_one_percent(microseconds):
+    histogram = LatencyHistogram()
+    histogram.record(microseconds / 1e6)
+
+    value = histogram.percentile(0.5) * 1e6
+    assert microseconds <= value <= microseconds * 1.01 + 1
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for microseconds in xrange(1, 1001):
+        histogram.record(microseconds / 1e6)
+
+    assert histogram.count == 1000
+    assert abs(histogram.percentile(0.5) - 500e-6) < 5e-6
+    assert abs(histogram.percentile(0.99) - 990e-6) < 10e-6
+    assert histogram.percentile(1.0) >= 1000e-6
+    assert len(histogram.counts) < 1000
+    assert LatencyHistogram().percentile(0.5) is None
+
+
+@pytest.fixture
+def metrics():
+    dispatcher = RPCDispatcher()
+    metrics = DispatchMetrics()
+    dispatcher.add_hook(post_dispatch=metrics.record)
+
+    @dispatcher.public('mining.submit')
+    def submit(ok):
+        if not ok:
+            raise ValueError('rejected')
+        return True
+
+    protocol = JSONRPCProtocol()
+    for method, ok in [('mining.submit', True), ('mining.submit', False),
+                       ('mining.submit', True), ('missing', True)]:
+        dispatcher.dispatch(protocol.create_request(method, [ok]))
+
+    return metrics
+
+
+def test_metrics_count_requests_and_errors(metrics):
+    assert metrics.latencies['mining.submit'].count == 3
+    assert metrics.method_errors == {'mining.submit': 1}
+    assert metrics.server_errors == {}
+    assert metrics.not_found == 1
+    assert 'missing' not in metrics.latencies
+
+
+def test_metrics_export_prometheus_text(metrics):
+    text = metrics.export_prometheus()
+    lines = text.splitlines()
+
+    assert '# TYPE tinyrpc_request_seconds summary' in lines
+    assert 'tinyrpc_request_seconds_count{method="mining.submit"} 3' in lines
+    assert any(line.startswith(
+        'tinyrpc_request_seconds{method="mining.submit",quantile="0.99"} ')
+        for line in lines)
+    assert 'tinyrpc_method_errors_total{method="mining.submit"} 1' in lines
+    assert 'tinyrpc_method_not_found_total 1' in lines
+    assert text.endswith('\n')
+
+
+def test_metrics_escape_method_names():
+    metrics = DispatchMetrics()
+    request = JSONRPCProtocol().create_request('say "hi"\n')
+    metrics.record(request, None, 'method_error', 0.001)
+
+    assert 'tinyrpc_method_errors_total{method="say \\"hi\\"\\n"} 1' in \
+        metrics.export_prometheus().splitlines()
+
+
+def test_metrics_wsgi_app(metrics):
+    from werkzeug.test import Client
+    from werkzeug.wrappers import BaseResponse
+
+    response = Client(metrics.wsgi_app, BaseResponse).get('/')
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+    assert response.data == metrics.export_prometheus()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import msgpack
+import pytest
+
+from tinyrpc import InvalidReplyError
+from tinyrpc.protocols.jsonrpc import JSONRPCParseError, \
+    JSONRPCInvalidRequestError
+from tinyrpc.protocols.msgpackrpc import MSGPackRPCProtocol
+
+
+@pytest.fixture
+def prot():
+    return MSGPackRPCProtocol()
+
+
+def _pack(obj):
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def _unpack(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def test_request_roundtrip(prot):
+    req = prot.create_request('subtract', [42, 23])
+    data = req.serialize()
+
+    assert _unpack(data) == {'jsonrpc': '2.0', 'method': 'subtract',
+                             'params': [42, 23], 'id': req.unique_id}
+
+    parsed = prot.parse_request(data)
+    assert parsed.method == 'subtract'
+    assert parsed.args == [42, 23]
+    assert parsed.unique_id == req.unique_id
+
+
+def test_binary_payloads_are_not_encoded(prot):
+    payload = '\x00\xff\n' * 10
+    req = prot.create_request('store', [payload])
+
+    assert payload in req.serialize()
+
+    parsed = prot.parse_request(req.serialize())
+    assert parsed.args == [payload]
+
+    reply = prot.parse_reply(parsed.respond(payload).serialize())
+    assert reply.result == payload
+
+
+def test_error_reply(prot):
+    req = prot.create_request('foo', [])
+    err = req.error_respond(Exception('custom message'))
+
+    data = _unpack(err.serialize())
+    assert data['error'] == {'code': -32000, 'message': 'custom message'}
+
+    reply = prot.parse_reply(err.serialize())
+    assert reply.error == 'custom message'
+
+
+def test_parse_error_is_encoded_with_msgpack(prot):
+    with pytest.raises(JSONRPCParseError) as excinfo:
+        prot.parse_request('\xc1garbage')
+
+    data = _unpack(excinfo.value.error_respond().serialize())
+    assert data['error']['code'] == -32700
+    assert data['id'] is None
+
+
+def test_invalid_request(prot):
+    with pytest.raises(JSONRPCInvalidRequestError):
+        prot.parse_request(_pack({'jsonrpc': '2.0', 'method': 1}))
+
+
+def test_invalid_reply(prot):
+    with pytest.raises(InvalidReplyError):
+        prot.parse_reply(_pack({'result': 1, 'id': 1}))
+
+
+def test_batch(prot):
+    batch = prot.create_batch_request([
+        prot.create_request('foo', [1]),
+        prot.create_request('bar', [2], one_way=True),
+        prot.create_request('baz', kwargs={'a': 'b'}),
+    ])
+
+    parsed = prot.parse_request(batch.serialize())
+    assert [req.method for req in parsed] == ['foo', 'bar', 'baz']
+
+    response = parsed.create_batch_response()
+    response.extend(req.respond(req.method) for req in parsed)
+
+    data = _unpack(response.serialize())
+    assert [rep['result'] for rep in data] == ['foo', 'baz']
+    assert [rep['id'] for rep in data] == [batch[0].unique_id,
+                                           batch[2].unique_id]
+
+
+def test_envelope_is_encoded_as_text(prot):
+    req = prot.create_request('echo', ['\x00\xff'])
+    data = req.serialize()
+
+    # names, version and method are strings (0xa0 + length), binary
+    # arguments stay binary (0xc4, length)
+    for text in ['jsonrpc', '2.0', 'method', 'echo', 'params', 'id']:
+        assert chr(0xa0 + len(text)) + text in data
+    assert data.count('\xc4') == 1
+    assert '\xc4\x02\x00\xff' in data
+
+    # strings are unpacked as unicode, binary as str
+    message = _unpack(data)
+    assert all(isinstance(key, unicode) for key in message)
+    assert isinstance(message['method'], unicode)
+    assert isinstance(message['jsonrpc'], unicode)
+    assert isinstance(message['params'][0], str)
+
+    error = _unpack(req.error_respond(Exception('failed')).serialize())
+    assert isinstance(error['error']['message'], unicode)
+    assert all(isinstance(key, unicode) for key in error['error'])
+
+    batch = prot.create_batch_request([req]).serialize()
+    assert '\xa7jsonrpc' in batch
+    assert batch.count('\xc4') == 1
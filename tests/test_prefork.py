@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+import socket
+import time
+
+import pytest
+
+import gevent
+import gevent.queue
+from gevent.server import StreamServer
+
+from tinyrpc.dispatch import RPCDispatcher
+from tinyrpc.protocols.stratum import StratumRPCProtocol
+from tinyrpc.server.gevent import RPCServerGreenlets
+from tinyrpc.server.prefork import PreforkServer, create_listener
+from tinyrpc.transports.tcp import StreamServerTransport, \
+    StreamClientTransport
+from tinyrpc import RPCClient
+
+
+def _free_address():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    address = sock.getsockname()
+    sock.close()
+    return address
+
+
+def _factory(listener):
+    dispatcher = RPCDispatcher()
+    dispatcher.add_method(os.getpid, 'getpid')
+
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue)
+    rpc_server = RPCServerGreenlets(transport, StratumRPCProtocol(),
+                                    dispatcher)
+    gevent.spawn(rpc_server.serve_forever)
+    return StreamServer(listener, transport.handle)
+
+
+def _wait_for_pids(address, count, timeout=10):
+    pids = set()
+    deadline = time.time() + timeout
+    while len(pids) < count and time.time() < deadline:
+        try:
+            transport = StreamClientTransport(address)
+        except socket.error:
+            time.sleep(0.05)
+            continue
+        client = RPCClient(StratumRPCProtocol(), transport)
+        pids.add(client.call('getpid', [], None))
+        transport.close()
+    return pids
+
+
+def test_create_listener_allows_shared_port():
+    first = create_listener(('127.0.0.1', 0))
+    second = create_listener(first.getsockname())
+
+    assert first.getsockname() == second.getsockname()
+
+    first.close()
+    second.close()
+
+
+@pytest.mark.parametrize('reuse_port', [True, False])
+def test_prefork_server_runs_workers(reuse_port):
+    address = _free_address()
+    server = PreforkServer(_factory, address, workers=2,
+                           reuse_port=reuse_port, graceful_timeout=1)
+
+    supervisor = os.fork()
+    if not supervisor:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+
+    try:
+        pids = _wait_for_pids(address, 2)
+        assert len(pids) == 2
+        assert supervisor not in pids
+
+        # killed workers are replaced
+        os.kill(pids.pop(), signal.SIGKILL)
+        time.sleep(0.5)
+        assert len(_wait_for_pids(address, 2)) == 2
+    finally:
+        os.kill(supervisor, signal.SIGTERM)
+        _, status = os.waitpid(supervisor, 0)
+
+    assert status == 0
+
+
+def _run_supervisor(server):
+    supervisor = os.fork()
+    if not supervisor:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    return supervisor
+
+
+def _stop_supervisor(supervisor):
+    os.kill(supervisor, signal.SIGTERM)
+    _, status = os.waitpid(supervisor, 0)
+    return status
+
+
+def test_prefork_server_restarts_workers_on_sighup():
+    address = _free_address()
+    server = PreforkServer(_factory, address, workers=2, graceful_timeout=5)
+    supervisor = _run_supervisor(server)
+
+    try:
+        old_pids = _wait_for_pids(address, 2)
+        assert len(old_pids) == 2
+
+        # a connection open during the restart is served until closed
+        transport = StreamClientTransport(address)
+        client = RPCClient(StratumRPCProtocol(), transport)
+        draining_pid = client.call('getpid', [], None)
+
+        os.kill(supervisor, signal.SIGHUP)
+        time.sleep(0.5)
+
+        new_pids = _wait_for_pids(address, 2)
+        assert len(new_pids) == 2
+        assert not new_pids & old_pids
+        assert client.call('getpid', [], None) == draining_pid
+        transport.close()
+    finally:
+        status = _stop_supervisor(supervisor)
+
+    assert status == 0
+
+
+def test_prefork_server_stops_gracefully_on_sigint_to_process_group():
+    address = _free_address()
+    server = PreforkServer(_factory, address, workers=2, graceful_timeout=5)
+    supervisor = _run_supervisor(server)
+
+    try:
+        pids = _wait_for_pids(address, 2)
+        assert len(pids) == 2
+
+        transport = StreamClientTransport(address)
+        client = RPCClient(StratumRPCProtocol(), transport)
+        pid = client.call('getpid', [], None)
+
+        # like Ctrl-C, which interrupts the supervisor and its workers
+        for target in [supervisor] + list(pids):
+            os.kill(target, signal.SIGINT)
+        time.sleep(0.5)
+
+        # the open connection is still served while the workers drain
+        assert client.call('getpid', [], None) == pid
+        transport.close()
+    finally:
+        _, status = os.waitpid(supervisor, 0)
+
+    assert status == 0
+
+
+def _failing_factory(listener):
+    raise RuntimeError('factory failed')
+
+
+def test_prefork_server_backs_off_failing_workers(tmpdir):
+    address = _free_address()
+    server = PreforkServer(_failing_factory, address, workers=1)
+    spawned = tmpdir.join('spawned')
+
+    def spawn_worker(slot, spawn=server._spawn_worker):
+        with spawned.open('a') as f:
+            f.write('x')
+        spawn(slot)
+
+    server._spawn_worker = spawn_worker
+    supervisor = _run_supervisor(server)
+
+    try:
+        time.sleep(2)
+    finally:
+        status = _stop_supervisor(supervisor)
+
+    assert status == 0
+    # after 0.1, 0.2, 0.4 and 0.8 seconds, restarting every 0.1 seconds
+    # would spawn about 20 workers
+    assert 3 <= len(spawned.read()) <= 7
+
+
+def test_prefork_server_stats():
+    server = PreforkServer(_factory, ('127.0.0.1', 0), workers=2)
+    server._children = {100: 0, 101: 1}
+    server._retiring = {99: (2, time.time())}
+    server.restarts = 3
+
+    handles = [server._count_connections(lambda: None, slot)
+               for slot in xrange(3)]
+    for handle in [handles[0], handles[0], handles[1], handles[2]]:
+        handle()
+
+    def active_handle():
+        assert server.stats()['active'] == 1
+    server._count_connections(active_handle, 1)()
+
+    stats = server.stats()
+    assert stats['accepted'] == 5
+    assert stats['active'] == 0
+    assert stats['restarts'] == 3
+    assert stats['workers'] == [
+        {'pid': 99, 'retiring': True, 'accepted': 1, 'active': 0},
+        {'pid': 100, 'retiring': False, 'accepted': 2, 'active': 0},
+        {'pid': 101, 'retiring': False, 'accepted': 2, 'active': 0},
+    ]
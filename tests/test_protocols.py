@@ -4,6 +4,7 @@
 import pytest
 
 from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+from tinyrpc.protocols.stratum import StratumRPCProtocol
 from tinyrpc import RPCErrorResponse
 
 
@@ -58,3 +59,111 @@ def test_parses_error_response(protocol):
     parsed = protocol.parse_reply(err_rep.serialize())
 
     assert hasattr(parsed, 'error')
+
+
+def test_success_response_has_no_error(protocol):
+    req = protocol.create_request('foo', ['bar'])
+
+    assert not hasattr(req.respond(42), 'error')
+    assert not hasattr(protocol.parse_reply(req.respond(42).serialize()),
+                       'error')
+
+
+def test_messages_have_no_instance_dict(protocol):
+    req = protocol.create_request('foo', ['bar'])
+
+    for obj in (req, req.respond(42), req.error_respond(Exception('foo'))):
+        assert not hasattr(obj, '__dict__')
+
+
+def test_requests_do_not_share_defaults(protocol):
+    first = protocol.create_request('foo')
+    second = protocol.create_request('foo')
+
+    first.args.append('bar')
+    first.kwargs['bar'] = 'baz'
+
+    assert second.args == []
+    assert second.kwargs == {}
+
+
+@pytest.fixture(params=['ujson', 'json'])
+def codec(request):
+    from tinyrpc.protocols.codec import get_codec
+    return get_codec(request.param)
+
+
+@pytest.fixture(params=['jsonrpc', 'stratum'])
+def codec_protocol(request, codec):
+    if request.param == 'jsonrpc':
+        return JSONRPCProtocol(codec=codec)
+    return StratumRPCProtocol(codec=codec)
+
+
+def test_get_codec_falls_back():
+    from tinyrpc.protocols.codec import get_codec, JSONCodec
+
+    codec = get_codec(['orjson', 'ujson'])
+    assert isinstance(codec, JSONCodec)
+    assert codec.name in ('orjson', 'ujson')
+    assert get_codec(codec) is codec
+
+
+def test_get_codec_rejects_unknown_names():
+    from tinyrpc.protocols.codec import get_codec
+
+    with pytest.raises(ValueError):
+        get_codec('yaml')
+
+
+def test_codec_roundtrip(codec_protocol, codec):
+    req = codec_protocol.create_request('foo', ['bar', {'baz': 1}])
+    data = req.serialize()
+    assert codec.loads(data)['method'] == 'foo'
+
+    parsed = codec_protocol.parse_request(data)
+    assert parsed.args == ['bar', {'baz': 1}]
+    assert parsed._codec is codec
+
+    rep = parsed.respond(['result', 42])
+    assert codec_protocol.parse_reply(rep.serialize()).result == \
+        ['result', 42]
+
+    err_rep = parsed.error_respond(Exception('foo'))
+    assert hasattr(codec_protocol.parse_reply(err_rep.serialize()), 'error')
+
+
+def test_get_codec_shares_instances():
+    from tinyrpc.protocols.codec import get_codec
+
+    assert get_codec('json') is get_codec('json')
+
+
+@pytest.mark.parametrize('unique_id', [1, 'abc', u'ሴ'])
+@pytest.mark.parametrize('result', [None, 1, 1.5, 'a"b', u'ሴ',
+                                    {'a': [1, {'b': None}]}])
+def test_split_response_encoding_matches(codec_protocol, codec,
+                                             unique_id, result):
+    req = codec_protocol.create_request('foo')
+    req.unique_id = unique_id
+    rep = req.respond(result)
+
+    expected = codec.dumps(rep._to_dict())
+    if isinstance(codec_protocol, StratumRPCProtocol):
+        expected += '\n'
+
+    assert rep.serialize() == expected
+
+
+def test_split_response_encoding_falls_back():
+    from tinyrpc.protocols.jsonrpc import JSONRPCSuccessResponse
+
+    class ConstantCodec(object):
+        split_encoding = True
+
+        def dumps(self, obj):
+            return 'constant'
+
+    rep = JSONRPCSuccessResponse(1, 'foo', ConstantCodec())
+
+    assert rep.serialize() == 'constant'
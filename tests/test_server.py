@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+import gevent
+import gevent.event
+import gevent.queue
+
+from tinyrpc.dispatch import RPCDispatcher
+from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+from tinyrpc.server import RPCServer
+from tinyrpc.server.gevent import RPCServerGreenletPool, OVERLOAD_BLOCK, \
+    OVERLOAD_REJECT, OVERLOAD_DROP
+from tinyrpc.transports import ServerTransport
+
+
+class QueueServerTransport(ServerTransport):
+    def __init__(self):
+        self.messages = gevent.queue.Queue()
+        self.replies = gevent.queue.Queue()
+
+    def receive_message(self):
+        return self.messages.get()
+
+    def send_reply(self, context, reply):
+        self.replies.put((context, reply))
+
+
+@pytest.fixture
+def transport():
+    return QueueServerTransport()
+
+
+@pytest.fixture
+def release():
+    return gevent.event.Event()
+
+
+@pytest.fixture
+def dispatcher(release):
+    dispatcher = RPCDispatcher()
+
+    @dispatcher.public
+    def wait():
+        release.wait()
+        return 'done'
+
+    return dispatcher
+
+
+def _request(unique_id, method='wait'):
+    data = {'jsonrpc': '2.0', 'method': method}
+    if unique_id is not None:
+        data['id'] = unique_id
+    return json.dumps(data)
+
+
+def _receive(server, transport, messages):
+    for context, message in messages:
+        transport.messages.put((context, message))
+        server.receive_one_message()
+
+
+def test_server_sends_replies(transport, dispatcher, release):
+    server = RPCServer(transport, JSONRPCProtocol(), dispatcher)
+    release.set()
+
+    _receive(server, transport, [('ctx', _request(1))])
+
+    context, reply = transport.replies.get(timeout=1)
+    assert context == 'ctx'
+    assert json.loads(reply)['result'] == 'done'
+
+
+@pytest.mark.parametrize('message', [
+    ['[{"jsonrpc": "2.0", "method": "wait", ', '"id": 1}]'],
+    iter(['{"jsonrpc": "2.0", ', '"method": "wait", "id": 1}']),
+])
+def test_server_handles_chunked_messages(transport, dispatcher, release,
+                                         message):
+    server = RPCServer(transport, JSONRPCProtocol(), dispatcher)
+    release.set()
+
+    _receive(server, transport, [('ctx', message)])
+
+    context, reply = transport.replies.get(timeout=1)
+    reply = json.loads(reply)
+    if isinstance(reply, list):
+        reply, = reply
+    assert reply['result'] == 'done'
+
+
+@pytest.mark.parametrize('message', [
+    _request(None),
+    '[%s, %s]' % (_request(None), _request(None)),
+])
+def test_server_sends_empty_reply_to_notifications(transport, dispatcher,
+                                                   release, message):
+    server = RPCServer(transport, JSONRPCProtocol(), dispatcher)
+    release.set()
+
+    _receive(server, transport, [('ctx', message)])
+
+    assert transport.replies.get(timeout=1) == ('ctx', '')
+
+
+def test_server_reads_chunked_messages_without_stream_support(
+        transport, dispatcher, release):
+    from tinyrpc.protocols.stratum import StratumRPCProtocol
+
+    server = RPCServer(transport, StratumRPCProtocol(), dispatcher)
+    release.set()
+
+    _receive(server, transport,
+             [('ctx', ['{"method": "wait", ', '"id": 1}\n'])])
+
+    context, reply = transport.replies.get(timeout=1)
+    assert json.loads(reply)['result'] == 'done'
+
+
+def _failing_read(*chunks):
+    for chunk in chunks:
+        yield chunk
+    raise IOError('connection reset')
+
+
+@pytest.mark.parametrize('protocol_class', [
+    JSONRPCProtocol,
+    'tinyrpc.protocols.stratum.StratumRPCProtocol',
+    'tinyrpc.protocols.msgpackrpc.MSGPackRPCProtocol',
+])
+@pytest.mark.parametrize('head', ['', '{"jsonrpc": "2.0", ',
+                                  '[{"jsonrpc": "2.0", "method": "wait", '
+                                  '"id": 1}, '])
+@pytest.mark.parametrize('stream_batches', [False, True])
+def test_server_answers_messages_failing_to_read(
+        transport, dispatcher, release, protocol_class, head,
+        stream_batches):
+    if isinstance(protocol_class, str):
+        module, _, name = protocol_class.rpartition('.')
+        protocol_class = getattr(pytest.importorskip(module), name)
+    server = RPCServer(transport, protocol_class(), dispatcher,
+                       stream_batches=stream_batches)
+    release.set()
+
+    _receive(server, transport, [('ctx', _failing_read(head))])
+
+    context, reply = transport.replies.get(timeout=1)
+    assert context == 'ctx'
+    assert 'Parse error' in reply
+
+
+class StreamQueueServerTransport(QueueServerTransport):
+    def send_reply_stream(self, context, chunks):
+        for chunk in chunks:
+            self.replies.put((context, chunk))
+        self.replies.put((context, None))
+
+
+def test_server_streams_batch_responses(dispatcher, release):
+    transport = StreamQueueServerTransport()
+    server = RPCServer(transport, JSONRPCProtocol(), dispatcher,
+                       stream_batches=True)
+
+    @dispatcher.public
+    def now():
+        return 'now'
+
+    batch = '[%s, %s]' % (_request(1, 'now'), _request(2))
+    handler = gevent.spawn(_receive, server, transport, [('ctx', batch)])
+
+    # the first response is sent while the second one is pending
+    assert transport.replies.get(timeout=1) == ('ctx', '[' + json.dumps(
+        {'jsonrpc': '2.0', 'id': 1, 'result': 'now'}, separators=(',', ':')
+    ))
+    assert transport.replies.empty()
+
+    release.set()
+    handler.join(timeout=1)
+    chunks = []
+    while True:
+        context, chunk = transport.replies.get(timeout=1)
+        if chunk is None:
+            break
+        chunks.append(chunk)
+    assert json.loads(''.join(chunks)[1:-1])['result'] == 'done'
+
+
+def test_server_streams_through_transports_joining_chunks(
+        transport, dispatcher, release):
+    server = RPCServer(transport, JSONRPCProtocol(), dispatcher,
+                       stream_batches=True)
+    release.set()
+
+    _receive(server, transport, [('ctx', '[%s]' % _request(1))])
+
+    context, reply = transport.replies.get(timeout=1)
+    reply, = json.loads(reply)
+    assert reply['result'] == 'done'
+
+
+def test_pool_rejects_requests_when_full(transport, dispatcher, release):
+    server = RPCServerGreenletPool(transport, JSONRPCProtocol(), dispatcher,
+                                   pool_size=1, queue_size=1,
+                                   overload=OVERLOAD_REJECT)
+
+    _receive(server, transport, [(1, _request(1))])
+    gevent.sleep(0)  # let the worker pick up the first request
+    _receive(server, transport, [(2, _request(2)), (3, _request(3)),
+                                 (4, _request(None))])
+
+    context, reply = transport.replies.get(timeout=1)
+    assert context == 3
+    assert json.loads(reply)['error']['message'] == 'Server busy'
+    assert transport.replies.get(timeout=1) == (4, '')
+
+    release.set()
+    replies = dict(transport.replies.get(timeout=1) for _ in xrange(2))
+    assert sorted(replies) == [1, 2]
+    assert transport.replies.empty()
+
+
+def test_pool_drops_notifications_when_full(transport, dispatcher, release):
+    server = RPCServerGreenletPool(transport, JSONRPCProtocol(), dispatcher,
+                                   pool_size=1, queue_size=1,
+                                   overload=OVERLOAD_DROP)
+
+    _receive(server, transport, [(1, _request(1))])
+    gevent.sleep(0)
+    _receive(server, transport, [(2, _request(2)), (3, _request(None))])
+    # the dropped notification is answered with an empty reply at once
+    assert transport.replies.get(timeout=1) == (3, '')
+
+    # requests wait for a worker instead of being rejected
+    receiver = gevent.spawn(_receive, server, transport, [(4, _request(4))])
+    gevent.sleep(0.01)
+    assert not receiver.ready()
+    assert transport.replies.empty()
+
+    release.set()
+    receiver.join(timeout=1)
+    replies = dict(transport.replies.get(timeout=1) for _ in xrange(3))
+    assert sorted(replies) == [1, 2, 4]
+
+
+def test_pool_blocks_when_full(transport, dispatcher, release):
+    server = RPCServerGreenletPool(transport, JSONRPCProtocol(), dispatcher,
+                                   pool_size=1, queue_size=1,
+                                   overload=OVERLOAD_BLOCK)
+
+    _receive(server, transport, [(1, _request(1))])
+    gevent.sleep(0)
+    _receive(server, transport, [(2, _request(2))])
+
+    receiver = gevent.spawn(_receive, server, transport, [(3, _request(None))])
+    gevent.sleep(0.01)
+    assert not receiver.ready()
+
+    release.set()
+    receiver.join(timeout=1)
+    assert receiver.ready()
+
+
+def test_pool_rejects_invalid_overload_policy(transport, dispatcher):
+    with pytest.raises(ValueError):
+        RPCServerGreenletPool(transport, JSONRPCProtocol(), dispatcher,
+                              overload='explode')
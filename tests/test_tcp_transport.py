@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import gevent
+import gevent.queue
+from gevent.server import StreamServer
+
+from tinyrpc.transports.tcp import NewlineFramer, LengthPrefixFramer, \
+    FramingError, StreamServerTransport, StreamClientTransport
+
+
+SAMPLE_MESSAGES = ['asdf', 'loremipsum' * 1500, '\x00', 'b\x00a',
+                   u'\u1234'.encode('utf8')]
+
+
+@pytest.fixture(params=[NewlineFramer, LengthPrefixFramer])
+def framer_class(request):
+    return request.param
+
+
+def _feed_in_chunks(framer, data, size):
+    frames = []
+    for i in xrange(0, len(data), size):
+        framer.feed(data[i:i + size])
+        frames.extend(framer.frames())
+    return frames
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 4096, 100000])
+def test_framer_reassembles_split_and_merged_frames(framer_class,
+                                                    chunk_size):
+    framer = framer_class()
+    data = ''.join(framer.frame(msg) for msg in SAMPLE_MESSAGES)
+
+    assert _feed_in_chunks(framer, data, chunk_size) == SAMPLE_MESSAGES
+
+
+def test_framer_keeps_partial_frames(framer_class):
+    framer = framer_class()
+    data = framer.frame('foo') + framer.frame('bar')
+
+    framer.feed(data[:-2])
+    assert list(framer.frames()) == ['foo']
+    assert list(framer.frames()) == []
+
+    framer.feed(data[-2:])
+    assert list(framer.frames()) == ['bar']
+
+
+def test_framer_rejects_oversized_frames(framer_class):
+    framer = framer_class(max_frame_size=16)
+    framer.feed(framer.frame('x' * 17))
+
+    with pytest.raises(FramingError):
+        list(framer.frames())
+
+
+def test_newline_framer_skips_empty_lines():
+    framer = NewlineFramer()
+    framer.feed('\n\nfoo\n\n')
+
+    assert list(framer.frames()) == ['foo']
+
+
+def test_newline_framer_does_not_duplicate_delimiter():
+    assert NewlineFramer().frame('foo\n') == 'foo\n'
+    assert NewlineFramer().frame('foo') == 'foo\n'
+
+
+def test_length_prefix_framer_allows_newlines():
+    framer = LengthPrefixFramer()
+    framer.feed(framer.frame('a\nb\n'))
+
+    assert list(framer.frames()) == ['a\nb\n']
+
+
+@pytest.fixture()
+def stream_server(request, framer_class):
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue,
+                                      framer_class=framer_class)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    def fin():
+        server.stop()
+
+    request.addfinalizer(fin)
+
+    return transport, server.address
+
+
+def _echo_replies(transport, count):
+    for _ in xrange(count):
+        context, msg = transport.receive_message()
+        transport.send_reply(context, 'reply:' + msg)
+
+
+def test_server_receives_messages(stream_server, framer_class):
+    transport, addr = stream_server
+    client = StreamClientTransport(addr, framer_class=framer_class)
+
+    gevent.spawn(_echo_replies, transport, len(SAMPLE_MESSAGES))
+
+    for msg in SAMPLE_MESSAGES:
+        assert client.send_message(msg) == 'reply:' + msg
+
+    client.close()
+
+
+def test_server_handles_pipelined_messages(stream_server, framer_class):
+    transport, addr = stream_server
+    client = StreamClientTransport(addr, framer_class=framer_class)
+
+    gevent.spawn(_echo_replies, transport, len(SAMPLE_MESSAGES))
+
+    # all messages are written in a single send
+    client.sock.sendall(
+        ''.join(client.framer.frame(msg) for msg in SAMPLE_MESSAGES)
+    )
+
+    for msg in SAMPLE_MESSAGES:
+        assert client.receive_reply() == 'reply:' + msg
+
+    client.close()
+
+
+def test_pipelined_server_replies_out_of_order(framer_class):
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue,
+                                      framer_class=framer_class,
+                                      pipelined=True)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    try:
+        client = StreamClientTransport(server.address,
+                                       framer_class=framer_class)
+        client.send_message('slow', expect_reply=False)
+        client.send_message('fast', expect_reply=False)
+
+        # both messages are received before any of them is answered
+        slow_context, slow_msg = transport.receive_message()
+        fast_context, fast_msg = transport.receive_message()
+        assert (slow_msg, fast_msg) == ('slow', 'fast')
+
+        transport.send_reply(fast_context, 'reply:fast')
+        assert client.receive_reply() == 'reply:fast'
+
+        transport.send_reply(slow_context, 'reply:slow')
+        assert client.receive_reply() == 'reply:slow'
+
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_pipelined_server_replies_after_client_half_closes(framer_class):
+    import socket
+
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue,
+                                      framer_class=framer_class,
+                                      pipelined=True)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    try:
+        client = StreamClientTransport(server.address,
+                                       framer_class=framer_class)
+        for msg in ['one', 'two', 'three']:
+            client.send_message(msg, expect_reply=False)
+        client.sock.shutdown(socket.SHUT_WR)
+
+        received = [transport.receive_message() for _ in xrange(3)]
+        gevent.sleep(0.1)
+        for context, msg in reversed(received):
+            transport.send_reply(context, 'reply:' + msg)
+
+        assert [client.receive_reply() for _ in xrange(3)] == \
+            ['reply:three', 'reply:two', 'reply:one']
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_pipelined_server_limits_messages_in_flight(framer_class):
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue,
+                                      framer_class=framer_class,
+                                      pipelined=True, max_in_flight=2)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    try:
+        client = StreamClientTransport(server.address,
+                                       framer_class=framer_class)
+        for i in xrange(4):
+            client.send_message(str(i), expect_reply=False)
+        gevent.sleep(0.1)
+
+        # the connection is not read while two messages are pending
+        first = transport.receive_message()
+        transport.receive_message()
+        gevent.sleep(0.1)
+        assert transport.messages.empty()
+
+        transport.send_reply(first[0], 'reply')
+        assert transport.receive_message()[1] == '2'
+        assert transport.messages.empty()
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_slow_streamed_reply_does_not_block_other_replies(framer_class):
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue,
+                                      framer_class=framer_class,
+                                      pipelined=True)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    def slow_chunks():
+        yield '[1'
+        gevent.sleep(0.2)
+        yield ',2]'
+
+    try:
+        client = StreamClientTransport(server.address,
+                                       framer_class=framer_class)
+        client.send_message('slow', expect_reply=False)
+        client.send_message('fast', expect_reply=False)
+        slow_context, slow_msg = transport.receive_message()
+        fast_context, fast_msg = transport.receive_message()
+
+        gevent.spawn(transport.send_reply_stream, slow_context, slow_chunks())
+        gevent.sleep(0.01)
+        transport.send_reply(fast_context, 'reply:fast')
+
+        assert client.receive_reply() == 'reply:fast'
+        assert client.receive_reply() == '[1,2]'
+
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_multiplexed_client_over_pipelined_connection():
+    import gevent.event
+    from tinyrpc.client import RPCClientMultiplexed
+    from tinyrpc.dispatch import RPCDispatcher
+    from tinyrpc.protocols.stratum import StratumRPCProtocol
+    from tinyrpc.server.gevent import RPCServerGreenlets
+
+    dispatcher = RPCDispatcher()
+
+    @dispatcher.public
+    def sleep_and_echo(delay, value):
+        gevent.sleep(delay)
+        return value
+
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue,
+                                      pipelined=True)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+    rpc_server = RPCServerGreenlets(transport, StratumRPCProtocol(),
+                                    dispatcher)
+    server_greenlet = gevent.spawn(rpc_server.serve_forever)
+
+    client_transport = StreamClientTransport(server.address)
+    client = RPCClientMultiplexed(StratumRPCProtocol(), client_transport,
+                                  result_class=gevent.event.AsyncResult)
+    receiver = gevent.spawn(client.receive_forever)
+
+    try:
+        slow = client.call_async('sleep_and_echo', [0.2, 'slow'], None)
+        fast = client.call_async('sleep_and_echo', [0, 'fast'], None)
+
+        assert fast.get(timeout=1) == 'fast'
+        assert not slow.ready()
+        assert slow.get(timeout=1) == 'slow'
+    finally:
+        client_transport.close()
+        receiver.kill()
+        server_greenlet.kill()
+        server.stop()
+
+
+def test_multiplexed_client_survives_idle_connection():
+    import gevent.event
+    from tinyrpc.client import RPCClientMultiplexed
+    from tinyrpc.dispatch import RPCDispatcher
+    from tinyrpc.protocols.stratum import StratumRPCProtocol
+    from tinyrpc.server.gevent import RPCServerGreenlets
+
+    dispatcher = RPCDispatcher()
+    dispatcher.add_method(lambda value: value, 'echo')
+
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue,
+                                      pipelined=True)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+    rpc_server = RPCServerGreenlets(transport, StratumRPCProtocol(),
+                                    dispatcher)
+    server_greenlet = gevent.spawn(rpc_server.serve_forever)
+
+    client_transport = StreamClientTransport(server.address)
+    client_transport.sock.settimeout(0.05)
+    client = RPCClientMultiplexed(StratumRPCProtocol(), client_transport,
+                                  result_class=gevent.event.AsyncResult)
+    receiver = gevent.spawn(client.receive_forever)
+
+    try:
+        # idle for longer than the socket timeout
+        gevent.sleep(0.2)
+
+        assert not receiver.ready()
+        assert client.call('echo', ['foo'], None, timeout=1) == 'foo'
+    finally:
+        client_transport.close()
+        receiver.kill()
+        server_greenlet.kill()
+        server.stop()
+
+
+def test_framer_frames_streams(framer_class):
+    framer = framer_class()
+    framer.feed(''.join(framer.frame_stream(['[1', ',2', ']'])))
+    framer.feed(''.join(framer.frame_stream([])))
+    framer.feed(''.join(framer.frame_stream(['foo'])))
+
+    assert list(framer.frames()) == ['[1,2]', 'foo']
+
+
+def test_newline_framer_writes_streams_incrementally():
+    frames = NewlineFramer().frame_stream(iter(['[1', ',2', ']']))
+
+    assert list(frames) == ['[1', ',2', ']', '\n']
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_server_sends_streamed_replies(framer_class, pipelined):
+    transport = StreamServerTransport(queue_class=gevent.queue.Queue,
+                                      framer_class=framer_class,
+                                      pipelined=pipelined)
+    server = StreamServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    try:
+        client = StreamClientTransport(server.address,
+                                       framer_class=framer_class)
+        client.send_message('stream', expect_reply=False)
+        context, msg = transport.receive_message()
+        transport.send_reply_stream(context, iter(['[1', ',2', ']']))
+        assert client.receive_reply() == '[1,2]'
+
+        # nothing is sent for empty streams
+        client.send_message('empty', expect_reply=False)
+        context, msg = transport.receive_message()
+        transport.send_reply_stream(context, iter([]))
+        client.send_message('next', expect_reply=False)
+        context, msg = transport.receive_message()
+        transport.send_reply(context, 'reply:' + msg)
+        assert client.receive_reply() == 'reply:next'
+
+        client.close()
+    finally:
+        server.stop()
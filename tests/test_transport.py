@@ -7,7 +7,8 @@ import zmq
 import zmq.green
 
 from tinyrpc.transports import ServerTransport, ClientTransport
-from tinyrpc.transports.zmq import ZmqServerTransport, ZmqClientTransport
+from tinyrpc.transports.zmq import ZmqServerTransport, ZmqClientTransport, \
+    ZmqDealerClientTransport
 
 
 class DummyServerTransport(ServerTransport):
@@ -59,16 +60,19 @@ def zmq_green_context(request):
     return ctx
 
 
-@pytest.fixture(params=['dummy', 'zmq', 'zmq.green'])
+@pytest.fixture(params=['dummy', 'zmq', 'zmq.green', 'zmq-nocopy'])
 def transport(request, zmq_context, zmq_green_context):
     if request.param == 'dummy':
         server = DummyServerTransport()
         client = DummyClientTransport(server)
-    elif request.param in ('zmq', 'zmq.green'):
-        ctx = zmq_context if request.param == 'zmq' else zmq_green_context
+    elif request.param in ('zmq', 'zmq.green', 'zmq-nocopy'):
+        ctx = zmq_green_context if request.param == 'zmq.green' \
+            else zmq_context
+        copy = request.param != 'zmq-nocopy'
+        endpoint = ZMQ_ENDPOINT if copy else ZMQ_ENDPOINT + '-nocopy'
 
-        server = ZmqServerTransport.create(ctx, ZMQ_ENDPOINT)
-        client = ZmqClientTransport.create(ctx, ZMQ_ENDPOINT)
+        server = ZmqServerTransport.create(ctx, endpoint, copy)
+        client = ZmqClientTransport.create(ctx, endpoint, copy)
 
         def fin():
             server.socket.close()
@@ -109,6 +113,207 @@ def test_transport_rejects_bad_values(transport, sample_msg, bad_msg):
         client.send_message(bad_msg)
 
 
+def test_zmq_transport_passes_uncopied_frames(zmq_context):
+    server = ZmqServerTransport.create(zmq_context, 'inproc://nocopy',
+                                       copy=False)
+    client = ZmqClientTransport.create(zmq_context, 'inproc://nocopy',
+                                       copy=False)
+
+    try:
+        client.socket.send('x' * 100000)
+        context, msg = server.receive_message()
+        assert isinstance(msg, memoryview)
+        assert msg == 'x' * 100000
+
+        server.send_reply(context, 'reply')
+        assert client.socket.recv() == 'reply'
+    finally:
+        server.socket.close()
+        client.socket.close()
+
+
+@pytest.mark.parametrize('protocol_name', ['jsonrpc', 'msgpackrpc'])
+def test_zmq_rpc_without_copying(protocol_name):
+    import gevent
+    from tinyrpc.client import RPCClient
+    from tinyrpc.dispatch import RPCDispatcher
+    from tinyrpc.server import RPCServer
+
+    if protocol_name == 'jsonrpc':
+        from tinyrpc.protocols.jsonrpc import JSONRPCProtocol as Protocol
+    else:
+        pytest.importorskip('msgpack')
+        from tinyrpc.protocols.msgpackrpc import MSGPackRPCProtocol as Protocol
+
+    dispatcher = RPCDispatcher()
+    dispatcher.add_method(lambda data: data[::-1], 'reverse')
+
+    ctx = zmq.green.Context()
+    endpoint = 'inproc://nocopy-rpc'
+    server_transport = ZmqServerTransport.create(ctx, endpoint, copy=False)
+    client_transport = ZmqClientTransport.create(ctx, endpoint, copy=False)
+    server = RPCServer(server_transport, Protocol(), dispatcher)
+    server_greenlet = gevent.spawn(server.serve_forever)
+
+    try:
+        client = RPCClient(Protocol(), client_transport)
+        data = u'abc' * 30000
+        assert client.call('reverse', [data], None) == data[::-1]
+    finally:
+        server_greenlet.kill()
+        server_transport.socket.close()
+        client_transport.socket.close()
+        ctx.term()
+
+
+def test_zmq_dealer_client_is_shared_across_threads(zmq_context):
+    import threading
+
+    server = ZmqServerTransport.create(zmq_context, 'inproc://dealer')
+    client = ZmqDealerClientTransport.create(zmq_context, 'inproc://dealer')
+    messages = ['%d-%d' % (i, j) for i in xrange(4) for j in xrange(25)]
+
+    def echo():
+        for _ in messages:
+            context, message = server.receive_message()
+            server.send_reply(context, 'reply:' + message)
+
+    def send(i):
+        for j in xrange(25):
+            client.send_message('%d-%d' % (i, j), expect_reply=False)
+
+    replies = []
+
+    def receive():
+        for _ in messages:
+            replies.append(client.receive_reply())
+
+    threads = [threading.Thread(target=echo), threading.Thread(target=receive)]
+    threads.extend(threading.Thread(target=send, args=(i,)) for i in xrange(4))
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        assert sorted(replies) == sorted('reply:' + m for m in messages)
+    finally:
+        server.socket.close()
+        client.close()
+
+
+def test_zmq_dealer_client_matches_replies_to_threads(zmq_context):
+    import threading
+
+    server = ZmqServerTransport.create(zmq_context, 'inproc://dealer-match')
+    client = ZmqDealerClientTransport.create(zmq_context,
+                                             'inproc://dealer-match')
+
+    def echo():
+        for _ in xrange(4 * 50):
+            context, message = server.receive_message()
+            server.send_reply(context, 'reply:' + message)
+
+    mismatches = []
+
+    def call(i):
+        for j in xrange(50):
+            message = '%d-%d' % (i, j)
+            if client.send_message(message) != 'reply:' + message:
+                mismatches.append(message)
+
+    server_thread = threading.Thread(target=echo)
+    server_thread.daemon = True
+    server_thread.start()
+    threads = [threading.Thread(target=call, args=(i,)) for i in xrange(4)]
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            assert not thread.is_alive()
+
+        assert mismatches == []
+    finally:
+        client.close()
+        server.socket.close()
+
+
+def test_zmq_dealer_client_close_fails_waiting_threads(zmq_context):
+    import threading
+
+    server = ZmqServerTransport.create(zmq_context, 'inproc://dealer-close')
+    client = ZmqDealerClientTransport.create(zmq_context,
+                                             'inproc://dealer-close')
+    errors = []
+
+    def call():
+        try:
+            client.send_message('unanswered')
+        except zmq.ZMQError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=call)
+    thread.daemon = True
+    thread.start()
+    try:
+        server.receive_message()
+        client.close()
+        thread.join(5)
+
+        assert len(errors) == 1
+        with pytest.raises(zmq.ZMQError):
+            client.receive_reply()
+        with pytest.raises(zmq.ZMQError):
+            client.send_message('too late')
+    finally:
+        client.close()
+        server.socket.close()
+
+
+def test_zmq_dealer_client_with_multiplexed_client():
+    import gevent
+    import gevent.event
+    from tinyrpc.client import RPCClientMultiplexed
+    from tinyrpc.dispatch import RPCDispatcher
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+    from tinyrpc.server.gevent import RPCServerGreenlets
+
+    dispatcher = RPCDispatcher()
+
+    @dispatcher.public
+    def sleep_and_echo(delay, value):
+        gevent.sleep(delay)
+        return value
+
+    ctx = zmq.green.Context()
+    server_transport = ZmqServerTransport.create(ctx, 'inproc://dealer-rpc')
+    client_transport = ZmqDealerClientTransport.create(ctx,
+                                                       'inproc://dealer-rpc')
+    server = RPCServerGreenlets(server_transport, JSONRPCProtocol(),
+                                dispatcher)
+    server_greenlet = gevent.spawn(server.serve_forever)
+    client = RPCClientMultiplexed(JSONRPCProtocol(), client_transport,
+                                  result_class=gevent.event.AsyncResult)
+    receiver = gevent.spawn(client.receive_forever)
+
+    try:
+        slow = client.call_async('sleep_and_echo', [0.2, 'slow'], None)
+        fast = client.call_async('sleep_and_echo', [0, 'fast'], None)
+
+        assert fast.get(timeout=1) == 'fast'
+        assert not slow.ready()
+        assert slow.get(timeout=1) == 'slow'
+    finally:
+        receiver.kill()
+        server_greenlet.kill()
+        server_transport.socket.close()
+        client_transport.close()
+        ctx.term()
+
+
 # FIXME: these tests need to be rethought, as they no longer work properly with
 # the change to the interface of ClientTransport
 
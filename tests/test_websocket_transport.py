@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import gevent
+import gevent.queue
+import gevent.socket
+
+pytest.importorskip('geventwebsocket')
+websocket = pytest.importorskip('websocket')
+
+from geventwebsocket import WebSocketServer
+
+from tinyrpc.transports.websocket import WSServerTransport, \
+    WSApplicationFactory, WSApplication
+
+
+@pytest.fixture()
+def ws_server(request):
+    transport = WSServerTransport(queue_class=gevent.queue.Queue)
+    server = WebSocketServer(('127.0.0.1', 0), transport.handle)
+    server.start()
+
+    request.addfinalizer(server.stop)
+
+    return transport, server.address
+
+
+@pytest.fixture()
+def ws(request, ws_server):
+    transport, address = ws_server
+    # a green socket, so the server keeps running while the client waits
+    sock = gevent.socket.create_connection(address)
+    ws = websocket.create_connection('ws://%s:%d/ws' % address, socket=sock,
+                                     timeout=5)
+
+    request.addfinalizer(ws.close)
+
+    return ws
+
+
+def _echo_replies(transport):
+    while True:
+        context, msg = transport.receive_message()
+        transport.send_reply(context, 'reply:' + msg)
+
+
+def test_server_receives_messages(ws_server, ws):
+    transport, address = ws_server
+    gevent.spawn(_echo_replies, transport)
+
+    for msg in ['foo', 'x' * 100000]:
+        ws.send(msg)
+        assert ws.recv() == 'reply:' + msg
+
+
+def test_server_sends_streamed_replies(ws_server, ws):
+    transport, address = ws_server
+
+    def consumer():
+        context, msg = transport.receive_message()
+        transport.send_reply_stream(context, iter(['[1', ',2', ']']))
+
+    gevent.spawn(consumer)
+
+    ws.send('[]')
+    assert ws.recv() == '[1,2]'
+
+
+def test_server_answers_plain_http_requests(ws_server):
+    transport, address = ws_server
+    sock = gevent.socket.create_connection(address)
+    sock.sendall('GET / HTTP/1.0\r\n\r\n')
+
+    assert 'Ready for WebSocket connection' in sock.makefile().read()
+
+
+def test_factory_binds_queues_to_application_class():
+    messages = gevent.queue.Queue()
+    factory = WSApplicationFactory(messages, gevent.queue.Queue)
+    app_class = factory.application_class()
+
+    assert issubclass(app_class, WSApplication)
+    assert app_class.messages is messages
+    assert app_class._queue_class is gevent.queue.Queue
+
+
+def test_closed_connection_puts_nothing_on_queue(ws_server, ws):
+    transport, address = ws_server
+    ws.close()
+    gevent.sleep(0.1)
+
+    assert transport.messages.empty()
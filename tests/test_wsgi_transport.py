@@ -86,3 +86,155 @@ def test_server_receives_messages(wsgi_server, msg):
     r = requests.post(addr, data=msg)
 
     assert r.content == 'reply:' + msg
+
+
+def test_server_passes_chunked_messages(wsgi_server):
+    transport, addr = wsgi_server
+    transport.chunk_size = 4
+    msg = '[{"jsonrpc": "2.0", "method": "foo"}]'
+
+    def consumer():
+        context, received_msg = transport.receive_message()
+        chunks = list(received_msg)
+        assert all(len(chunk) <= 4 for chunk in chunks)
+        transport.send_reply(context, ''.join(chunks))
+
+    gevent.spawn(consumer)
+
+    r = requests.post(addr, data=msg)
+
+    assert r.content == msg
+
+
+def test_server_sends_streamed_replies_chunked(wsgi_server):
+    transport, addr = wsgi_server
+
+    def consumer():
+        context, received_msg = transport.receive_message()
+        transport.send_reply_stream(context, iter(['[1', ',2', ']']))
+
+    gevent.spawn(consumer)
+
+    r = requests.post(addr, data='[]')
+
+    assert r.headers['Transfer-Encoding'] == 'chunked'
+    assert r.content == '[1,2]'
+
+
+@pytest.fixture()
+def echo(wsgi_server):
+    transport, addr = wsgi_server
+
+    def consumer():
+        while True:
+            context, received_msg = transport.receive_message()
+            if not isinstance(received_msg, str):
+                received_msg = ''.join(received_msg)
+            transport.send_reply(context, 'reply:' + received_msg)
+
+    greenlet = gevent.spawn(consumer)
+    yield transport, addr
+    greenlet.kill()
+
+
+def test_server_compresses_large_replies(echo):
+    transport, addr = echo
+    transport.compress_threshold = 100
+
+    r = requests.post(addr, data='x' * 200,
+                      headers={'Accept-Encoding': 'deflate, gzip;q=0.5'})
+    assert r.headers['Content-Encoding'] == 'deflate'
+    assert r.content == 'reply:' + 'x' * 200
+
+    r = requests.post(addr, data='x', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in r.headers
+    assert r.headers['Vary'] == 'Accept-Encoding'
+    assert r.content == 'reply:x'
+
+    r = requests.post(addr, data='x' * 200,
+                      headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in r.headers
+
+
+def test_server_compresses_streamed_replies(wsgi_server):
+    transport, addr = wsgi_server
+    transport.compress_threshold = 100
+
+    def consumer():
+        context, received_msg = transport.receive_message()
+        transport.send_reply_stream(context, iter(['[1', ',2', ']']))
+
+    gevent.spawn(consumer)
+
+    r = requests.post(addr, data='[]', headers={'Accept-Encoding': 'gzip'})
+
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert r.content == '[1,2]'
+
+
+@pytest.mark.parametrize('chunk_size', [None, 4])
+def test_server_accepts_compressed_requests(echo, chunk_size):
+    from tinyrpc.transports.http import HttpPostClientTransport
+
+    transport, addr = echo
+    transport.chunk_size = chunk_size
+    client = HttpPostClientTransport(addr, compress_threshold=10)
+
+    assert client.send_message('x' * 1000) == 'reply:' + 'x' * 1000
+
+
+def test_server_rejects_unknown_and_oversized_compressed_requests(echo):
+    import zlib
+
+    transport, addr = echo
+
+    r = requests.post(addr, data='x', headers={'Content-Encoding': 'foo'})
+    assert r.status_code == 415
+
+    bomb = zlib.compress('x' * 100000)
+    assert len(bomb) < transport.max_content_length
+    r = requests.post(addr, data=bomb,
+                      headers={'Content-Encoding': 'deflate'})
+    assert r.status_code == 413
+
+
+@pytest.fixture()
+def rpc_server(wsgi_server):
+    from tinyrpc.dispatch import RPCDispatcher
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+    from tinyrpc.server.gevent import RPCServerGreenlets
+
+    transport, addr = wsgi_server
+    dispatcher = RPCDispatcher()
+    dispatcher.add_method(lambda value: value, 'echo')
+    server = RPCServerGreenlets(transport, JSONRPCProtocol(), dispatcher)
+    greenlet = gevent.spawn(server.serve_forever)
+    yield transport, addr
+    greenlet.kill()
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'deflate'])
+def test_server_answers_bad_compressed_chunked_requests(rpc_server,
+                                                        encoding):
+    import json
+    from tinyrpc.transports.compression import get_encodings
+
+    transport, addr = rpc_server
+    transport.chunk_size = 16
+    compress = get_encodings([encoding])[0].compress
+    headers = {'Content-Encoding': encoding}
+
+    request = json.dumps({'jsonrpc': '2.0', 'method': 'echo',
+                          'params': ['x' * 100], 'id': 1})
+    with gevent.Timeout(5):
+        r = requests.post(addr, data=compress(request), headers=headers)
+        assert json.loads(r.content)['result'] == 'x' * 100
+
+        bomb = compress('[' + ' ' * 1024 * 1024 + ']')
+        assert len(bomb) < transport.max_content_length
+        r = requests.post(addr, data=bomb, headers=headers)
+        assert r.status_code == 413
+
+        r = requests.post(addr, data=compress('[' + request)[:-20],
+                          headers=headers)
+        assert json.loads(r.content)['error']['code'] == -32700
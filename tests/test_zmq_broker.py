@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import gevent
+import zmq.green
+
+from tinyrpc.transports.zmq import ZmqBroker, ZmqWorkerTransport, \
+    ZmqClientTransport, ZmqDealerClientTransport
+
+HEARTBEAT_INTERVAL = 0.05
+
+
+@pytest.fixture(params=['inproc', 'ipc'])
+def endpoints(request, tmpdir):
+    if request.param == 'inproc':
+        return 'inproc://frontend', 'inproc://backend'
+    return 'ipc://%s' % tmpdir.join('frontend'), \
+        'ipc://%s' % tmpdir.join('backend')
+
+
+@pytest.fixture()
+def ctx(request):
+    ctx = zmq.green.Context()
+
+    request.addfinalizer(lambda: ctx.destroy(linger=0))
+    return ctx
+
+
+@pytest.fixture()
+def broker(request, ctx, endpoints):
+    broker = ZmqBroker.create(ctx, *endpoints,
+                              heartbeat_interval=HEARTBEAT_INTERVAL)
+    greenlet = gevent.spawn(broker.serve_forever)
+
+    request.addfinalizer(greenlet.kill)
+    return broker
+
+
+@pytest.fixture()
+def client(request, ctx, endpoints, broker):
+    client = ZmqDealerClientTransport.create(ctx, endpoints[0])
+
+    request.addfinalizer(client.close)
+    return client
+
+
+def _worker(ctx, endpoints, **kwargs):
+    return ZmqWorkerTransport.create(
+        ctx, endpoints[1], heartbeat_interval=HEARTBEAT_INTERVAL, **kwargs
+    )
+
+
+def _echo(worker, name):
+    while True:
+        context, message = worker.receive_message()
+        worker.send_reply(context, '%s:%s' % (name, message))
+
+
+def test_broker_routes_requests_to_workers(ctx, endpoints, broker):
+    worker = _worker(ctx, endpoints)
+    gevent.spawn(_echo, worker, 'worker')
+    client = ZmqClientTransport.create(ctx, endpoints[0])
+
+    for msg in ['foo', '', 'x' * 100000]:
+        assert client.send_message(msg) == 'worker:' + msg
+
+
+def test_broker_routes_to_least_loaded_worker(ctx, endpoints, broker,
+                                             client):
+    busy = _worker(ctx, endpoints, capacity=2)
+    idle = _worker(ctx, endpoints, capacity=2)
+    gevent.sleep(0.01)
+
+    client.send_message('1', expect_reply=False)
+    client.send_message('2', expect_reply=False)
+    first = gevent.spawn(busy.receive_message).get(timeout=1)
+    second = gevent.spawn(idle.receive_message).get(timeout=1)
+    assert sorted([first[1], second[1]]) == ['1', '2']
+
+    # both workers have one free slot, the least recently used one wins
+    client.send_message('3', expect_reply=False)
+    assert gevent.spawn(busy.receive_message).get(timeout=1)[1] == '3'
+
+    # the busy worker is full
+    client.send_message('4', expect_reply=False)
+    assert gevent.spawn(idle.receive_message).get(timeout=1)[1] == '4'
+
+    # requests wait for a free worker
+    client.send_message('5', expect_reply=False)
+    waiting = gevent.spawn(busy.receive_message)
+    gevent.sleep(0.02)
+    assert not waiting.ready()
+
+    busy.send_reply(first[0], 'done')
+    assert client.receive_reply() == 'done'
+    assert waiting.get(timeout=1)[1] == '5'
+
+
+def test_broker_requeues_requests_of_dead_workers(ctx, endpoints, broker,
+                                                  client):
+    dying = _worker(ctx, endpoints)
+    gevent.sleep(0.01)
+
+    client.send_message('foo', expect_reply=False)
+    dying.receive_message()
+    dying.socket.close(linger=0)
+
+    gevent.spawn(_echo, _worker(ctx, endpoints), 'survivor')
+    assert gevent.spawn(client.receive_reply).get(timeout=1) == \
+        'survivor:foo'
+    assert len(broker._workers) == 1
+
+
+def test_idle_workers_stay_alive(ctx, endpoints, broker, client):
+    worker = _worker(ctx, endpoints)
+    gevent.spawn(_echo, worker, 'worker')
+
+    gevent.sleep(HEARTBEAT_INTERVAL * 6)
+    assert len(broker._workers) == 1
+    assert client.send_message('foo') == 'worker:foo'
+
+
+def test_workers_announce_themselves_to_new_brokers(ctx, endpoints):
+    worker = _worker(ctx, endpoints)
+    gevent.spawn(_echo, worker, 'worker')
+    gevent.sleep(HEARTBEAT_INTERVAL * 4)
+
+    # the broker starts after the worker's first announcement
+    broker = ZmqBroker.create(ctx, *endpoints,
+                              heartbeat_interval=HEARTBEAT_INTERVAL)
+    greenlet = gevent.spawn(broker.serve_forever)
+    client = ZmqDealerClientTransport.create(ctx, endpoints[0])
+
+    try:
+        assert gevent.spawn(client.send_message, 'foo').get(timeout=1) == \
+            'worker:foo'
+    finally:
+        greenlet.kill()
+
+
+def test_rpc_through_broker(ctx, endpoints, broker, client):
+    import gevent.event
+    from tinyrpc.client import RPCClientMultiplexed
+    from tinyrpc.dispatch import RPCDispatcher
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+    from tinyrpc.server.gevent import RPCServerGreenlets
+
+    dispatcher = RPCDispatcher()
+
+    @dispatcher.public
+    def sleep_and_echo(delay, value):
+        gevent.sleep(delay)
+        return value
+
+    servers = [
+        gevent.spawn(RPCServerGreenlets(
+            _worker(ctx, endpoints, capacity=10), JSONRPCProtocol(),
+            dispatcher
+        ).serve_forever)
+        for _ in xrange(3)
+    ]
+    rpc_client = RPCClientMultiplexed(JSONRPCProtocol(), client,
+                                      result_class=gevent.event.AsyncResult)
+    receiver = gevent.spawn(rpc_client.receive_forever)
+
+    try:
+        results = [rpc_client.call_async('sleep_and_echo', [0.05, i], None)
+                   for i in xrange(30)]
+        assert [result.get(timeout=1) for result in results] == range(30)
+    finally:
+        receiver.kill()
+        gevent.killall(servers)
+
+
+def test_broker_and_workers_in_threads(endpoints):
+    import threading
+
+    ctx = zmq.Context()
+    broker = ZmqBroker.create(ctx, *endpoints,
+                              heartbeat_interval=HEARTBEAT_INTERVAL)
+    workers = [_worker(ctx, endpoints, copy=False) for _ in xrange(2)]
+    client = ZmqClientTransport.create(ctx, endpoints[0])
+
+    def echo(worker):
+        for _ in xrange(5):
+            context, message = worker.receive_message()
+            worker.send_reply(context, 'reply:' + message.tobytes())
+
+    threads = [threading.Thread(target=broker.serve_forever)]
+    threads.extend(threading.Thread(target=echo, args=(worker,))
+                   for worker in workers)
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for i in xrange(10):
+            assert client.send_message(str(i)) == 'reply:%d' % i
+    finally:
+        broker.stop()
+        for thread in threads:
+            thread.join(1)
+        ctx.destroy(linger=0)
+
+
+def test_broker_takes_all_waiting_messages_per_poll(ctx, endpoints):
+    broker = ZmqBroker.create(ctx, *endpoints,
+                              heartbeat_interval=HEARTBEAT_INTERVAL)
+    broker.drain_limit = 8
+    sender = ctx.socket(zmq.DEALER)
+    sender.connect(endpoints[0])
+
+    for i in xrange(10):
+        sender.send_multipart(['', 'message %d' % i])
+    gevent.sleep(0.1)
+
+    broker.poll(1)
+    assert len(broker._requests) == 8
+    broker.poll(1)
+    assert len(broker._requests) == 10
+
+    sender.close(linger=0)
+    broker.close()
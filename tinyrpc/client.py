@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import logging
+import threading
+
 from .exc import RPCError
+from .protocols import RPCBatchResponse
+
+log = logging.getLogger('RPCClient')
 
 
 class RPCClient(object):
@@ -60,6 +66,231 @@ class RPCClient(object):
         return self._send_and_handle_reply(req)
 
 
+class AsyncResult(object):
+    """Result of a call that has not necessarily been answered yet.
+
+    A minimal, thread-based counterpart to :py:class:`gevent.event.AsyncResult`
+    used by :py:class:`~tinyrpc.client.RPCClientMultiplexed`.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.value = None
+        self.exception = None
+
+    def set(self, value=None):
+        self.value = value
+        self._event.set()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self._event.set()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def get(self, block=True, timeout=None):
+        """Return the result, waiting for it if necessary.
+
+        :param block: Whether or not to wait for the result.
+        :param timeout: Maximum number of seconds to wait.
+        :return: The result of the call. If the call failed, its exception is
+                 raised instead.
+        """
+        if not self._event.wait(timeout if block else 0):
+            raise RPCError('Timeout waiting for reply')
+
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+class RPCClientMultiplexed(RPCClient):
+    """Client keeping many calls in flight on a single connection.
+
+    Requests are sent without waiting for the reply to earlier ones. Every
+    pending call is remembered by its unique id and completed once a reply
+    carrying that id arrives, in whatever order replies are received.
+
+    Replies are read by
+    :py:func:`~tinyrpc.client.RPCClientMultiplexed.receive_forever`, which
+    must be run concurrently, e.g. in its own greenlet or thread.
+
+    :param protocol: An :py:class:`~tinyrpc.RPCProtocol` instance supporting
+                     out of order replies.
+    :param transport: A :py:class:`~tinyrpc.transports.ClientTransport`
+                      instance that implements
+                      :py:func:`~tinyrpc.transports.ClientTransport.receive_reply`.
+    :param result_class: The class used for pending results. Defaults to
+                         :py:class:`~tinyrpc.client.AsyncResult`, set it to
+                         :py:class:`gevent.event.AsyncResult` when using
+                         :py:mod:`gevent`.
+    """
+
+    def __init__(self, protocol, transport, result_class=AsyncResult):
+        if not protocol.supports_out_of_order:
+            raise ValueError('Protocol must support out of order replies.')
+
+        super(RPCClientMultiplexed, self).__init__(protocol, transport)
+        self.result_class = result_class
+        self._pending = {}
+        self._failure = None
+
+    def _send(self, req, requests):
+        """Send a request and return a result per request of ``requests``,
+        the request itself or the requests of a batch."""
+        if self._failure is not None:
+            raise RPCError('Client closed: %s' % self._failure)
+
+        results = []
+        for request in requests:
+            result = self.result_class()
+            if request.unique_id is None:
+                # one way requests are complete once sent
+                result.set(None)
+            else:
+                self._pending[request.unique_id] = result
+            results.append(result)
+
+        try:
+            self.transport.send_message(req.serialize(), expect_reply=False)
+            if self._failure is not None:
+                # the reader stopped after the results were added
+                raise RPCError('Client closed: %s' % self._failure)
+        except Exception:
+            self._forget(requests)
+            raise
+
+        return results
+
+    def _forget(self, requests):
+        for request in requests:
+            self._pending.pop(request.unique_id, None)
+
+    def call_async(self, method, args, kwargs, one_way=False):
+        """Calls the requested method without waiting for the result.
+
+        :param method: Name of the method to call.
+        :param args: Arguments to pass to the method.
+        :param kwargs: Keyword arguments to pass to the method.
+        :param one_way: Whether or not a reply is desired.
+        :return: A ``result_class`` instance. Its ``get`` method returns the
+                 result or raises an :py:class:`~tinyrpc.exc.RPCError`.
+        """
+        req = self.protocol.create_request(method, args, kwargs, one_way)
+
+        return self._send(req, [req])[0]
+
+    def call(self, method, args, kwargs, one_way=False, timeout=None):
+        """Calls the requested method and returns the result.
+
+        :param method: Name of the method to call.
+        :param args: Arguments to pass to the method.
+        :param kwargs: Keyword arguments to pass to the method.
+        :param one_way: Whether or not a reply is desired.
+        :param timeout: Seconds to wait for the reply, ``None`` waits
+                        forever. If no reply arrives in time, the timeout
+                        error of ``result_class`` is raised (an
+                        :py:class:`~tinyrpc.exc.RPCError` for the default
+                        :py:class:`~tinyrpc.client.AsyncResult`) and a late
+                        reply is dropped.
+        """
+        req = self.protocol.create_request(method, args, kwargs, one_way)
+
+        try:
+            return self._send(req, [req])[0].get(timeout=timeout)
+        finally:
+            self._forget([req])
+
+    def batch_call(self, calls, timeout=None):
+        """Calls several methods using a single batch request.
+
+        :param calls: An iterable of ``(method, args, kwargs, one_way)``
+                      tuples, the arguments of
+                      :py:func:`~tinyrpc.client.RPCClientMultiplexed.call`.
+        :param timeout: Seconds to wait for all replies, ``None`` waits
+                        forever.
+        :return: A list holding the result of every call, in order. Calls
+                 that failed have their :py:class:`~tinyrpc.exc.RPCError`
+                 in its place.
+        """
+        req = self.protocol.create_batch_request()
+        for call_args in calls:
+            req.append(self.protocol.create_request(*call_args))
+
+        try:
+            results = self._send(req, req)
+            # the replies of a batch arrive together, after the first one
+            # the others are ready as well
+            values = []
+            for result in results:
+                try:
+                    values.append(result.get(timeout=timeout))
+                except RPCError as e:
+                    if not result.ready():
+                        raise
+                    values.append(e)
+            return values
+        finally:
+            self._forget(req)
+
+    def handle_reply(self, reply):
+        """Complete the pending calls a reply belongs to.
+
+        Replies that cannot be parsed or do not belong to any pending call are
+        logged and dropped.
+
+        :param reply: A reply as received from the transport.
+        """
+        try:
+            response = self.protocol.parse_reply(reply)
+        except RPCError as e:
+            log.debug('Dropping invalid reply: %s', e)
+            return
+
+        if isinstance(response, RPCBatchResponse):
+            for subresponse in response:
+                self._complete(subresponse)
+        else:
+            self._complete(response)
+
+    def _complete(self, response):
+        result = self._pending.pop(response.unique_id, None)
+        if result is None:
+            log.debug('Dropping reply to unknown id %r', response.unique_id)
+            return
+
+        if hasattr(response, 'error'):
+            result.set_exception(
+                RPCError('Error calling remote procedure: %s' % response.error)
+            )
+        else:
+            result.set(response.result)
+
+    def receive_forever(self):
+        """Receive and handle replies until the transport fails.
+
+        Once the transport raises an exception, all pending calls fail with
+        that exception and the function returns. The client is closed then,
+        further calls raise an :py:class:`~tinyrpc.exc.RPCError`.
+        """
+        while True:
+            try:
+                reply = self.transport.receive_reply()
+            except Exception as e:
+                log.debug('Transport failed: %s', e)
+                self._failure = e
+                self._fail_pending(e)
+                return
+
+            self.handle_reply(reply)
+
+    def _fail_pending(self, exception):
+        pending, self._pending = self._pending, {}
+        for result in pending.itervalues():
+            result.set_exception(exception)
+
+
 class RPCProxy(object):
     """Create a new remote proxy object.
 
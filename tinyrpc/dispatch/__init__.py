@@ -1,12 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import cPickle
 import inspect
+import multiprocessing
+import time
 
 from ..exc import *
 
 
-def public(name=None):
+OUTCOME_OK = 'ok'
+"""The method returned a result."""
+
+OUTCOME_NOT_FOUND = 'not_found'
+"""No method with the requested name exists."""
+
+OUTCOME_METHOD_ERROR = 'method_error'
+"""The method raised an exception."""
+
+OUTCOME_SERVER_ERROR = 'server_error'
+"""An error occurred outside of the method."""
+
+
+def public(name=None, cpu_bound=False):
     """Set RPC name on function.
 
     This function decorator will set the ``_rpc_public_name`` attribute on a
@@ -17,6 +33,8 @@ def public(name=None):
     ``@public`` is a shortcut for ``@public()``.
 
     :param name: The name to register the function with.
+    :param cpu_bound: Mark the function as CPU bound, see
+                      :py:func:`~tinyrpc.dispatch.RPCDispatcher.add_method`.
     """
     # called directly with function
     if callable(name):
@@ -26,19 +44,139 @@ def public(name=None):
 
     def _(f):
         f._rpc_public_name = name or f.__name__
+        if cpu_bound:
+            f._rpc_cpu_bound = True
         return f
 
     return _
 
 
+def _call_method(obj, name, args, kwargs):
+    return getattr(obj, name)(*args, **kwargs)
+
+
+def _picklable_call(func, args, kwargs):
+    # bound methods cannot be pickled on Python 2, their instance and name
+    # can, the method is looked up again in the worker
+    if inspect.ismethod(func) and func.__self__ is not None:
+        return _call_method, (func.__self__, func.__name__, args, kwargs), {}
+    return func, args, kwargs
+
+
+def _until_error(iterable, errors):
+    try:
+        for item in iterable:
+            yield item
+    except Exception as e:
+        errors.append(e)
+
+
+class ProcessPool(object):
+    """Pool of worker processes running CPU bound methods.
+
+    Worker processes are started on first use or by calling
+    :py:func:`~tinyrpc.dispatch.ProcessPool.start`. Starting them before
+    serving requests avoids forking a process with open client connections.
+
+    :py:func:`~tinyrpc.dispatch.ProcessPool.apply` blocks the calling thread
+    until the result is available. Use
+    :py:class:`~tinyrpc.dispatch.gevent.GeventProcessPool` with
+    :py:mod:`gevent` based servers.
+
+    :param processes: The number of worker processes. Defaults to the number
+                      of CPUs.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self._pool = None
+
+    def start(self):
+        """Start the worker processes, if they are not running yet."""
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+
+    def close(self):
+        """Terminate all worker processes."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def apply(self, func, args, kwargs):
+        """Call ``func`` in a worker process and return its result.
+
+        Exceptions raised by ``func`` are raised again in the caller.
+
+        :param func: A picklable callable. Bound methods are called on a copy
+                     of their instance, which must be picklable.
+        :param args: Positional arguments for ``func``.
+        :param kwargs: Keyword arguments for ``func``.
+        """
+        self.start()
+        return self._pool.apply(*_picklable_call(func, args or (),
+                                                 kwargs or {}))
+
+
 class RPCDispatcher(object):
-    """Stores name-to-method mappings."""
+    """Stores name-to-method mappings.
+
+    Methods should only be registered using the methods of the dispatcher,
+    which keep the routing table used by
+    :py:func:`~tinyrpc.dispatch.RPCDispatcher.get_method` up to date.
+
+    :param process_pool: A :py:class:`~tinyrpc.dispatch.ProcessPool` to run
+                         methods marked as CPU bound in. If ``None``, these
+                         are called directly like all other methods.
+    :param batch_pool: A pool to handle the requests of a batch concurrently
+                       with, such as a :py:class:`gevent.pool.Pool` or a
+                       :py:class:`multiprocessing.pool.ThreadPool`. Its
+                       ``map`` and ``imap`` methods must return results in
+                       order. The size of the pool limits the concurrency. If ``None``, batch
+                       requests are handled one after another.
+    """
 
-    def __init__(self):
+    def __init__(self, process_pool=None, batch_pool=None):
         self.method_map = {}
         self.method_help = {}
         self.method_params = {}
         self.subdispatchers = {}
+        self.cpu_bound_methods = set()
+        """The names of the methods of this dispatcher marked as CPU
+        bound."""
+        self.process_pool = process_pool
+        self.batch_pool = batch_pool
+        self._routes = None
+        self._cpu_bound_routes = frozenset()
+        self._parents = []
+        self._pre_dispatch = []
+        self._post_dispatch = []
+
+    def add_hook(self, pre_dispatch=None, post_dispatch=None):
+        """Add callbacks run around the handling of every request.
+
+        ``pre_dispatch`` is called with the request before the method is
+        looked up. ``post_dispatch`` is called with the request, its response,
+        one of the ``OUTCOME_*`` constants of :py:mod:`tinyrpc.dispatch` and
+        the seconds it took to handle the request, including looking up the
+        method. Requests of a batch are passed one by one.
+
+        Hooks run in the dispatcher handling the request, those of
+        subdispatchers are not run. Exceptions raised by hooks are answered
+        with a :py:exc:`~tinyrpc.exc.ServerError`. Without any hooks, the
+        time is not taken.
+
+        :param pre_dispatch: Called as ``pre_dispatch(request)``.
+        :param post_dispatch: Called as
+                              ``post_dispatch(request, response, outcome,
+                              seconds)``.
+        """
+        if pre_dispatch is not None:
+            self._pre_dispatch.append(pre_dispatch)
+        if post_dispatch is not None:
+            self._post_dispatch.append(post_dispatch)
+        # dispatchers without hooks do not check for them on every request
+        self._dispatch = self._dispatch_with_hooks
 
     def add_subdispatch(self, dispatcher, prefix=''):
         """Adds a subdispatcher, possibly in its own namespace.
@@ -48,13 +186,23 @@ class RPCDispatcher(object):
                        available as prefix + their original name.
         """
         self.subdispatchers.setdefault(prefix, []).append(dispatcher)
+        dispatcher._parents.append(self)
+        self._invalidate_routes()
 
-    def add_method(self, f, name=None):
+    def add_method(self, f, name=None, cpu_bound=False):
         """Add a method to the dispatcher.
 
+        Methods marked as CPU bound are run in the ``process_pool`` of the
+        dispatcher handling the request instead of blocking the server. Their
+        arguments, results and the method itself must be picklable, e.g.
+        module level functions. Bound methods are called on a copy of their
+        instance, changes to it are not seen by the server. Methods that
+        cannot be pickled raise an :py:exc:`~tinyrpc.exc.RPCError` here.
+
         :param f: Callable to be added.
         :param name: Name to register it with. If ``None``, ``f.__name__`` will
                      be used.
+        :param cpu_bound: Whether or not to mark the method as CPU bound.
         """
         assert callable(f), "method argument must be callable"
                             # catches a few programming errors that are
@@ -65,7 +213,17 @@ class RPCDispatcher(object):
         if name in self.method_map:
             raise RPCError('Name %s already registered')
 
+        if cpu_bound:
+            try:
+                cPickle.dumps(_picklable_call(f, (), {}),
+                              cPickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                raise RPCError('CPU bound method %s cannot be sent to worker '
+                               'processes: %s' % (name, e))
+            self.cpu_bound_methods.add(name)
+
         self.method_map[name] = f
+        self._invalidate_routes()
 
         if hasattr(f, '_rpc_help_text'):
             self.method_help[name] = f._rpc_help_text
@@ -93,14 +251,34 @@ class RPCDispatcher(object):
         the client, as the exception is part of the requested method.
 
         :py:class:`~tinyrpc.RPCBatchRequest` instances are handled by handling
-        all its children in order and collecting the results, then returning an
-        :py:class:`~tinyrpc.RPCBatchResponse` with the results.
+        all its children and collecting the results in order, then returning
+        an :py:class:`~tinyrpc.RPCBatchResponse` with the results. Children
+        are handled concurrently if the dispatcher has a ``batch_pool``.
+        Batches that are parsed while being read, such as a
+        :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCBatchRequestStream`, are
+        handled as their requests arrive.
 
         :param request: An :py:func:`~tinyrpc.RPCRequest`.
         :return: An :py:func:`~tinyrpc.RPCResponse`.
         """
         if hasattr(request, 'create_batch_response'):
-            results = [self._dispatch(req) for req in request]
+            if isinstance(request, list):
+                requests, errors = request, None
+                concurrent = len(request) > 1
+            else:
+                # errors reading a stream are raised here, not in the pool
+                errors = []
+                requests = _until_error(request, errors)
+                concurrent = True
+
+            if self.batch_pool is not None and concurrent:
+                results = self.batch_pool.map(self._dispatch_subrequest,
+                                              requests)
+            else:
+                results = [self._dispatch_subrequest(req) for req in requests]
+
+            if errors:
+                raise errors[0]
 
             response = request.create_batch_response()
             if response is not None:
@@ -110,26 +288,97 @@ class RPCDispatcher(object):
         else:
             return self._dispatch(request)
 
+    def dispatch_iter(self, request):
+        """Handle the requests of a batch request, yielding their responses.
+
+        Responses are yielded in the order of the requests, each as soon as
+        it and all responses before it are ready. Like in
+        :py:func:`~tinyrpc.dispatch.RPCDispatcher.dispatch`, requests are
+        handled concurrently if the dispatcher has a ``batch_pool``.
+
+        Errors reading a batch that is parsed while being read are raised
+        after the responses to all requests before the error have been
+        yielded.
+
+        :param request: An :py:class:`~tinyrpc.RPCBatchRequest` or a batch
+                        request being read.
+        :return: An iterator over :py:class:`~tinyrpc.RPCResponse` instances
+                 or ``None`` for requests that expect no response.
+        """
+        errors = []
+        requests = _until_error(request, errors)
+
+        if self.batch_pool is not None:
+            for response in self.batch_pool.imap(self._dispatch_subrequest,
+                                                 requests):
+                yield response
+        else:
+            for req in requests:
+                yield self._dispatch_subrequest(req)
+
+        if errors:
+            raise errors[0]
+
+    def _dispatch_subrequest(self, request):
+        # requests of a batch that could not be parsed are errors, which are
+        # answered without calling anything
+        if isinstance(request, Exception):
+            return request.error_respond()
+        return self._dispatch(request)
+
     def _dispatch(self, request):
         try:
-            try:
-                method = self.get_method(request.method)
-            except KeyError as e:
-                return request.error_respond(MethodNotFoundError(e))
+            return self._call(request)[0]
+        except Exception as e:
+            # unexpected error, do not let client know what happened
+            return request.error_respond(ServerError())
+
+    def _dispatch_with_hooks(self, request):
+        # replaces _dispatch once hooks are added, so that dispatchers without
+        # hooks do not pay for the timing
+        start = time.time()
+        try:
+            for hook in self._pre_dispatch:
+                hook(request)
 
-            # we found the method
             try:
-                result = method(*request.args, **request.kwargs)
+                response, outcome = self._call(request)
             except Exception as e:
-                # an error occurred within the method, return it
-                return request.error_respond(e)
+                response = request.error_respond(ServerError())
+                outcome = OUTCOME_SERVER_ERROR
 
-            # respond with result
-            return request.respond(result)
+            seconds = time.time() - start
+            for hook in self._post_dispatch:
+                hook(request, response, outcome, seconds)
+            return response
         except Exception as e:
-            # unexpected error, do not let client know what happened
             return request.error_respond(ServerError())
 
+    def _call(self, request):
+        # looks up and calls the method, returning the response and the
+        # outcome. Errors outside of the method are raised.
+        try:
+            method = self.get_method(request.method)
+        except KeyError as e:
+            return (request.error_respond(MethodNotFoundError(e)),
+                    OUTCOME_NOT_FOUND)
+
+        # we found the method
+        try:
+            if (self.process_pool is not None and
+                    request.method in self._cpu_bound_routes):
+                result = self.process_pool.apply(
+                    method, request.args, request.kwargs
+                )
+            else:
+                result = method(*request.args, **request.kwargs)
+        except Exception as e:
+            # an error occurred within the method, return it
+            return request.error_respond(e), OUTCOME_METHOD_ERROR
+
+        # respond with result
+        return request.respond(result), OUTCOME_OK
+
     def get_method(self, name):
         """Retrieve a previously registered method.
 
@@ -138,25 +387,50 @@ class RPCDispatcher(object):
         If :py:func:`get_method` cannot find a method, every subdispatcher
         with a prefix matching the method name is checked as well.
 
+        Lookups are done in a table of all methods, including those of
+        subdispatchers, that is built on first use and rebuilt after methods or
+        subdispatchers have been added.
+
         If a method isn't found, a :py:class:`KeyError` is thrown.
 
         :param name: Callable to find.
         :param return: The callable.
         """
-        if name in self.method_map:
-            return self.method_map[name]
-
+        routes = self._routes
+        if routes is None:
+            routes = self._routes = self._build_routes()
+
+        return routes[name]
+
+    def _build_routes(self):
+        # flattens all methods reachable through this dispatcher into a
+        # single dict, with the same precedence get_method had when walking
+        # the subdispatchers on every lookup. The names of CPU bound methods
+        # among them are collected along the way.
+        routes = {}
+        cpu_bound = set()
         for prefix, subdispatchers in self.subdispatchers.iteritems():
-            if name.startswith(prefix):
-                for sd in subdispatchers:
-                    try:
-                        return sd.get_method(name[len(prefix):])
-                    except KeyError:
-                        pass
-
-        raise KeyError(name)
-
-    def public(self, name=None):
+            for sd in subdispatchers:
+                if sd._routes is None:
+                    sd._routes = sd._build_routes()
+                for name, method in sd._routes.iteritems():
+                    if prefix + name not in routes:
+                        routes[prefix + name] = method
+                        if name in sd._cpu_bound_routes:
+                            cpu_bound.add(prefix + name)
+
+        routes.update(self.method_map)
+        cpu_bound.difference_update(self.method_map)
+        cpu_bound.update(self.cpu_bound_methods)
+        self._cpu_bound_routes = cpu_bound
+        return routes
+
+    def _invalidate_routes(self):
+        self._routes = None
+        for parent in self._parents:
+            parent._invalidate_routes()
+
+    def public(self, name=None, cpu_bound=False):
         """Convenient decorator.
 
         Allows easy registering of functions to this dispatcher. Example:
@@ -178,13 +452,15 @@ class RPCDispatcher(object):
                     # ...
 
         :param name: Name to register callable with
+        :param cpu_bound: Passed on to
+                          :py:func:`~tinyrpc.dispatch.RPCDispatcher.add_method`.
         """
         if callable(name):
             self.add_method(name)
             return name
 
         def _(f):
-            self.add_method(f, name=name)
+            self.add_method(f, name=name, cpu_bound=cpu_bound)
             return f
 
         return _
@@ -203,7 +479,8 @@ class RPCDispatcher(object):
         for name, f in inspect.getmembers(
             obj, lambda f: callable(f) and hasattr(f, '_rpc_public_name')
         ):
-            dispatch.add_method(f, f._rpc_public_name)
+            dispatch.add_method(f, f._rpc_public_name,
+                                getattr(f, '_rpc_cpu_bound', False))
 
         # add to dispatchers
         self.add_subdispatch(dispatch, prefix)
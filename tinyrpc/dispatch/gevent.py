@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import gevent.threadpool
+
+from . import ProcessPool, _picklable_call
+
+
+class GeventProcessPool(ProcessPool):
+    """Process pool for :py:mod:`gevent` based servers.
+
+    Waiting for a result only blocks the calling greenlet. Results are waited
+    for in a pool of native threads, one per worker process, so other
+    greenlets keep running while a CPU bound method is executed.
+
+    :param processes: The number of worker processes. Defaults to the number
+                      of CPUs.
+    """
+
+    def __init__(self, processes=None):
+        super(GeventProcessPool, self).__init__(processes)
+        self._threadpool = gevent.threadpool.ThreadPool(self.processes)
+
+    def apply(self, func, args, kwargs):
+        self.start()
+        return self._threadpool.apply(
+            self._pool.apply, _picklable_call(func, args or (), kwargs or {})
+        )
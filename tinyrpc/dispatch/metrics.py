@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import threading
+
+from . import OUTCOME_NOT_FOUND, OUTCOME_METHOD_ERROR, OUTCOME_SERVER_ERROR
+
+
+class LatencyHistogram(object):
+    """Histogram of latencies with a relative error below 1%.
+
+    Like an HDR histogram, latencies are counted in buckets whose width grows
+    with their value: below 256 microseconds, every microsecond has a bucket
+    of its own, above, every power of two is split into 128 buckets. Memory
+    grows with the number of distinct buckets hit, not with the number of
+    latencies recorded.
+    """
+
+    _sub_bits = 7
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+
+    def _index(self, microseconds):
+        shift = microseconds.bit_length() - self._sub_bits - 1
+        if shift <= 0:
+            return microseconds
+        return (shift << self._sub_bits) + (microseconds >> shift)
+
+    def _highest_value(self, index):
+        # the highest value counted in the bucket, in microseconds
+        shift = (index >> self._sub_bits) - 1
+        if shift <= 0:
+            return index
+        value = (index - (shift << self._sub_bits)) << shift
+        return value + (1 << shift) - 1
+
+    def record(self, seconds):
+        """Count a latency.
+
+        :param seconds: The latency in seconds.
+        """
+        index = self._index(int(seconds * 1e6))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, fraction):
+        """Return the latency below which ``fraction`` of all latencies lie.
+
+        :param fraction: A number between 0 and 1.
+        :return: The latency in seconds, or ``None`` if nothing was recorded.
+        """
+        if not self.count:
+            return None
+
+        rank = max(1, int(round(fraction * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                break
+        return self._highest_value(index) / 1e6
+
+
+class DispatchMetrics(object):
+    """Collects latencies and errors of the requests of a dispatcher.
+
+    Metrics are collected by a post dispatch hook, a dispatcher without it
+    does not pay for them:
+
+    .. code-block:: python
+
+       metrics = DispatchMetrics()
+       dispatcher.add_hook(post_dispatch=metrics.record)
+
+    Latencies and errors are kept per method name. Requests of methods that
+    do not exist are only counted, as their names are chosen by clients.
+
+    :param quantiles: The quantiles exported per method.
+    """
+
+    def __init__(self, quantiles=(0.5, 0.9, 0.99)):
+        self.quantiles = quantiles
+        self.latencies = {}
+        """A :py:class:`~tinyrpc.dispatch.metrics.LatencyHistogram` per
+        method name."""
+        self.method_errors = {}
+        """The number of exceptions raised per method name."""
+        self.server_errors = {}
+        """The number of server errors per method name."""
+        self.not_found = 0
+        """The number of requests for methods that do not exist."""
+        self._lock = threading.Lock()
+
+    def record(self, request, response, outcome, seconds):
+        """Record a handled request, a post dispatch hook for
+        :py:func:`~tinyrpc.dispatch.RPCDispatcher.add_hook`."""
+        with self._lock:
+            if outcome == OUTCOME_NOT_FOUND:
+                self.not_found += 1
+                return
+
+            name = request.method
+            histogram = self.latencies.get(name)
+            if histogram is None:
+                histogram = self.latencies[name] = LatencyHistogram()
+            histogram.record(seconds)
+
+            if outcome == OUTCOME_METHOD_ERROR:
+                errors = self.method_errors
+            elif outcome == OUTCOME_SERVER_ERROR:
+                errors = self.server_errors
+            else:
+                return
+            errors[name] = errors.get(name, 0) + 1
+
+    def export_prometheus(self, prefix='tinyrpc'):
+        """Export the metrics in the Prometheus text format.
+
+        Latencies are exported as a summary with the configured quantiles,
+        errors as counters.
+
+        :param prefix: The prefix of all metric names.
+        :return: The metrics as a string.
+        """
+        with self._lock:
+            lines = [
+                '# HELP %s_request_seconds Time spent handling requests.'
+                % prefix,
+                '# TYPE %s_request_seconds summary' % prefix,
+            ]
+            for name in sorted(self.latencies):
+                histogram = self.latencies[name]
+                label = 'method="%s"' % _escape(name)
+                for quantile in self.quantiles:
+                    lines.append('%s_request_seconds{%s,quantile="%s"} %r' % (
+                        prefix, label, quantile,
+                        histogram.percentile(quantile)
+                    ))
+                lines.append('%s_request_seconds_sum{%s} %r'
+                             % (prefix, label, histogram.sum))
+                lines.append('%s_request_seconds_count{%s} %d'
+                             % (prefix, label, histogram.count))
+
+            for metric, help_text, counts in [
+                ('method_errors', 'Exceptions raised by methods.',
+                 self.method_errors),
+                ('server_errors', 'Errors outside of methods.',
+                 self.server_errors),
+            ]:
+                lines.append('# HELP %s_%s_total %s'
+                             % (prefix, metric, help_text))
+                lines.append('# TYPE %s_%s_total counter' % (prefix, metric))
+                for name in sorted(counts):
+                    lines.append('%s_%s_total{method="%s"} %d' % (
+                        prefix, metric, _escape(name), counts[name]
+                    ))
+
+            lines.extend([
+                '# HELP %s_method_not_found_total Requests for methods that '
+                'do not exist.' % prefix,
+                '# TYPE %s_method_not_found_total counter' % prefix,
+                '%s_method_not_found_total %d' % (prefix, self.not_found),
+            ])
+
+        return '\n'.join(lines) + '\n'
+
+    def wsgi_app(self, environ, start_response):
+        """WSGI application serving the metrics to Prometheus."""
+        body = self.export_prometheus()
+        start_response('200 OK', [
+            ('Content-Type', 'text/plain; version=0.0.4'),
+            ('Content-Length', str(len(body))),
+        ])
+        return [body]
+
+
+def _escape(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
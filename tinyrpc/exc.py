@@ -39,3 +39,7 @@ class MethodNotFoundError(RPCError):
 
 class ServerError(RPCError):
     """An internal error in the RPC system occurred."""
+
+
+class ServerBusyError(ServerError):
+    """The server is overloaded and did not handle the request."""
@@ -4,26 +4,43 @@ from ..exc import *
 
 
 class RPCRequest(object):
-    unique_id = None
-    """A unique ID to remember the request by. Protocol specific, may or
-    may not be set. This value should only be set by
-    :py:func:`~tinyrpc.RPCProtocol.create_request`.
+    """RPC call request class.
 
-    The ID allows client to receive responses out-of-order and still allocate
-    them to the correct request.
+    Base class for all deriving requests. Requests use ``__slots__``, deriving
+    classes should declare the slots of any attributes they add.
 
-    Only supported if the parent protocol has
-    :py:attr:`~tinyrpc.RPCProtocol.supports_out_of_order` set to ``True``.
-    """
+    .. py:attribute:: unique_id
+
+       A unique ID to remember the request by. Protocol specific, may or
+       may not be set. This value should only be set by
+       :py:func:`~tinyrpc.RPCProtocol.create_request`.
+
+       The ID allows client to receive responses out-of-order and still
+       allocate them to the correct request.
+
+       Only supported if the parent protocol has
+       :py:attr:`~tinyrpc.RPCProtocol.supports_out_of_order` set to ``True``.
 
-    method = None
-    """The name of the method to be called."""
+    .. py:attribute:: method
 
-    args = []
-    """The positional arguments of the method call."""
+       The name of the method to be called.
 
-    kwargs = {}
-    """The keyword arguments of the method call."""
+    .. py:attribute:: args
+
+       The positional arguments of the method call.
+
+    .. py:attribute:: kwargs
+
+       The keyword arguments of the method call.
+    """
+
+    __slots__ = ('unique_id', 'method', 'args', 'kwargs')
+
+    def __init__(self, method=None, args=None, kwargs=None, unique_id=None):
+        self.unique_id = unique_id
+        self.method = method
+        self.args = [] if args is None else args
+        self.kwargs = {} if kwargs is None else kwargs
 
     def error_respond(self, error):
         """Creates an error response.
@@ -93,9 +110,14 @@ class RPCResponse(object):
 
     Has an attribute ``result`` containing the result of the RPC call, unless
     an error occured, in which case an attribute ``error`` will contain the
-    error message."""
+    error message.
 
-    unique_id = None
+    Like requests, responses use ``__slots__``."""
+
+    __slots__ = ('unique_id',)
+
+    def __init__(self, unique_id=None):
+        self.unique_id = unique_id
 
     def serialize(self):
         """Returns a serialization of the response.
@@ -106,7 +128,11 @@ class RPCResponse(object):
 
 
 class RPCErrorResponse(RPCResponse):
-    pass
+    __slots__ = ('error',)
+
+    def __init__(self, unique_id=None, error=None):
+        super(RPCErrorResponse, self).__init__(unique_id)
+        self.error = error
 
 
 class RPCBatchResponse(list):
@@ -131,8 +157,9 @@ class RPCProtocol(object):
 
     Note that this usually depends on the generation of unique_ids, the
     generation of these may or may not be thread safe, depending on the
-    protocol. Ideally, only once instance of RPCProtocol should be used per
-    client."""
+    protocol. The protocols included generate ids using the thread safe
+    generators in :py:mod:`tinyrpc.protocols.ids`. Ideally, only one instance
+    of RPCProtocol should be used per client."""
 
     def create_request(self, method, args=None, kwargs=None, one_way=False):
         """Creates a new RPCRequest object.
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+
+class JSONCodec(object):
+    """Base class for JSON encoders and decoders.
+
+    Codecs wrap a JSON library. Instantiating a codec whose library is not
+    installed raises an :py:exc:`ImportError`.
+
+    Depending on the library, :py:func:`~tinyrpc.protocols.codec.JSONCodec.dumps`
+    returns either text or bytes, which are passed on to transports as is.
+    """
+
+    name = None
+    """The name used to select the codec in
+    :py:func:`~tinyrpc.protocols.codec.get_codec`."""
+
+    split_encoding = False
+    """If true, encoding the values of an object one by one and joining the
+    results is faster than encoding the whole object. Protocols then encode
+    the constant parts of their responses once and only encode the values
+    of each response."""
+
+    accepts_buffers = False
+    """If true, :py:func:`~tinyrpc.protocols.codec.JSONCodec.loads` accepts
+    any object supporting the buffer protocol, such as a
+    :py:class:`memoryview` of received data. Otherwise, protocols copy such
+    data into a string first."""
+
+    json_syntax = True
+    """If true, the output is JSON text. Arrays can then be written one
+    element at a time, see
+    :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCBatchResponseStream`."""
+
+    def dumps(self, obj):
+        """Encode ``obj``.
+
+        :return: A string containing the JSON representation of ``obj``.
+        """
+        raise NotImplementedError()
+
+    def loads(self, data):
+        """Decode ``data``.
+
+        :param data: A string containing JSON.
+        :return: The decoded object.
+        """
+        raise NotImplementedError()
+
+
+class OrjsonCodec(JSONCodec):
+    """Codec using :py:mod:`orjson`. Encodes to bytes."""
+
+    name = 'orjson'
+    split_encoding = True
+    accepts_buffers = True
+
+    def __init__(self):
+        import orjson
+        self.dumps = orjson.dumps
+        self.loads = orjson.loads
+
+
+class RapidjsonCodec(JSONCodec):
+    """Codec using :py:mod:`rapidjson`."""
+
+    name = 'rapidjson'
+    split_encoding = True
+
+    def __init__(self):
+        import rapidjson
+        self.dumps = rapidjson.dumps
+        self.loads = rapidjson.loads
+
+
+class UjsonCodec(JSONCodec):
+    """Codec using :py:mod:`ujson`."""
+
+    name = 'ujson'
+    split_encoding = True
+
+    def __init__(self):
+        import ujson
+        self.dumps = ujson.dumps
+        self.loads = ujson.loads
+
+
+class StdlibJSONCodec(JSONCodec):
+    """Codec using the :py:mod:`json` module of the standard library.
+
+    Always available, output is compact like that of the other codecs.
+    """
+
+    name = 'json'
+
+    def __init__(self):
+        import json
+        self._encoder = json.JSONEncoder(separators=(',', ':'))
+        self.dumps = self._encoder.encode
+        self.loads = json.loads
+
+
+CODECS = [OrjsonCodec, RapidjsonCodec, UjsonCodec, StdlibJSONCodec]
+"""All codec classes, in order of preference."""
+
+
+def get_codec(preferred=None):
+    """Return a codec instance.
+
+    :param preferred: The name of a codec, a list of names in order of
+                      preference or a codec instance, which is returned
+                      unchanged. Codec instances are objects with ``dumps``
+                      and ``loads`` methods, usually
+                      :py:class:`~tinyrpc.protocols.codec.JSONCodec`
+                      subclasses. If ``None``, all
+                      codecs in :py:data:`~tinyrpc.protocols.codec.CODECS`
+                      are tried.
+    :return: An instance of the first codec in ``preferred`` whose library
+             is installed. If none of them is, the standard library codec is
+             used. Codecs are stateless, all calls asking for the same codec
+             share one instance.
+    """
+    if hasattr(preferred, 'dumps'):
+        return preferred
+
+    if preferred is None:
+        names = [codec.name for codec in CODECS]
+    elif isinstance(preferred, basestring):
+        names = [preferred]
+    else:
+        names = list(preferred)
+
+    by_name = dict((codec.name, codec) for codec in CODECS)
+    for name in names:
+        try:
+            codec_class = by_name[name]
+        except KeyError:
+            raise ValueError('Unknown codec: %s' % name)
+
+        try:
+            return _get_instance(codec_class)
+        except ImportError:
+            pass
+
+    return _get_instance(StdlibJSONCodec)
+
+
+def _loadable(codec, data):
+    """Return ``data`` in a form the ``loads`` method of ``codec`` accepts."""
+    if isinstance(data, basestring) or getattr(codec, 'accepts_buffers',
+                                               False):
+        return data
+    return memoryview(data).tobytes()
+
+
+_instances = {}
+
+
+def _get_instance(codec_class):
+    if codec_class not in _instances:
+        _instances[codec_class] = codec_class()
+    return _instances[codec_class]
+
+
+default_codec = get_codec()
+"""The codec used by protocols that have not been given one explicitly."""
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+import os
+import random
+
+
+class CounterIdGenerator(object):
+    """Generates consecutive integers as unique ids.
+
+    Ids are taken from an :py:func:`itertools.count`, whose ``next`` is a
+    single operation under the GIL, so a generator can be shared by threads
+    without a lock. Ids are unique per generator only; processes forked after
+    creating it generate the same ids.
+
+    :param start: The first id.
+    """
+
+    def __init__(self, start=1):
+        self._counter = itertools.count(start)
+        self.value = start - 1
+        """The last id generated. With several threads generating ids, it may
+        briefly lag behind the last one."""
+
+    def __call__(self):
+        self.value = value = next(self._counter)
+        return value
+
+
+class PrefixedIdGenerator(object):
+    """Generates 63 bit integers unique across processes and hosts.
+
+    The upper 31 bits are a random prefix chosen per process, the lower 32
+    bits are taken from an :py:func:`itertools.count` like the ids of the
+    :py:class:`~tinyrpc.protocols.ids.CounterIdGenerator`. A new prefix is
+    chosen after a fork, so processes sharing a protocol instance created
+    before forking do not generate the same ids.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        prefix = random.SystemRandom().getrandbits(31)
+        self._counter = itertools.count(prefix << 32)
+
+    def __call__(self):
+        if os.getpid() != self._pid:
+            self._reset()
+        return next(self._counter)
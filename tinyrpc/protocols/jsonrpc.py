@@ -1,26 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import itertools
+import re
+
 from .. import RPCBatchProtocol, RPCRequest, RPCResponse, RPCErrorResponse, \
     InvalidRequestError, MethodNotFoundError, ServerError, \
     InvalidReplyError, RPCError, RPCBatchRequest, RPCBatchResponse
 
-import ujson as json
+from .codec import default_codec, get_codec, _loadable
+from .ids import CounterIdGenerator
 
 
 class FixedErrorMessageMixin(object):
+    _codec = default_codec
+
     def __init__(self, *args, **kwargs):
         if not args:
             args = [self.message]
         super(FixedErrorMessageMixin, self).__init__(*args, **kwargs)
 
     def error_respond(self):
-        response = JSONRPCErrorResponse()
-
-        response.error = self.message
-        response.unique_id = None
-        response._jsonrpc_error_code = self.jsonrpc_error_code
-        return response
+        return JSONRPCErrorResponse(None, self.message,
+                                    self.jsonrpc_error_code, self._codec)
 
 
 class JSONRPCParseError(FixedErrorMessageMixin, InvalidRequestError):
@@ -53,7 +55,73 @@ class JSONRPCServerError(FixedErrorMessageMixin, InvalidRequestError):
     message = ''
 
 
+def _response_encoder(response_class, codec, trailer=''):
+    """Create a function encoding success responses.
+
+    If the codec supports
+    :py:attr:`~tinyrpc.protocols.codec.JSONCodec.split_encoding`, a response
+    with placeholders for ``id`` and ``result`` is encoded once and the
+    output is split around the placeholders. The constant parts are then
+    joined with the encoded id and result of every response, which gives the
+    same output as encoding the complete response.
+
+    :param response_class: The class of the responses to encode.
+    :param codec: The codec to encode with.
+    :param trailer: A string to append to every response.
+    :return: A function taking a response and returning its encoding.
+    """
+    dumps = codec.dumps
+    join = ''.join
+
+    def encode_dict(response):
+        return dumps(response._to_dict()) + trailer
+
+    if not getattr(codec, 'split_encoding', False):
+        return encode_dict
+
+    placeholders = {'id': '__tinyrpc_id__', 'result': '__tinyrpc_result__'}
+    data = dumps(response_class(placeholders['id'],
+                                placeholders['result'])._to_dict())
+
+    parts = []
+    for key, placeholder in placeholders.iteritems():
+        encoded = dumps(placeholder)
+        if data.count(encoded) != 1:
+            return encode_dict
+        parts.append((data.index(encoded), len(encoded), key))
+    parts.sort()
+
+    (first_pos, first_len, first), (second_pos, second_len, second) = parts
+    if first_pos + first_len > second_pos:
+        return encode_dict
+
+    prefix = data[:first_pos]
+    middle = data[first_pos + first_len:second_pos]
+    suffix = data[second_pos + second_len:] + trailer
+
+    if first == 'id':
+        def encode(response):
+            return join((prefix, dumps(response.unique_id), middle,
+                         dumps(response.result), suffix))
+    else:
+        def encode(response):
+            return join((prefix, dumps(response.result), middle,
+                         dumps(response.unique_id), suffix))
+
+    return encode
+
+
 class JSONRPCSuccessResponse(RPCResponse):
+    __slots__ = ('result', '_codec')
+
+    # encoders by codec, see _response_encoder
+    _encoders = {}
+
+    def __init__(self, unique_id=None, result=None, codec=default_codec):
+        self.unique_id = unique_id
+        self.result = result
+        self._codec = codec
+
     def _to_dict(self):
         return {
             'jsonrpc': JSONRPCProtocol.JSON_RPC_VERSION,
@@ -62,10 +130,25 @@ class JSONRPCSuccessResponse(RPCResponse):
         }
 
     def serialize(self):
-        return json.dumps(self._to_dict())
+        try:
+            encode = self._encoders[self._codec]
+        except KeyError:
+            encode = self._encoders[self._codec] = _response_encoder(
+                JSONRPCSuccessResponse, self._codec
+            )
+        return encode(self)
 
 
 class JSONRPCErrorResponse(RPCErrorResponse):
+    __slots__ = ('_jsonrpc_error_code', '_codec')
+
+    def __init__(self, unique_id=None, error=None, code=None,
+                 codec=default_codec):
+        self.unique_id = unique_id
+        self.error = error
+        self._jsonrpc_error_code = code
+        self._codec = codec
+
     def _to_dict(self):
         return {
             'jsonrpc': JSONRPCProtocol.JSON_RPC_VERSION,
@@ -77,7 +160,7 @@ class JSONRPCErrorResponse(RPCErrorResponse):
         }
 
     def serialize(self):
-        return json.dumps(self._to_dict())
+        return self._codec.dumps(self._to_dict())
 
 
 def _get_code_and_message(error):
@@ -104,29 +187,30 @@ def _get_code_and_message(error):
 
 
 class JSONRPCRequest(RPCRequest):
+    __slots__ = ('_codec',)
+
+    def __init__(self, method=None, args=None, kwargs=None, unique_id=None,
+                 codec=default_codec):
+        # not calling the base class saves a call on every request
+        self.unique_id = unique_id
+        self.method = method
+        self.args = [] if args is None else args
+        self.kwargs = {} if kwargs is None else kwargs
+        self._codec = codec
+
     def error_respond(self, error):
         if not self.unique_id:
             return None
 
-        response = JSONRPCErrorResponse()
-
         code, msg = _get_code_and_message(error)
 
-        response.error = msg
-        response.unique_id = self.unique_id
-        response._jsonrpc_error_code = code
-        return response
+        return JSONRPCErrorResponse(self.unique_id, msg, code, self._codec)
 
     def respond(self, result):
-        response = JSONRPCSuccessResponse()
-
         if not self.unique_id:
             return None
 
-        response.result = result
-        response.unique_id = self.unique_id
-
-        return response
+        return JSONRPCSuccessResponse(self.unique_id, result, self._codec)
 
     def _to_dict(self):
         jdata = {
@@ -142,13 +226,27 @@ class JSONRPCRequest(RPCRequest):
         return jdata
 
     def serialize(self):
-        return json.dumps(self._to_dict())
+        return self._codec.dumps(self._to_dict())
 
 
 class JSONRPCBatchRequest(RPCBatchRequest):
+    _codec = default_codec
+
     def create_batch_response(self):
         if self._expects_response():
-            return JSONRPCBatchResponse()
+            response = JSONRPCBatchResponse()
+            response._codec = self._codec
+            return response
+
+    def create_batch_response_stream(self, responses):
+        """Create a response serialized while its responses are produced.
+
+        :param responses: An iterable yielding a response or ``None`` for each
+                          request of the batch, in order.
+        :return: A
+                 :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCBatchResponseStream`.
+        """
+        return JSONRPCBatchResponseStream(responses, self._codec)
 
     def _expects_response(self):
         for request in self:
@@ -160,63 +258,386 @@ class JSONRPCBatchRequest(RPCBatchRequest):
         return False
 
     def serialize(self):
-        return json.dumps([req._to_dict() for req in self])
+        return self._codec.dumps([req._to_dict() for req in self])
 
 
 class JSONRPCBatchResponse(RPCBatchResponse):
+    _codec = default_codec
+
     def serialize(self):
-        return json.dumps([resp._to_dict() for resp in self if resp is not None])
+        return self._codec.dumps([resp._to_dict() for resp in self if resp is not None])
+
+
+class JSONRPCBatchResponseStream(object):
+    """A batch response that is serialized while its responses are produced.
+
+    Returned by ``create_batch_response_stream`` of JSON-RPC batch requests.
+    :py:func:`~tinyrpc.protocols.jsonrpc.JSONRPCBatchResponseStream.serialize_iter`
+    yields the text of the response in chunks: the opening bracket together
+    with the first response, each further response as soon as it has been
+    produced and finally the closing bracket. Nothing is yielded if no
+    response is expected.
+
+    An :py:exc:`~tinyrpc.exc.RPCError` raised while producing the responses,
+    such as a parse error in a batch being read, is sent as the only response
+    if nothing has been yielded yet. Otherwise, it is added to the array of
+    responses, which is then closed.
+
+    Codecs whose output is not JSON text, such as MessagePack, cannot be
+    written one element at a time and are serialized in a single chunk once
+    all responses have been produced.
+
+    :param responses: An iterable yielding a response or ``None`` for each
+                      request of the batch, in order.
+    :param codec: The codec to encode the responses with.
+    """
+
+    def __init__(self, responses, codec=default_codec):
+        self._responses = responses
+        self._codec = codec
+
+    def serialize_iter(self):
+        """Serialize the response in chunks.
+
+        :return: An iterator over strings, which are empty if no response is
+                 expected.
+        """
+        if not getattr(self._codec, 'json_syntax', True):
+            response = self._collect()
+            if response:
+                yield self._codec.dumps([resp._to_dict() for resp in response])
+            return
+
+        dumps = self._codec.dumps
+        separator = '['
+        try:
+            for response in self._responses:
+                if response is not None:
+                    yield separator + dumps(response._to_dict())
+                    separator = ','
+        except RPCError as e:
+            error = e.error_respond()
+            if separator == '[':
+                yield error.serialize()
+                return
+            yield ',' + dumps(error._to_dict())
+
+        if separator == ',':
+            yield ']'
+
+    def _collect(self):
+        try:
+            return [resp for resp in self._responses if resp is not None]
+        except RPCError as e:
+            return [e.error_respond()]
+
+    def serialize(self):
+        """Serialize the whole response at once.
+
+        :return: A string, which is empty if no response is expected.
+        """
+        return ''.join(self.serialize_iter())
+
+
+class _ArraySplitter(object):
+    """Splits the text of a JSON array into the text of its elements.
+
+    Data is fed in chunks, each call to
+    :py:func:`~tinyrpc.protocols.jsonrpc._ArraySplitter.feed` returns the
+    elements completed by it. Only the text of the element currently being
+    read is buffered. Elements are not validated, they are expected to be
+    decoded afterwards.
+
+    Raises :py:exc:`ValueError` if the data is not a JSON array.
+    """
+
+    _TOKENS = re.compile(r'["\[\]{},]')
+    _STRING_END = re.compile(r'["\\]')
+
+    def __init__(self):
+        self.count = 0
+        self.done = False
+        self._buf = ''
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data):
+        buf = self._buf + data
+        pos = self._pos
+        start = self._start
+        depth = self._depth
+        in_string = self._in_string
+        elements = []
+
+        while not self.done:
+            if in_string:
+                m = self._STRING_END.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                if m.group() == '"':
+                    in_string = False
+                    pos = m.end()
+                elif m.end() < len(buf):
+                    # skip the escaped character
+                    pos = m.end() + 1
+                else:
+                    pos = m.start()
+                    break
+                continue
+
+            m = self._TOKENS.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+
+            token = m.group()
+            pos = m.end()
+            if token == '"':
+                in_string = True
+            elif token in '[{':
+                if depth == 0:
+                    if token != '[' or buf[:m.start()].strip():
+                        raise ValueError('Not a JSON array')
+                    start = pos
+                depth += 1
+            elif token in ']}':
+                depth -= 1
+                if depth == 0:
+                    if token != ']':
+                        raise ValueError('Mismatched brackets')
+                    self._add(elements, buf[start:m.start()], last=True)
+                    self.done = True
+            elif depth == 1:
+                self._add(elements, buf[start:m.start()])
+                start = pos
+
+        if self.done:
+            if buf[pos:].strip():
+                raise ValueError('Extra data after JSON array')
+            buf, pos, start = '', 0, 0
+        elif depth:
+            # drop the elements that have been returned already
+            buf, pos, start = buf[start:], pos - start, 0
+        elif buf.strip():
+            raise ValueError('Not a JSON array')
+
+        self._buf = buf
+        self._pos = pos
+        self._start = start
+        self._depth = depth
+        self._in_string = in_string
+        return elements
+
+    def _add(self, elements, element, last=False):
+        if not element.strip():
+            if last and not self.count:
+                return
+            raise ValueError('Missing array element')
+
+        self.count += 1
+        elements.append(element)
+
+    def close(self):
+        """Signal the end of the data.
+
+        Raises :py:exc:`ValueError` if the array is incomplete.
+        """
+        if not self.done:
+            raise ValueError('Incomplete JSON array')
+
+
+class JSONRPCBatchRequestStream(object):
+    """A batch request that is parsed while it is iterated over.
+
+    Returned by
+    :py:func:`~tinyrpc.protocols.jsonrpc.JSONRPCProtocol.parse_request_stream`.
+    Iterating yields the requests of the batch as soon as their text has been
+    read, instead of after the whole message has been received. The items are
+    the same as those of a :py:class:`~tinyrpc.RPCBatchRequest`. A stream can
+    only be iterated over once.
+
+    Malformed JSON, or an error reading the message, raises a
+    :py:exc:`~tinyrpc.protocols.jsonrpc.JSONRPCParseError` during
+    iteration, once it is read. Requests before it have been yielded already.
+
+    :param protocol: The protocol parsing the requests.
+    :param chunks: An iterable of strings containing the message.
+    """
+
+    def __init__(self, protocol, chunks):
+        self._protocol = protocol
+        self._chunks = chunks
+        self._codec = protocol.codec
+        self._expects_response = False
+
+    def __iter__(self):
+        splitter = _ArraySplitter()
+        try:
+            for data in self._chunks:
+                for element in splitter.feed(data):
+                    yield self._parse_element(element)
+            splitter.close()
+        except RPCError:
+            raise
+        except Exception:
+            # invalid JSON or a failure reading the message
+            raise self._error(JSONRPCParseError())
+
+        if not splitter.count:
+            raise self._error(JSONRPCInvalidRequestError())
+
+    def _parse_element(self, element):
+        try:
+            req = self._codec.loads(element)
+        except Exception:
+            raise self._error(JSONRPCParseError())
+
+        try:
+            request = self._protocol._parse_subrequest(req)
+        except RPCError as e:
+            request = e
+        except Exception:
+            request = JSONRPCInvalidRequestError()
+
+        if isinstance(request, Exception) or request.unique_id is not None:
+            self._expects_response = True
+        return request
+
+    def _error(self, e):
+        e._codec = self._codec
+        return e
+
+    def create_batch_response(self):
+        """Create a response for the requests of the batch.
+
+        Must be called after iterating over the batch, as whether or not a
+        response is expected depends on its requests.
+
+        :return: A :py:class:`~tinyrpc.RPCBatchResponse` or ``None``.
+        """
+        if self._expects_response:
+            response = JSONRPCBatchResponse()
+            response._codec = self._codec
+            return response
+
+    def create_batch_response_stream(self, responses):
+        """Create a response serialized while its responses are produced.
+
+        Can be created before iterating over the batch.
+
+        :param responses: An iterable yielding a response or ``None`` for each
+                          request of the batch, in order, usually while
+                          iterating over it.
+        :return: A
+                 :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCBatchResponseStream`.
+        """
+        return JSONRPCBatchResponseStream(responses, self._codec)
 
 
 class JSONRPCProtocol(RPCBatchProtocol):
     """JSONRPC protocol implementation.
 
-    Currently, only version 2.0 is supported."""
+    Currently, only version 2.0 is supported.
+
+    :param codec: The JSON codec to use, either a
+                  :py:class:`~tinyrpc.protocols.codec.JSONCodec` instance or
+                  the name of one or more codecs to try, see
+                  :py:func:`~tinyrpc.protocols.codec.get_codec`. Defaults to
+                  the fastest one installed.
+    :param id_generator: A callable returning the unique id of the next
+                         request, see :py:mod:`tinyrpc.protocols.ids`.
+                         Defaults to a
+                         :py:class:`~tinyrpc.protocols.ids.CounterIdGenerator`.
+    """
+
+    supports_out_of_order = True
 
     JSON_RPC_VERSION = "2.0"
-    _ALLOWED_REPLY_KEYS = sorted(['id', 'jsonrpc', 'error', 'result'])
-    _ALLOWED_REQUEST_KEYS = sorted(['id', 'jsonrpc', 'method', 'params'])
+    _ALLOWED_REPLY_KEYS = frozenset(['id', 'jsonrpc', 'error', 'result'])
+    _ALLOWED_REQUEST_KEYS = frozenset(['id', 'jsonrpc', 'method', 'params'])
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, codec=None, id_generator=None, *args, **kwargs):
         super(JSONRPCProtocol, self).__init__(*args, **kwargs)
-        self._id_counter = 0
+        self.codec = default_codec if codec is None else get_codec(codec)
+        self.id_generator = id_generator or CounterIdGenerator()
+
+    @property
+    def _id_counter(self):
+        return self._counter_id_generator().value
+
+    @_id_counter.setter
+    def _id_counter(self, value):
+        self._counter_id_generator()
+        self.id_generator = CounterIdGenerator(value + 1)
+
+    def _counter_id_generator(self):
+        # _id_counter only makes sense for consecutive ids, other generators
+        # must not be replaced by a counter behind the back of their owner
+        if not isinstance(self.id_generator, CounterIdGenerator):
+            raise TypeError(
+                '_id_counter requires a CounterIdGenerator, the id generator '
+                'is %r' % (self.id_generator,)
+            )
+        return self.id_generator
 
     def _get_unique_id(self):
-        self._id_counter += 1
-        return self._id_counter
+        return self.id_generator()
 
     def create_batch_request(self, requests=None):
-        return JSONRPCBatchRequest(requests or [])
+        request = JSONRPCBatchRequest(requests or [])
+        request._codec = self.codec
+        return request
 
     def create_request(self, method, args=None, kwargs=None, one_way=False):
         if args and kwargs:
             raise InvalidRequestError('Does not support args and kwargs at the same time')
 
-        request = JSONRPCRequest()
-
-        if not one_way:
-            request.unique_id = self._get_unique_id()
-
-        request.method = method
-        request.args = args
-        request.kwargs = kwargs
+        unique_id = None if one_way else self._get_unique_id()
 
-        return request
+        return JSONRPCRequest(method, args, kwargs, unique_id, self.codec)
 
     def parse_reply(self, data):
+        """Parse a reply, or the reply to a batch request.
+
+        :return: An :py:class:`~tinyrpc.RPCResponse` or, for an array of
+                 replies, a
+                 :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCBatchResponse`.
+        """
         try:
-            rep = json.loads(data)
+            rep = self.codec.loads(_loadable(self.codec, data))
         except Exception as e:
             raise InvalidReplyError(e)
 
-        for k in rep.iterkeys():
-            if not k in self._ALLOWED_REPLY_KEYS:
-                raise InvalidReplyError('Key not allowed: %s' % k)
+        if isinstance(rep, list):
+            if not rep:
+                raise InvalidReplyError('Empty batch reply.')
+
+            replies = JSONRPCBatchResponse()
+            replies._codec = self.codec
+            replies.extend(self._parse_subreply(subrep) for subrep in rep)
+            return replies
+
+        return self._parse_subreply(rep)
 
-        if not 'jsonrpc' in rep:
+    def _parse_subreply(self, rep):
+        if not isinstance(rep, dict):
+            raise InvalidReplyError('Reply must be an object.')
+
+        if not self._ALLOWED_REPLY_KEYS.issuperset(rep):
+            raise InvalidReplyError(
+                'Key not allowed: %s' % ', '.join(
+                    sorted(set(rep) - self._ALLOWED_REPLY_KEYS)
+                )
+            )
+
+        version = rep.get('jsonrpc')
+        if version is None:
             raise InvalidReplyError('Missing jsonrpc (version) in response.')
 
-        if rep['jsonrpc'] != self.JSON_RPC_VERSION:
+        if version != self.JSON_RPC_VERSION:
             raise InvalidReplyError('Wrong JSONRPC version')
 
         if not 'id' in rep:
@@ -228,27 +649,71 @@ class JSONRPCProtocol(RPCBatchProtocol):
             )
 
         if 'error' in rep:
-            response = JSONRPCErrorResponse()
             error = rep['error']
-            response.error = error['message']
-            response._jsonrpc_error_code = error['code']
-        else:
-            response = JSONRPCSuccessResponse()
-            response.result = rep.get('result', None)
-
-        response.unique_id = rep['id']
+            return JSONRPCErrorResponse(rep['id'], error['message'],
+                                        error['code'], self.codec)
 
-        return response
+        return JSONRPCSuccessResponse(rep['id'], rep['result'], self.codec)
 
     def parse_request(self, data):
         try:
-            req = json.loads(data)
+            return self._parse_request(data)
+        except RPCError as e:
+            # error responses are encoded like all other messages
+            e._codec = self.codec
+            raise
+
+    def parse_request_stream(self, chunks):
+        """Parse a request that is read in chunks.
+
+        Batch requests are not parsed at once, but while their requests are
+        being handled, see
+        :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCBatchRequestStream`. Other
+        requests are read completely and parsed like in
+        :py:func:`~tinyrpc.protocols.jsonrpc.JSONRPCProtocol.parse_request`.
+
+        :param chunks: An iterable of strings, for example the reads from a
+                       request body.
+        :return: A request or a
+                 :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCBatchRequestStream`.
+        """
+        chunks = iter(chunks)
+        head = ''
+        try:
+            for data in chunks:
+                head += data
+                if head.strip():
+                    break
+
+            batch = head.lstrip().startswith('[')
+            if not batch:
+                head += ''.join(chunks)
+        except Exception:
+            # the message could not be read, e.g. because the client went
+            # away or its body could not be decompressed
+            raise self._parse_error()
+
+        if batch:
+            return JSONRPCBatchRequestStream(
+                self, itertools.chain([head], chunks)
+            )
+        return self.parse_request(head)
+
+    def _parse_error(self):
+        e = JSONRPCParseError()
+        e._codec = self.codec
+        return e
+
+    def _parse_request(self, data):
+        try:
+            req = self.codec.loads(_loadable(self.codec, data))
         except Exception as e:
             raise JSONRPCParseError()
 
         if isinstance(req, list):
             # batch request
             requests = JSONRPCBatchRequest()
+            requests._codec = self.codec
             for subreq in req:
                 try:
                     requests.append(self._parse_subrequest(subreq))
@@ -264,27 +729,24 @@ class JSONRPCProtocol(RPCBatchProtocol):
             return self._parse_subrequest(req)
 
     def _parse_subrequest(self, req):
-        for k in req.iterkeys():
-            if not k in self._ALLOWED_REQUEST_KEYS:
-                raise JSONRPCInvalidRequestError()
-
-        if req.get('jsonrpc', None) != self.JSON_RPC_VERSION:
+        # validate the key set in one pass, then read every member only once
+        if not (isinstance(req, dict) and
+                self._ALLOWED_REQUEST_KEYS.issuperset(req)):
             raise JSONRPCInvalidRequestError()
 
-        if not isinstance(req['method'], basestring):
+        get = req.get
+        method = get('method')
+        if (get('jsonrpc') != self.JSON_RPC_VERSION or
+                not isinstance(method, basestring)):
             raise JSONRPCInvalidRequestError()
 
-        request = JSONRPCRequest()
-        request.method = str(req['method'])
-        request.unique_id = req.get('id', None)
-
-        params = req.get('params', None)
-        if params is not None:
-            if isinstance(params, list):
-                request.args = req['params']
-            elif isinstance(params, dict):
-                request.kwargs = req['params']
-            else:
-                raise JSONRPCInvalidParamsError()
+        params = get('params')
+        if params is None or isinstance(params, list):
+            kwargs = None
+        elif isinstance(params, dict):
+            params, kwargs = None, params
+        else:
+            raise JSONRPCInvalidParamsError()
 
-        return request
+        return JSONRPCRequest(str(method), params, kwargs, get('id'),
+                              self.codec)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import msgpack
+
+from .jsonrpc import JSONRPCProtocol
+
+
+# members of messages and of errors holding text rather than binary data
+_TEXT_MEMBERS = frozenset(['jsonrpc', 'method', 'message'])
+
+
+def _text_envelope(message):
+    # the envelope is built from byte strings on Python 2, which would be
+    # encoded using the binary type, peers expect its names and text as
+    # strings
+    envelope = {}
+    for key, value in message.iteritems():
+        if key in _TEXT_MEMBERS and isinstance(value, str):
+            value = value.decode('utf-8', 'replace')
+        elif key == 'error' and isinstance(value, dict):
+            value = _text_envelope(value)
+        envelope[key.decode('utf-8') if isinstance(key, str) else key] = value
+    return envelope
+
+
+class MSGPackCodec(object):
+    """Codec encoding messages using :py:mod:`msgpack`.
+
+    Byte strings are encoded using the binary type and decoded as such,
+    text is encoded using the string type and decoded as unicode. The member
+    names of messages, the version, method names and error messages are
+    always encoded as strings.
+    """
+
+    name = 'msgpack'
+    json_syntax = False
+    accepts_buffers = True
+
+    def dumps(self, obj):
+        if isinstance(obj, list):
+            obj = [_text_envelope(message) for message in obj]
+        else:
+            obj = _text_envelope(obj)
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+_msgpack_codec = MSGPackCodec()
+
+
+class MSGPackRPCProtocol(JSONRPCProtocol):
+    """JSON-RPC 2.0 messages encoded using MessagePack.
+
+    Requires :py:mod:`msgpack`. Requests, responses, batches, errors and
+    unique ids behave exactly like those of the
+    :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCProtocol`, but messages are
+    encoded as MessagePack instead of JSON text. Binary data in arguments and
+    results is carried as is, without needing to be encoded as a string.
+
+    Messages may contain any byte, so stream transports need to use
+    length-prefixed framing, see
+    :py:class:`~tinyrpc.transports.tcp.LengthPrefixFramer`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MSGPackRPCProtocol, self).__init__(
+            _msgpack_codec, *args, **kwargs
+        )
+
+    def parse_request_stream(self, chunks):
+        # batches are split as JSON text, read MessagePack completely
+        try:
+            data = ''.join(chunks)
+        except Exception:
+            raise self._parse_error()
+        return self.parse_request(data)
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import ujson as json
 import logging
 
 log = logging.getLogger('StratumRPCProtocol')
@@ -11,7 +10,10 @@ from .. import RPCBatchProtocol, RPCRequest, RPCResponse, RPCErrorResponse, \
     InvalidRequestError, MethodNotFoundError, InvalidReplyError
 
 from .jsonrpc import FixedErrorMessageMixin, JSONRPCInvalidRequestError, \
-    JSONRPCMethodNotFoundError, JSONRPCServerError, JSONRPCParseError, JSONRPCInvalidParamsError
+    JSONRPCMethodNotFoundError, JSONRPCServerError, JSONRPCParseError, JSONRPCInvalidParamsError, \
+    _response_encoder
+from .codec import default_codec, get_codec
+from .ids import CounterIdGenerator
 
 
 class StratumUnknownError(FixedErrorMessageMixin, InvalidRequestError):
@@ -45,6 +47,15 @@ class StratumNotSubscribedError(FixedErrorMessageMixin, InvalidRequestError):
 
 
 class StratumRPCSuccessResponse(RPCResponse):
+    __slots__ = ('result', '_codec')
+
+    _encoders = {}
+
+    def __init__(self, unique_id=None, result=None, codec=default_codec):
+        self.unique_id = unique_id
+        self.result = result
+        self._codec = codec
+
     def _to_dict(self):
         return {
             'id': self.unique_id,
@@ -53,13 +64,28 @@ class StratumRPCSuccessResponse(RPCResponse):
         }
 
     def serialize(self):
-        s = json.dumps(self._to_dict()) + '\n'
+        try:
+            encode = self._encoders[self._codec]
+        except KeyError:
+            encode = self._encoders[self._codec] = _response_encoder(
+                StratumRPCSuccessResponse, self._codec, '\n'
+            )
+        s = encode(self)
         log.debug(s)
         return s
 
 
 # hardcode traceback to be null for now
 class StratumRPCErrorResponse(RPCErrorResponse):
+    __slots__ = ('_jsonrpc_error_code', '_codec')
+
+    def __init__(self, unique_id=None, error=None, code=None,
+                 codec=default_codec):
+        self.unique_id = unique_id
+        self.error = error
+        self._jsonrpc_error_code = code
+        self._codec = codec
+
     def _to_dict(self):
         return {
             'id': self.unique_id,
@@ -68,7 +94,7 @@ class StratumRPCErrorResponse(RPCErrorResponse):
         }
 
     def serialize(self):
-        s = json.dumps(self._to_dict()) + '\n'
+        s = self._codec.dumps(self._to_dict()) + '\n'
         log.debug(s)
         return s
 
@@ -97,29 +123,29 @@ def _get_code_and_message(error):
 
 
 class StratumRPCRequest(RPCRequest):
+    __slots__ = ('_codec',)
+
+    def __init__(self, method=None, args=None, kwargs=None, unique_id=None,
+                 codec=default_codec):
+        self.unique_id = unique_id
+        self.method = method
+        self.args = [] if args is None else args
+        self.kwargs = {} if kwargs is None else kwargs
+        self._codec = codec
+
     def error_respond(self, error):
         if not self.unique_id:
             return None
 
-        response = StratumRPCErrorResponse()
-
         code, msg = _get_code_and_message(error)
 
-        response.error = msg
-        response.unique_id = self.unique_id
-        response._jsonrpc_error_code = code
-        return response
+        return StratumRPCErrorResponse(self.unique_id, msg, code, self._codec)
 
     def respond(self, result):
-        response = StratumRPCSuccessResponse()
-
         if not self.unique_id:
             return None
 
-        response.result = result
-        response.unique_id = self.unique_id
-
-        return response
+        return StratumRPCSuccessResponse(self.unique_id, result, self._codec)
 
     def _to_dict(self):
         jdata = {'method': self.method}
@@ -132,76 +158,105 @@ class StratumRPCRequest(RPCRequest):
         return jdata
 
     def serialize(self):
-        s = json.dumps(self._to_dict()) + '\n'
+        s = self._codec.dumps(self._to_dict()) + '\n'
         log.debug(s)
         return s
 
 
 class StratumRPCProtocol(RPCBatchProtocol):
-    """Stratum JSONRPC protocol implementation."""
+    """Stratum JSONRPC protocol implementation.
 
-    _ALLOWED_REPLY_KEYS = sorted(['id', 'result', 'error'])
-    _ALLOWED_REQUEST_KEYS = sorted(['id', 'method', 'params'])
+    :param codec: The JSON codec to use, see
+                  :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCProtocol`.
+    :param id_generator: A callable returning the unique id of the next
+                         request, see
+                         :py:class:`~tinyrpc.protocols.jsonrpc.JSONRPCProtocol`.
+    """
 
-    def __init__(self, *args, **kwargs):
+    supports_out_of_order = True
+
+    _ALLOWED_REPLY_KEYS = frozenset(['id', 'result', 'error'])
+    _ALLOWED_REQUEST_KEYS = frozenset(['id', 'method', 'params'])
+
+    def __init__(self, codec=None, id_generator=None, *args, **kwargs):
         super(StratumRPCProtocol, self).__init__(*args, **kwargs)
-        self._id_counter = 0
+        self.codec = default_codec if codec is None else get_codec(codec)
+        self.id_generator = id_generator or CounterIdGenerator()
+
+    @property
+    def _id_counter(self):
+        return self._counter_id_generator().value
+
+    @_id_counter.setter
+    def _id_counter(self, value):
+        self._counter_id_generator()
+        self.id_generator = CounterIdGenerator(value + 1)
+
+    def _counter_id_generator(self):
+        # _id_counter only makes sense for consecutive ids, other generators
+        # must not be replaced by a counter behind the back of their owner
+        if not isinstance(self.id_generator, CounterIdGenerator):
+            raise TypeError(
+                '_id_counter requires a CounterIdGenerator, the id generator '
+                'is %r' % (self.id_generator,)
+            )
+        return self.id_generator
 
     def _get_unique_id(self):
-        self._id_counter += 1
-        return self._id_counter
+        return self.id_generator()
 
     def create_request(self, method, args=None, kwargs=None, one_way=False):
         if args and kwargs:
             raise InvalidRequestError('Does not support args and kwargs at the same time')
 
-        request = StratumRPCRequest()
-
-        if not one_way:
-            request.unique_id = self._get_unique_id()
+        unique_id = None if one_way else self._get_unique_id()
 
-        request.method = method
-        request.args = args
-        request.kwargs = kwargs
-
-        return request
+        return StratumRPCRequest(method, args, kwargs, unique_id, self.codec)
 
     def parse_reply(self, data):
         try:
+            if not isinstance(data, basestring):
+                # messages are stripped, which needs a string
+                data = memoryview(data).tobytes()
             log.debug(data)
             data = data.strip()
-            rep = json.loads(data)
+            rep = self.codec.loads(data)
         except Exception as e:
             raise InvalidReplyError(e)
 
-        for k in rep.iterkeys():
-            if not k in self._ALLOWED_REPLY_KEYS:
-                raise InvalidReplyError('Key not allowed: %s' % k)
+        if not isinstance(rep, dict):
+            raise InvalidReplyError('Reply must be an object.')
+
+        if not self._ALLOWED_REPLY_KEYS.issuperset(rep):
+            raise InvalidReplyError(
+                'Key not allowed: %s' % ', '.join(
+                    sorted(set(rep) - self._ALLOWED_REPLY_KEYS)
+                )
+            )
 
-        if rep.get('id', None) is None:
+        unique_id = rep.get('id')
+        if unique_id is None:
             raise InvalidReplyError('Missing id in response')
 
         # if ('error' in rep) == ('result' in rep):
         #     raise InvalidReplyError('Reply must contain exactly one of result and error.')
 
-        if rep.get('error', None) is not None:
-            response = StratumRPCErrorResponse()
-            error = rep['error']
-            response._jsonrpc_error_code = error[0]
-            response.error = error[1]
-        else:
-            response = StratumRPCSuccessResponse()
-            response.result = rep.get('result', None)
-
-        response.unique_id = rep['id']
+        error = rep.get('error')
+        if error is not None:
+            return StratumRPCErrorResponse(unique_id, error[1], error[0],
+                                           self.codec)
 
-        return response
+        return StratumRPCSuccessResponse(unique_id, rep.get('result'),
+                                         self.codec)
 
     def parse_request(self, data):
         try:
+            if not isinstance(data, basestring):
+                # messages are stripped, which needs a string
+                data = memoryview(data).tobytes()
             log.debug(data)
             data = data.strip()
-            req = json.loads(data)
+            req = self.codec.loads(data)
         except Exception as e:
             raise JSONRPCParseError()
 
@@ -211,24 +266,23 @@ class StratumRPCProtocol(RPCBatchProtocol):
             return self._parse_subrequest(req)
 
     def _parse_subrequest(self, req):
-        for k in req.iterkeys():
-            if not k in self._ALLOWED_REQUEST_KEYS:
-                raise JSONRPCInvalidRequestError()
-
-        if not isinstance(req['method'], basestring):
+        # validate the key set in one pass, then read every member only once
+        if not (isinstance(req, dict) and
+                self._ALLOWED_REQUEST_KEYS.issuperset(req)):
             raise JSONRPCInvalidRequestError()
 
-        request = StratumRPCRequest()
-        request.method = req['method']
-        request.unique_id = req.get('id', None)
+        get = req.get
+        method = get('method')
+        if not isinstance(method, basestring):
+            raise JSONRPCInvalidRequestError()
 
-        params = req.get('params', None)
-        if params is not None:
-            if isinstance(params, list):
-                request.args = req['params']
-            elif isinstance(params, dict):
-                request.kwargs = req['params']
-            else:
-                raise JSONRPCInvalidParamsError()
+        params = get('params')
+        if params is None or isinstance(params, list):
+            kwargs = None
+        elif isinstance(params, dict):
+            params, kwargs = None, params
+        else:
+            raise JSONRPCInvalidParamsError()
 
-        return request
+        return StratumRPCRequest(method, params, kwargs, get('id'),
+                                 self.codec)
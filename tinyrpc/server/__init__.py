@@ -5,6 +5,9 @@
 # FIXME: needs checks for out-of-order, concurrency, etc as attributes
 from tinyrpc.exc import RPCError
 
+# messages that are passed as a whole, not in chunks
+_MESSAGE_TYPES = (basestring, bytearray, memoryview, buffer)
+
 
 class RPCServer(object):
     """High level RPC server.
@@ -12,11 +15,17 @@ class RPCServer(object):
     :param transport: The :py:class:`~tinyrpc.transports.RPCTransport` to use.
     :param protocol: The :py:class:`~tinyrpc.RPCProtocol` to use.
     :param dispatcher: The :py:class:`~tinyrpc.dispatch.RPCDispatcher` to use.
+    :param stream_batches: If true, the responses to a batch request are sent
+                           as they become ready, using
+                           :py:func:`~tinyrpc.transports.ServerTransport.send_reply_stream`,
+                           for protocols whose batch requests have a
+                           ``create_batch_response_stream`` method.
     """
-    def __init__(self, transport, protocol, dispatcher):
+    def __init__(self, transport, protocol, dispatcher, stream_batches=False):
         self.transport = transport
         self.protocol = protocol
         self.dispatcher = dispatcher
+        self.stream_batches = stream_batches
 
     def serve_forever(self):
         """Handle requests forever.
@@ -45,19 +54,63 @@ class RPCServer(object):
 
         # assuming protocol is threadsafe and dispatcher is threadsafe, as
         # long as its immutable
-
-        def handle_message(context, message):
-            try:
-                request = self.protocol.parse_request(message)
-            except RPCError as e:
-                response = e.error_respond()
-            else:
-                response = self.dispatcher.dispatch(request)
-
-            # send reply
-            self.transport.send_reply(context, response.serialize())
-
-        self._spawn(handle_message, context, message)
+        self._spawn(self.handle_message, context, message)
+
+    def handle_message(self, context, message):
+        """Handle a single message.
+
+        Decodes the message, dispatches the resulting request and sends the
+        response back using the transport.
+
+        :param context: The context as returned by the transport.
+        :param message: The message to handle, a string or an object
+                        supporting the buffer protocol, such as a
+                        :py:class:`memoryview`. Transports reading large
+                        messages in chunks pass an iterable of strings
+                        instead, which is parsed using the
+                        ``parse_request_stream`` method of the protocol, if
+                        it has one. Errors reading the chunks are answered
+                        with the parse error of the protocol.
+        """
+        try:
+            request = self._parse_request(message)
+            if self.stream_batches and \
+                    hasattr(request, 'create_batch_response_stream'):
+                response = request.create_batch_response_stream(
+                    self.dispatcher.dispatch_iter(request)
+                )
+                self.transport.send_reply_stream(context,
+                                                 response.serialize_iter())
+                return
+
+            response = self.dispatcher.dispatch(request)
+        except RPCError as e:
+            response = e.error_respond()
+
+        if response is None:
+            # nothing to answer, such as a notification, but the transport
+            # may be waiting for the reply
+            self.transport.send_reply_stream(context, [])
+            return
+
+        # send reply
+        self.transport.send_reply(context, response.serialize())
+
+    def _parse_request(self, message):
+        if isinstance(message, _MESSAGE_TYPES):
+            return self.protocol.parse_request(message)
+
+        parse_stream = getattr(self.protocol, 'parse_request_stream', None)
+        if parse_stream is not None:
+            return parse_stream(message)
+
+        try:
+            message = ''.join(message)
+        except Exception:
+            # the message could not be read, e.g. because the client went
+            # away, answer it like an empty one, which every protocol rejects
+            message = ''
+        return self.protocol.parse_request(message)
 
     def _spawn(self, func, *args, **kwargs):
         """Spawn a handler function.
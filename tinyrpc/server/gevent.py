@@ -2,12 +2,119 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import
+import logging
+
 import gevent
+import gevent.queue
+
+from . import RPCServer, _MESSAGE_TYPES
+from ..exc import RPCError, ServerBusyError
+
+log = logging.getLogger('RPCServer')
 
-from . import RPCServer
+OVERLOAD_BLOCK = 'block'
+"""Stop receiving messages until a worker is free."""
+
+OVERLOAD_REJECT = 'reject'
+"""Answer requests with a server busy error, drop notifications."""
+
+OVERLOAD_DROP = 'drop'
+"""Drop notifications, wait for a free worker for all other requests."""
 
 
 class RPCServerGreenlets(RPCServer):
     # documentation in docs because of dependencies
     def _spawn(self, func, *args, **kwargs):
         gevent.spawn(func, *args, **kwargs)
+
+
+class RPCServerGreenletPool(RPCServer):
+    # documentation in docs because of dependencies
+    def __init__(self, transport, protocol, dispatcher, pool_size=100,
+                 queue_size=None, overload=OVERLOAD_BLOCK,
+                 stream_batches=False):
+        super(RPCServerGreenletPool, self).__init__(
+            transport, protocol, dispatcher, stream_batches
+        )
+
+        if overload not in (OVERLOAD_BLOCK, OVERLOAD_REJECT, OVERLOAD_DROP):
+            raise ValueError('Invalid overload policy: %r' % overload)
+
+        self.pool_size = pool_size
+        self.overload = overload
+        self._queue = gevent.queue.Queue(queue_size or pool_size)
+        self._workers = []
+
+    def _start_workers(self):
+        self._workers = [gevent.spawn(self._work)
+                         for _ in xrange(self.pool_size)]
+
+    def _work(self):
+        while True:
+            context, message = self._queue.get()
+            try:
+                self.handle_message(context, message)
+            except Exception:
+                log.exception('Error handling message')
+
+    def receive_one_message(self):
+        if not self._workers:
+            self._start_workers()
+
+        context, message = self.transport.receive_message()
+
+        if self.overload == OVERLOAD_BLOCK:
+            self._queue.put((context, message))
+            return
+
+        try:
+            self._queue.put_nowait((context, message))
+        except gevent.queue.Full:
+            self._handle_overload(context, message)
+
+    def _handle_overload(self, context, message):
+        if not isinstance(message, _MESSAGE_TYPES):
+            # a message being read in chunks, read it completely
+            message = ''.join(message)
+
+        try:
+            request = self.protocol.parse_request(message)
+        except RPCError as e:
+            response = e.error_respond()
+        else:
+            if self._is_notification(request):
+                log.debug('Server busy, dropping notification')
+                response = None
+            elif self.overload == OVERLOAD_DROP:
+                self._queue.put((context, message))
+                return
+            else:
+                response = self._busy_respond(request)
+
+        if response is None:
+            # nothing to answer, but the transport may be waiting for the
+            # reply, see RPCServer.handle_message
+            self.transport.send_reply_stream(context, [])
+        else:
+            self.transport.send_reply(context, response.serialize())
+
+    def _is_notification(self, request):
+        if hasattr(request, 'create_batch_response'):
+            return all(not isinstance(req, Exception) and
+                       req.unique_id is None for req in request)
+        return request.unique_id is None
+
+    def _busy_respond(self, request):
+        error = ServerBusyError('Server busy')
+
+        if not hasattr(request, 'create_batch_response'):
+            return request.error_respond(error)
+
+        response = request.create_batch_response()
+        if response is not None:
+            response.extend(
+                req.error_respond() if isinstance(req, Exception)
+                else req.error_respond(error)
+                for req in request
+            )
+        return response
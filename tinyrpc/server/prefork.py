@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import errno
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+import gevent
+from gevent import socket
+
+# gevent.signal was renamed in gevent 1.5
+_signal_handler = getattr(gevent, 'signal_handler', None) or gevent.signal
+
+log = logging.getLogger('PreforkServer')
+
+_ACCEPTED = 0
+_ACTIVE = 1
+_COUNTERS = 2
+
+
+def create_listener(address, backlog=1024, reuse_port=True):
+    """Create a listening TCP socket.
+
+    :param address: A ``(host, port)`` tuple to bind to.
+    :param backlog: The listen backlog.
+    :param reuse_port: Set ``SO_REUSEPORT``, allowing multiple sockets to be
+                       bound to the same address. The kernel then distributes
+                       incoming connections among them.
+    :return: A :py:class:`gevent.socket.socket` instance.
+    """
+    family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+
+class PreforkServer(object):
+    """Supervisor running a server in multiple worker processes.
+
+    Each worker process calls ``factory`` with a listening socket. The factory
+    must return a :py:mod:`gevent` server instance (such as a
+    :py:class:`gevent.server.StreamServer` or
+    :py:class:`gevent.pywsgi.WSGIServer`) using that socket, and usually starts
+    an :py:class:`~tinyrpc.server.RPCServer` in a greenlet as well:
+
+    .. code-block:: python
+
+       def factory(listener):
+           transport = StreamServerTransport(queue_class=gevent.queue.Queue)
+           rpc_server = RPCServerGreenlets(transport, StratumRPCProtocol(),
+                                           dispatcher)
+           gevent.spawn(rpc_server.serve_forever)
+           return StreamServer(listener, transport.handle)
+
+       PreforkServer(factory, ('0.0.0.0', 3333)).serve_forever()
+
+    With ``reuse_port`` set, every worker binds its own ``SO_REUSEPORT``
+    socket and the kernel balances connections across workers. Otherwise, a
+    single listening socket is created by the supervisor and shared.
+
+    The supervisor restarts workers that exit unexpectedly. Workers failing
+    within ``min_uptime`` seconds of their start, e.g. because the factory
+    raises, are restarted after a delay that doubles with every consecutive
+    failure, up to ``max_respawn_delay`` seconds.
+
+    The supervisor handles the following signals:
+
+    ``SIGTERM``, ``SIGINT``
+        Stop all workers gracefully and exit.
+    ``SIGHUP``
+        Start a new set of workers, then stop the old ones gracefully.
+    ``SIGUSR1``
+        Log the current :py:func:`~tinyrpc.server.prefork.PreforkServer.stats`.
+
+    Workers stop gracefully on ``SIGTERM`` by no longer accepting connections
+    and waiting up to ``graceful_timeout`` seconds for open connections to
+    finish. They ignore ``SIGINT``, which a terminal sends to the supervisor
+    and the workers alike, and leave stopping to the supervisor.
+
+    :param factory: A callable creating the server of a worker.
+    :param address: The ``(host, port)`` address to listen on.
+    :param workers: The number of worker processes. Defaults to the number of
+                    CPUs.
+    :param reuse_port: Whether or not every worker binds its own socket.
+    :param graceful_timeout: Seconds to wait for workers to drain.
+    :param backlog: The listen backlog.
+    :param min_uptime: Workers exiting earlier than this many seconds after
+                       their start count as failing.
+    :param max_respawn_delay: The longest delay before restarting a failing
+                              worker.
+    """
+
+    respawn_delay = 0.1
+    """The delay before restarting a worker after its first failure."""
+
+    def __init__(self, factory, address, workers=None, reuse_port=True,
+                 graceful_timeout=30, backlog=1024, min_uptime=1.0,
+                 max_respawn_delay=30.0):
+        self.factory = factory
+        self.address = address
+        self.workers = workers or multiprocessing.cpu_count()
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.min_uptime = min_uptime
+        self.max_respawn_delay = max_respawn_delay
+        self.restarts = 0
+
+        self._listener = None
+        # old and new workers overlap during a graceful restart
+        self._slots = 2 * self.workers
+        self._counters = multiprocessing.RawArray(
+            'L', self._slots * _COUNTERS
+        )
+        self._children = {}
+        self._started = {}
+        self._retiring = {}
+        # slots of failed workers waiting to be restarted, with the time
+        self._respawns = {}
+        self._failures = 0
+        self._signals = []
+
+    def serve_forever(self):
+        """Start the workers and supervise them until stopped."""
+        if not self.reuse_port:
+            self._listener = create_listener(self.address, self.backlog,
+                                             reuse_port=False)
+
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP,
+                    signal.SIGUSR1):
+            signal.signal(sig, self._on_signal)
+
+        self._spawn_workers()
+
+        stopping = False
+        while self._children or self._retiring or not stopping:
+            while self._signals:
+                sig = self._signals.pop(0)
+                if sig in (signal.SIGTERM, signal.SIGINT) and not stopping:
+                    log.info('Stopping workers')
+                    stopping = True
+                    self._retire_all()
+                elif sig == signal.SIGHUP and not stopping:
+                    log.info('Restarting workers')
+                    self._retire_all()
+                    self._spawn_workers()
+                elif sig == signal.SIGUSR1:
+                    log.info('Stats: %r', self.stats())
+
+            self._reap(respawn=not stopping)
+            self._respawn_due()
+            self._kill_overdue()
+            time.sleep(0.1)
+
+        if self._listener is not None:
+            self._listener.close()
+
+    def stats(self):
+        """Return statistics aggregated over all running workers.
+
+        :return: A dictionary with the number of ``accepted`` and ``active``
+                 connections and ``restarts`` of workers, as well as a list
+                 of ``workers`` with per-process numbers.
+        """
+        slots = dict(self._children)
+        for pid, (slot, deadline) in self._retiring.iteritems():
+            slots[pid] = slot
+
+        workers = []
+        for pid, slot in sorted(slots.iteritems()):
+            base = slot * _COUNTERS
+            workers.append({
+                'pid': pid,
+                'retiring': pid in self._retiring,
+                'accepted': self._counters[base + _ACCEPTED],
+                'active': self._counters[base + _ACTIVE],
+            })
+
+        return {
+            'workers': workers,
+            'accepted': sum(w['accepted'] for w in workers),
+            'active': sum(w['active'] for w in workers),
+            'restarts': self.restarts,
+        }
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _free_slot(self):
+        used = set(self._children.values())
+        used.update(slot for slot, deadline in self._retiring.values())
+        used.update(self._respawns)
+        for slot in xrange(self._slots):
+            if slot not in used:
+                return slot
+
+    def _spawn_workers(self):
+        while len(self._children) + len(self._respawns) < self.workers:
+            slot = self._free_slot()
+            if slot is None:
+                log.warning('Previous workers still draining, not spawning '
+                            'more workers')
+                return
+            self._spawn_worker(slot)
+
+    def _spawn_worker(self, slot):
+        base = slot * _COUNTERS
+        for i in xrange(_COUNTERS):
+            self._counters[base + i] = 0
+
+        pid = os.fork()
+        if pid:
+            self._children[pid] = slot
+            self._started[pid] = time.time()
+            return
+
+        status = 0
+        try:
+            self._run_worker(slot)
+        except Exception:
+            log.exception('Worker failed')
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _run_worker(self, slot):
+        for sig in (signal.SIGTERM, signal.SIGHUP, signal.SIGUSR1):
+            signal.signal(sig, signal.SIG_DFL)
+        # Ctrl-C in a terminal interrupts the whole process group, workers
+        # are stopped gracefully by the SIGTERM of the supervisor instead
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        gevent.reinit()
+
+        listener = self._listener or create_listener(self.address,
+                                                     self.backlog)
+        server = self.factory(listener)
+        server.set_handle(self._count_connections(server.handle, slot))
+        # serve_forever stops the server again once it returns, waiting
+        # only stop_timeout seconds for connections
+        server.stop_timeout = self.graceful_timeout
+
+        _signal_handler(signal.SIGTERM, server.stop, self.graceful_timeout)
+        server.serve_forever()
+
+        # servers without a pool do not wait for their connections to finish
+        active = slot * _COUNTERS + _ACTIVE
+        deadline = time.time() + self.graceful_timeout
+        while self._counters[active] and time.time() < deadline:
+            gevent.sleep(0.1)
+
+    def _count_connections(self, handle, slot):
+        counters = self._counters
+        base = slot * _COUNTERS
+
+        def counting_handle(*args):
+            counters[base + _ACCEPTED] += 1
+            counters[base + _ACTIVE] += 1
+            try:
+                return handle(*args)
+            finally:
+                counters[base + _ACTIVE] -= 1
+
+        return counting_handle
+
+    def _retire_all(self):
+        deadline = time.time() + self.graceful_timeout + 5
+        for pid, slot in self._children.items():
+            self._retiring[pid] = (slot, deadline)
+            self._kill(pid, signal.SIGTERM)
+        self._children.clear()
+        self._respawns.clear()
+
+    def _kill_overdue(self):
+        now = time.time()
+        for pid, (slot, deadline) in self._retiring.items():
+            if deadline < now:
+                self._kill(pid, signal.SIGKILL)
+
+    def _kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _reap(self, respawn):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            if not pid:
+                return
+
+            started = self._started.pop(pid, None)
+            if self._retiring.pop(pid, None) is not None:
+                continue
+
+            slot = self._children.pop(pid, None)
+            if slot is None:
+                continue
+
+            if time.time() - started < self.min_uptime:
+                self._failures += 1
+                exponent = min(self._failures - 1, 30)
+                delay = min(self.respawn_delay * 2 ** exponent,
+                            self.max_respawn_delay)
+            else:
+                self._failures = 0
+                delay = 0
+
+            log.warning('Worker %d exited unexpectedly with status %d',
+                        pid, status)
+            if respawn:
+                if delay:
+                    log.warning('Restarting failing worker in %.1f seconds',
+                                delay)
+                self._respawns[slot] = time.time() + delay
+
+    def _respawn_due(self):
+        now = time.time()
+        for slot, due in self._respawns.items():
+            if due <= now:
+                del self._respawns[slot]
+                self.restarts += 1
+                self._spawn_worker(slot)
@@ -33,6 +33,62 @@ class ServerTransport(object):
         """
         raise NotImplementedError
 
+    def send_reply_stream(self, context, chunks):
+        """Sends a reply that is produced in chunks.
+
+        Transports that can do so write every chunk as soon as it has been
+        produced, instead of waiting for the whole reply. The base
+        implementation joins the chunks and calls
+        :py:func:`~tinyrpc.transport.Transport.send_reply`.
+
+        :param context: A context returned by
+                        :py:func:`~tinyrpc.transport.Transport.receive_message`.
+        :param chunks: An iterable of strings, which may be empty if no reply
+                       is to be sent.
+        """
+        self.send_reply(context, ''.join(chunks))
+
+
+# mark the start and end of a streamed reply on a context queue
+_STREAM_START = object()
+_STREAM_END = object()
+_STREAM_FAILED = object()
+
+
+def _put_reply_stream(context, chunks):
+    """Put a streamed reply on a context queue, chunk by chunk."""
+    context.put(_STREAM_START)
+    try:
+        for chunk in chunks:
+            context.put(chunk)
+    except:
+        context.put(_STREAM_FAILED)
+        raise
+    context.put(_STREAM_END)
+
+
+def _get_reply(context):
+    """Get a reply from a context queue.
+
+    :return: A string or, for streamed replies, an iterator over the chunks.
+             The iterator raises an :py:exc:`IOError` if producing the reply
+             failed after some of it has been sent.
+    """
+    reply = context.get()
+    if reply is _STREAM_START:
+        return _iter_reply_stream(context)
+    return reply
+
+
+def _iter_reply_stream(context):
+    while True:
+        chunk = context.get()
+        if chunk is _STREAM_END:
+            return
+        if chunk is _STREAM_FAILED:
+            raise IOError('Reply stream failed')
+        yield chunk
+
 
 class ClientTransport(object):
     """Base class for all client transports."""
@@ -51,3 +107,17 @@ class ClientTransport(object):
         :return: A string containing the server reply.
         """
         raise NotImplementedError
+
+    def receive_reply(self):
+        """Receive the next reply from the server.
+
+        Only supported by transports that allow multiple messages in flight.
+        These send messages using ``expect_reply=False`` and hand out replies
+        in the order they arrive, which is not necessarily the order the
+        messages have been sent in.
+
+        This function will block until one reply has been received.
+
+        :return: A string containing the server reply.
+        """
+        raise NotImplementedError
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import zlib
+
+
+class DecompressionError(ValueError):
+    """Compressed data is invalid or decompresses to more than allowed."""
+
+
+class Encoding(object):
+    """Base class for HTTP content encodings.
+
+    Encodings wrap a compression library. Instantiating an encoding whose
+    library is not installed raises an :py:exc:`ImportError`.
+
+    :param level: The compression level, the meaning depends on the library.
+                  If ``None``, a level trading some compression for speed is
+                  used.
+    """
+
+    name = None
+    """The name of the encoding in ``Content-Encoding`` headers."""
+
+    # without a limit of the output of the decompressor, data is decompressed
+    # in pieces of this size to check the output size
+    _piece_size = 1024
+
+    def compress(self, data):
+        """Compress ``data`` at once.
+
+        :return: The compressed string.
+        """
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.flush()
+
+    def compressor(self):
+        """Create an object compressing data incrementally.
+
+        Its ``compress`` method returns the compressed data of everything
+        passed in so far, so it can be decompressed by the peer right away.
+        ``flush`` returns the end of the compressed data.
+        """
+        raise NotImplementedError()
+
+    def decompressor(self):
+        """Create an object decompressing data incrementally.
+
+        Its ``decompress`` method returns the data decompressed so far or
+        raises a :py:exc:`~tinyrpc.transports.compression.DecompressionError`.
+        If its ``limits_output`` attribute is true, ``decompress`` takes the
+        maximum length of the data returned as second argument.
+        """
+        raise NotImplementedError()
+
+    def decompress(self, data, max_size=None):
+        """Decompress ``data``.
+
+        :param max_size: The maximum size of the decompressed data.
+        :return: The decompressed string.
+        """
+        return ''.join(self.decompress_iter([data], max_size))
+
+    def decompress_iter(self, chunks, max_size=None):
+        """Decompress data read in chunks.
+
+        :param chunks: An iterable of compressed strings.
+        :param max_size: The maximum size of the decompressed data. Reaching
+                         it raises a
+                         :py:exc:`~tinyrpc.transports.compression.DecompressionError`
+                         as soon as possible, without decompressing the rest.
+        :return: An iterator over decompressed strings.
+        """
+        decompressor = self.decompressor()
+        if max_size is not None and decompressor.limits_output:
+            return _decompress_limited(decompressor, chunks, max_size)
+        return self._decompress_pieces(decompressor, chunks, max_size)
+
+    def _decompress_pieces(self, decompressor, chunks, max_size):
+        size = 0
+        step = self._piece_size
+        for chunk in chunks:
+            for i in xrange(0, len(chunk), step):
+                data = decompressor.decompress(chunk[i:i + step])
+                size += len(data)
+                if max_size is not None and size > max_size:
+                    raise DecompressionError('Decompressed data too large')
+                if data:
+                    yield data
+
+
+def _decompress_limited(decompressor, chunks, max_size):
+    # at most one byte more than allowed is ever decompressed, however well
+    # the data compresses
+    size = 0
+    for chunk in chunks:
+        data = decompressor.decompress(chunk, max_size - size + 1)
+        size += len(data)
+        if size > max_size:
+            raise DecompressionError('Decompressed data too large')
+        if data:
+            yield data
+
+
+class _ZlibCompressor(object):
+    def __init__(self, level, wbits):
+        self._compressobj = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        return self._compressobj.compress(data) + \
+            self._compressobj.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        return self._compressobj.flush()
+
+
+class _ZlibDecompressor(object):
+    limits_output = True
+
+    def __init__(self, wbits):
+        self._decompressobj = zlib.decompressobj(wbits)
+
+    def decompress(self, data, max_length=0):
+        # output stops at max_length only when input is left over, so callers
+        # raising once they got max_length bytes never need the rest
+        try:
+            return self._decompressobj.decompress(data, max_length)
+        except zlib.error as e:
+            raise DecompressionError(str(e))
+
+
+class GzipEncoding(Encoding):
+    """The ``gzip`` encoding, using :py:mod:`zlib`. Always available."""
+
+    name = 'gzip'
+    _wbits = 16 + zlib.MAX_WBITS
+
+    def __init__(self, level=None):
+        self.level = 6 if level is None else level
+
+    def compress(self, data):
+        compressobj = zlib.compressobj(self.level, zlib.DEFLATED, self._wbits)
+        return compressobj.compress(data) + compressobj.flush()
+
+    def compressor(self):
+        return _ZlibCompressor(self.level, self._wbits)
+
+    def decompressor(self):
+        return _ZlibDecompressor(self._wbits)
+
+
+class DeflateEncoding(GzipEncoding):
+    """The ``deflate`` encoding (zlib format), using :py:mod:`zlib`. Always
+    available."""
+
+    name = 'deflate'
+    _wbits = zlib.MAX_WBITS
+
+
+class _BrotliCompressor(object):
+    def __init__(self, brotli, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class _BrotliDecompressor(object):
+    limits_output = False
+
+    def __init__(self, brotli):
+        self._brotli = brotli
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data):
+        try:
+            return self._decompressor.process(data)
+        except self._brotli.error as e:
+            raise DecompressionError(str(e))
+
+
+class BrotliEncoding(Encoding):
+    """The ``br`` encoding, using :py:mod:`brotli`."""
+
+    name = 'br'
+
+    def __init__(self, level=None):
+        import brotli
+        self._brotli = brotli
+        self.level = 5 if level is None else level
+
+    def compress(self, data):
+        return self._brotli.compress(data, quality=self.level)
+
+    def compressor(self):
+        return _BrotliCompressor(self._brotli, self.level)
+
+    def decompressor(self):
+        return _BrotliDecompressor(self._brotli)
+
+
+class _ZstdCompressor(object):
+    def __init__(self, zstandard, level):
+        self._zstandard = zstandard
+        self._compressobj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressobj.compress(data) + self._compressobj.flush(
+            self._zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def flush(self):
+        return self._compressobj.flush()
+
+
+class _ZstdDecompressor(object):
+    limits_output = False
+
+    def __init__(self, zstandard):
+        self._zstandard = zstandard
+        self._decompressobj = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        try:
+            return self._decompressobj.decompress(data)
+        except self._zstandard.ZstdError as e:
+            raise DecompressionError(str(e))
+
+
+class ZstdEncoding(Encoding):
+    """The ``zstd`` encoding, using :py:mod:`zstandard`."""
+
+    name = 'zstd'
+
+    def __init__(self, level=None):
+        import zstandard
+        self._zstandard = zstandard
+        self.level = 3 if level is None else level
+
+    def compress(self, data):
+        return self._zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressor(self):
+        return _ZstdCompressor(self._zstandard, self.level)
+
+    def decompressor(self):
+        return _ZstdDecompressor(self._zstandard)
+
+
+ENCODINGS = [ZstdEncoding, BrotliEncoding, GzipEncoding, DeflateEncoding]
+"""All encoding classes, in order of preference."""
+
+
+def get_encodings(preferred=None):
+    """Return instances of the available encodings.
+
+    :param preferred: A list of encoding names in order of preference. If
+                      ``None``, all encodings in
+                      :py:data:`~tinyrpc.transports.compression.ENCODINGS`
+                      are tried.
+    :return: A list of instances of the encodings whose library is
+             installed, in order of preference.
+    """
+    by_name = dict((encoding.name, encoding) for encoding in ENCODINGS)
+    if preferred is None:
+        preferred = [encoding.name for encoding in ENCODINGS]
+
+    encodings = []
+    for name in preferred:
+        try:
+            encoding_class = by_name[name]
+        except KeyError:
+            raise ValueError('Unknown encoding: %s' % name)
+
+        try:
+            encodings.append(encoding_class())
+        except ImportError:
+            pass
+
+    return encodings
+
+
+def negotiate(accept_encoding, encodings):
+    """Choose an encoding accepted by a client.
+
+    :param accept_encoding: The value of the ``Accept-Encoding`` header of the
+                            request or ``None``.
+    :param encodings: The encodings to choose from, in order of preference.
+    :return: The accepted encoding with the highest quality value, the first
+             one in ``encodings`` among equals, or ``None`` if no encoding
+             is accepted.
+    """
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    default = qualities.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding.name, default)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
@@ -4,9 +4,11 @@
 from Queue import Queue
 import threading
 import requests
+import requests.adapters
 import websocket
 
 from . import ServerTransport, ClientTransport
+from .compression import get_encodings
 
 
 class HttpPostClientTransport(ClientTransport):
@@ -15,22 +17,90 @@ class HttpPostClientTransport(ClientTransport):
     Requires :py:mod:`requests`. Submits messages to a server using the body of
     an ``HTTP`` ``POST`` request. Replies are taken from the responses body.
 
+    Connections are kept alive and reused by later requests, saving a TCP
+    (and TLS) handshake per call. They are pooled by a single
+    :py:class:`requests.adapters.HTTPAdapter`, which is safe to use from
+    multiple threads. Every thread (or greenlet, if :py:mod:`threading` is
+    patched by :py:mod:`gevent`) sends requests using its own
+    :py:class:`requests.Session` mounting that adapter, so a transport can be
+    shared freely.
+
     :param endpoint: The URL to send ``POST`` data to.
+    :param pool_size: The maximum number of connections kept open to the
+                      server. More concurrent requests open additional
+                      connections, which are closed afterwards.
+    :param keep_alive: Whether or not to reuse connections. If false,
+                       every request asks the server to close the connection.
+    :param retries: The number of times failing to connect is retried.
+                    Requests are not sent again once they might have reached
+                    the server.
+    :param timeout: The timeout in seconds for connecting and for reading
+                    the reply, or a ``(connect, read)`` tuple. ``None`` waits
+                    forever.
+    :param compress_threshold: If set, messages of at least this many bytes
+                               are compressed using ``encoding``. The server
+                               has to accept compressed requests, like the
+                               :py:class:`~tinyrpc.transports.wsgi.WsgiServerTransport`
+                               does. Compressed replies are accepted and
+                               decompressed by :py:mod:`requests` in any
+                               case.
+    :param encoding: The name of the content encoding to compress messages
+                     with, see :py:mod:`tinyrpc.transports.compression`.
     :param kwargs: Additional parameters for :py:func:`requests.post`.
     """
-    def __init__(self, endpoint, **kwargs):
+    def __init__(self, endpoint, pool_size=10, keep_alive=True, retries=0,
+                 timeout=None, compress_threshold=None, encoding='gzip',
+                 **kwargs):
         self.endpoint = endpoint
         self.request_kwargs = kwargs
+        self.request_kwargs.setdefault('timeout', timeout)
+        self.keep_alive = keep_alive
+        self.compress_threshold = compress_threshold
+        if compress_threshold is not None:
+            encodings = get_encodings([encoding])
+            if not encodings:
+                raise ImportError('Library for %s encoding not installed'
+                                  % encoding)
+            self.encoding = encodings[0]
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retries
+        )
+        self._local = threading.local()
+
+    def _get_session(self):
+        try:
+            return self._local.session
+        except AttributeError:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+            return session
 
     def send_message(self, message, expect_reply=True):
         if not isinstance(message, str):
             raise TypeError('str expected')
 
-        r = requests.post(self.endpoint, data=message, **self.request_kwargs)
+        kwargs = self.request_kwargs
+        if self.compress_threshold is not None and \
+                len(message) >= self.compress_threshold:
+            message = self.encoding.compress(message)
+            kwargs = dict(kwargs, headers=dict(
+                kwargs.get('headers') or {},
+                **{'Content-Encoding': self.encoding.name}
+            ))
+
+        r = self._get_session().post(self.endpoint, data=message, **kwargs)
 
         if expect_reply:
             return r.content
 
+    def close(self):
+        """Close all pooled connections."""
+        self.adapter.close()
+
 
 class HttpWebSocketClientTransport(ClientTransport):
     """HTTP WebSocket based client transport.
@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import logging
+import Queue
+import urlparse
+
+import gevent
+import gevent.event
+import gevent.queue
+from gevent import socket
+from gevent.lock import Semaphore
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+import h2.settings
+
+from . import ServerTransport, ClientTransport
+
+log = logging.getLogger('Http2Transport')
+
+
+class _Http2Connection(object):
+    """An HTTP/2 connection shared by concurrently running greenlets.
+
+    All access to the :py:class:`h2.connection.H2Connection` state machine
+    and writes to the socket are serialized by a lock. Data is sent in frames
+    fitting the flow control window, senders wait for the peer to open the
+    window if it is exhausted.
+    """
+
+    read_size = 65536
+
+    def __init__(self, sock, client_side):
+        self.sock = sock
+        # frames are written as soon as they are ready, waiting for the ACK of
+        # the previous ones delays every request by the delayed ACK timeout
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn = h2.connection.H2Connection(h2.config.H2Configuration(
+            client_side=client_side, header_encoding=None
+        ))
+        self.closed = False
+        self._lock = Semaphore()
+        self._window_updated = gevent.event.Event()
+
+    def initiate(self, settings=None):
+        with self._lock:
+            self.conn.initiate_connection()
+            if settings:
+                self.conn.update_settings(settings)
+            self._flush()
+
+    def receive(self):
+        """Read from the socket and handle the data.
+
+        :return: A list of :py:mod:`h2.events`, empty once the connection has
+                 been closed.
+        """
+        try:
+            data = self.sock.recv(self.read_size)
+        except socket.error:
+            data = ''
+
+        if not data:
+            self.close()
+            return []
+
+        with self._lock:
+            try:
+                events = self.conn.receive_data(data)
+            except h2.exceptions.ProtocolError:
+                log.debug('Http2Transport:protocol error, closing connection')
+                self._flush()
+                self.closed = True
+                events = []
+
+            for event in events:
+                if isinstance(event, (h2.events.WindowUpdated,
+                                        h2.events.RemoteSettingsChanged)):
+                    self._window_updated.set()
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    self.closed = True
+            self._flush()
+
+        if self.closed:
+            self.close()
+        return events
+
+    def acknowledge(self, received):
+        """Open the flow control windows again for processed data.
+
+        :param received: A list of ``(stream_id, length)`` tuples with the
+                         flow controlled length of
+                         :py:class:`h2.events.DataReceived` events. Data of
+                         streams that have been closed or reset only opens
+                         the window of the connection.
+        """
+        if not received:
+            return
+
+        with self._lock:
+            for stream_id, length in received:
+                self.conn.acknowledge_received_data(length, stream_id)
+            self._flush()
+
+    def open_stream(self, headers):
+        """Start a request on a new stream.
+
+        :return: The id of the stream or ``None`` if the peer does not allow
+                 any more concurrent streams.
+        """
+        with self._lock:
+            if self.closed:
+                raise socket.error('Connection closed')
+            if self.conn.open_outbound_streams >= \
+                    self.conn.remote_settings.max_concurrent_streams:
+                return None
+
+            # ids have to be used in order, take one and send it at once
+            stream_id = self.conn.get_next_available_stream_id()
+            self.conn.send_headers(stream_id, headers)
+            self._flush()
+            return stream_id
+
+    def send_headers(self, stream_id, headers, end_stream=False):
+        with self._lock:
+            self.conn.send_headers(stream_id, headers, end_stream=end_stream)
+            self._flush()
+
+    def send_data(self, stream_id, data, end_stream=False):
+        """Send data on a stream, waiting for flow control as needed."""
+        view = memoryview(data)
+        while True:
+            with self._lock:
+                size = min(self.conn.local_flow_control_window(stream_id),
+                           self.conn.max_outbound_frame_size, len(view))
+                if size > 0 or not view:
+                    last = size == len(view)
+                    self.conn.send_data(stream_id, view[:size].tobytes(),
+                                        end_stream=end_stream and last)
+                    self._flush()
+                    if last:
+                        return
+                    view = view[size:]
+                    continue
+
+                # cooperative scheduling: no update can arrive before waiting
+                self._window_updated.clear()
+
+            if self.closed:
+                raise socket.error('Connection closed')
+            self._window_updated.wait()
+
+    def end_stream(self, stream_id):
+        with self._lock:
+            self.conn.end_stream(stream_id)
+            self._flush()
+
+    def reset_stream(self, stream_id):
+        with self._lock:
+            self.conn.reset_stream(stream_id)
+            self._flush()
+
+    def _flush(self):
+        data = self.conn.data_to_send()
+        if data and not self.closed:
+            try:
+                self.sock.sendall(data)
+            except socket.error:
+                log.debug('Http2Transport:socket error sending data')
+                self.closed = True
+
+    def close(self):
+        if not self.closed:
+            with self._lock:
+                self.conn.close_connection()
+                self._flush()
+            self.closed = True
+        self._window_updated.set()
+        self.sock.close()
+
+
+class _Http2Stream(object):
+    """Reply context of a request received on an HTTP/2 connection."""
+
+    def __init__(self, connection, stream_id):
+        self.connection = connection
+        self.stream_id = stream_id
+
+    def put(self, reply):
+        self._send([('content-length', str(len(reply)))], [reply])
+
+    def put_stream(self, chunks):
+        self._send([], chunks)
+
+    def _send(self, headers, chunks):
+        try:
+            self.connection.send_headers(self.stream_id,
+                                         [(':status', '200')] + headers)
+            for chunk in chunks:
+                if chunk:
+                    self.connection.send_data(self.stream_id, chunk)
+            self.connection.end_stream(self.stream_id)
+        except (h2.exceptions.ProtocolError, socket.error):
+            log.debug('Http2Transport:stream %d closed before reply was sent',
+                      self.stream_id)
+
+
+class Http2ServerTransport(ServerTransport):
+    """HTTP/2 server transport.
+
+    Requires :py:mod:`h2`. Like the
+    :py:class:`~tinyrpc.transports.tcp.StreamServerTransport`, this
+    transport is served by a :py:class:`gevent.server.StreamServer`, which
+    calls :py:func:`~tinyrpc.transports.http2.Http2ServerTransport.handle`
+    for every connection:
+
+    .. code-block:: python
+
+       transport = Http2ServerTransport(queue_class=gevent.queue.Queue)
+       StreamServer(('0.0.0.0', 8080), transport.handle).start()
+
+    Every ``POST`` request on a connection is a message, answered by the
+    reply sent in its context. Any number of requests are received
+    concurrently on a single connection, each in its own HTTP/2 stream, so
+    replies may be sent in any order. Other request methods are answered
+    with a ``405`` status. Only HTTP/2 is spoken, clients must know that in
+    advance (cleartext ``h2c`` with prior knowledge) or negotiate it using
+    TLS ALPN if the server wraps its sockets using an
+    :py:class:`ssl.SSLContext` advertising the ``h2`` protocol.
+
+    Replies sent using
+    :py:func:`~tinyrpc.transports.ServerTransport.send_reply_stream` are sent
+    in data frames as they are produced.
+
+    Requests with a body larger than ``max_content_length`` are answered
+    with a ``413`` status and their stream is reset. The flow control window
+    of a stream is only opened again for data that is kept, so clients
+    cannot make the server buffer more than the limit plus one window.
+
+    :param queue_class: The Queue class to use for the messages.
+    :param max_concurrent_streams: The number of requests a client may have
+                                   in flight on a single connection.
+    :param max_content_length: The maximum request body size allowed, or
+                               ``None`` for no limit. Should be set to a sane
+                               value to prevent DoS-Attacks.
+    """
+
+    def __init__(self, queue_class=Queue.Queue, max_concurrent_streams=100,
+                 max_content_length=1024 * 1024):
+        self.messages = queue_class()
+        self.max_concurrent_streams = max_concurrent_streams
+        self.max_content_length = max_content_length
+
+    def receive_message(self):
+        return self.messages.get()
+
+    def send_reply(self, context, reply):
+        if not isinstance(reply, basestring):
+            raise TypeError('string expected')
+
+        context.put(reply)
+
+    def send_reply_stream(self, context, chunks):
+        context.put_stream(chunks)
+
+    def handle(self, sock, address):
+        """StreamServer handler function.
+
+        Reads requests from the connection until it is closed. Replies are
+        written by
+        :py:func:`~tinyrpc.transports.http2.Http2ServerTransport.send_reply`.
+        """
+        connection = _Http2Connection(sock, client_side=False)
+        connection.initiate({
+            h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS:
+                self.max_concurrent_streams,
+        })
+
+        bodies = {}
+        sizes = {}
+        while not connection.closed:
+            received = []
+            for event in connection.receive():
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = dict(event.headers)
+                    if headers.get(':method') != 'POST':
+                        self._refuse(connection, event, '405')
+                    elif self._too_large(headers.get('content-length', 0)):
+                        self._refuse(connection, event, '413')
+                    else:
+                        bodies[event.stream_id] = []
+                        sizes[event.stream_id] = 0
+                elif isinstance(event, h2.events.DataReceived):
+                    body = bodies.get(event.stream_id)
+                    if body is not None:
+                        sizes[event.stream_id] += len(event.data)
+                        if self._too_large(sizes[event.stream_id]):
+                            del bodies[event.stream_id]
+                            self._refuse(connection, event, '413')
+                        else:
+                            body.append(event.data)
+                    # after a refusal, this only opens the connection window
+                    received.append((event.stream_id,
+                                     event.flow_controlled_length))
+                elif isinstance(event, h2.events.StreamEnded):
+                    sizes.pop(event.stream_id, None)
+                    body = bodies.pop(event.stream_id, None)
+                    if body is not None:
+                        context = _Http2Stream(connection, event.stream_id)
+                        self.messages.put((context, ''.join(body)))
+                elif isinstance(event, h2.events.StreamReset):
+                    sizes.pop(event.stream_id, None)
+                    bodies.pop(event.stream_id, None)
+            connection.acknowledge(received)
+
+    def _too_large(self, size):
+        if self.max_content_length is None:
+            return False
+        try:
+            return int(size) > self.max_content_length
+        except ValueError:
+            return False
+
+    def _refuse(self, connection, event, status):
+        connection.send_headers(event.stream_id, [(':status', status)],
+                                end_stream=True)
+        try:
+            # stop a client that is still sending
+            connection.reset_stream(event.stream_id)
+        except h2.exceptions.StreamClosedError:
+            pass
+
+
+class Http2ClientTransport(ClientTransport):
+    """HTTP/2 client transport.
+
+    Requires :py:mod:`h2` and :py:mod:`gevent`. Messages are sent as ``POST``
+    requests to ``endpoint``, all over a single connection that is
+    established on ``__init__``. Every request uses its own HTTP/2 stream,
+    so any number of greenlets can send messages concurrently without
+    waiting for each other's replies. Requests beyond the number of
+    concurrent streams allowed by the server wait for earlier ones to
+    finish.
+
+    Replies are read by a greenlet that is started along with the
+    connection. Messages sent using ``expect_reply=False`` have their replies
+    passed to
+    :py:func:`~tinyrpc.transports.http2.Http2ClientTransport.receive_reply`
+    in the order they arrive, which allows using the transport with a
+    :py:class:`~tinyrpc.client.RPCClientMultiplexed`. Empty replies, as sent
+    for notifications, are skipped.
+
+    :param endpoint: The URL to send ``POST`` requests to, ``http`` for
+                     cleartext HTTP/2 with prior knowledge or ``https``.
+    :param timeout: Seconds to wait for a reply, ``None`` waits forever.
+    :param ssl_context: The :py:class:`ssl.SSLContext` used for ``https``
+                        endpoints. It has to offer ``h2`` using ALPN. If
+                        ``None``, a default context is created.
+    :param kwargs: Additional parameters for
+                   :py:func:`gevent.socket.create_connection`.
+    """
+
+    def __init__(self, endpoint, timeout=None, ssl_context=None, **kwargs):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        url = urlparse.urlsplit(endpoint)
+        secure = url.scheme == 'https'
+        self._authority = url.netloc
+        self._scheme = url.scheme
+        self._path = url.path or '/'
+        if url.query:
+            self._path += '?' + url.query
+
+        sock = socket.create_connection(
+            (url.hostname, url.port or (443 if secure else 80)), **kwargs
+        )
+        if secure:
+            if ssl_context is None:
+                from gevent import ssl
+                ssl_context = ssl.create_default_context()
+                ssl_context.set_alpn_protocols(['h2'])
+            sock = ssl_context.wrap_socket(sock, server_hostname=url.hostname)
+
+        self._connection = _Http2Connection(sock, client_side=True)
+        self._connection.initiate()
+        self._pending = {}
+        self._bodies = {}
+        self._stream_closed = gevent.event.Event()
+        self._replies = gevent.queue.Queue()
+        self._reader = gevent.spawn(self._read_forever)
+
+    def send_message(self, message, expect_reply=True):
+        if not isinstance(message, basestring):
+            raise TypeError('str expected')
+
+        result = gevent.event.AsyncResult() if expect_reply else None
+        stream_id = self._open_stream(result, [
+            (':method', 'POST'),
+            (':scheme', self._scheme),
+            (':authority', self._authority),
+            (':path', self._path),
+            ('content-length', str(len(message))),
+        ])
+
+        try:
+            self._connection.send_data(stream_id, message, end_stream=True)
+        except Exception:
+            self._pending.pop(stream_id, None)
+            raise
+
+        if expect_reply:
+            try:
+                return result.get(timeout=self.timeout)
+            except gevent.Timeout:
+                self._pending.pop(stream_id, None)
+                self._connection.reset_stream(stream_id)
+                raise socket.timeout('Timed out waiting for the reply')
+
+    def _open_stream(self, result, headers):
+        while True:
+            stream_id = self._connection.open_stream(headers)
+            if stream_id is not None:
+                self._pending[stream_id] = result
+                return stream_id
+
+            self._stream_closed.clear()
+            self._stream_closed.wait()
+
+    def receive_reply(self):
+        """Wait for the next reply to a message sent without expecting one.
+
+        :return: The body of the reply.
+        """
+        reply = self._replies.get()
+        if isinstance(reply, Exception):
+            # let other receivers fail as well
+            self._replies.put(reply)
+            raise reply
+        return reply
+
+    def _read_forever(self):
+        while not self._connection.closed:
+            received = []
+            for event in self._connection.receive():
+                if isinstance(event, h2.events.ResponseReceived):
+                    self._bodies[event.stream_id] = []
+                elif isinstance(event, h2.events.DataReceived):
+                    body = self._bodies.get(event.stream_id)
+                    if body is not None:
+                        body.append(event.data)
+                    received.append((event.stream_id,
+                                     event.flow_controlled_length))
+                elif isinstance(event, h2.events.StreamEnded):
+                    body = ''.join(self._bodies.pop(event.stream_id, ()))
+                    self._complete(event.stream_id, body)
+                elif isinstance(event, h2.events.StreamReset):
+                    self._bodies.pop(event.stream_id, None)
+                    self._complete(event.stream_id, socket.error(
+                        'Stream reset by server'
+                    ))
+            self._connection.acknowledge(received)
+
+        error = socket.error('Connection closed by server')
+        for result in self._pending.values():
+            if result is not None:
+                result.set_exception(error)
+        self._pending.clear()
+        self._replies.put(error)
+        self._stream_closed.set()
+
+    def _complete(self, stream_id, reply):
+        self._stream_closed.set()
+        if stream_id not in self._pending:
+            return
+
+        result = self._pending.pop(stream_id)
+        if result is None:
+            if reply and not isinstance(reply, Exception):
+                self._replies.put(reply)
+        elif isinstance(reply, Exception):
+            result.set_exception(reply)
+        else:
+            result.set(reply)
+
+    def close(self):
+        self._connection.close()
+        self._reader.join()
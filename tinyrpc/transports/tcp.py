@@ -2,9 +2,231 @@ import logging
 log = logging.getLogger('StreamTransport')
 
 import Queue
+import struct
+import time
 import gevent
 from gevent import socket
-from . import ServerTransport, ClientTransport
+from gevent.lock import Semaphore
+from . import ServerTransport, ClientTransport, _put_reply_stream, _get_reply
+from ..exc import RPCError
+
+
+class FramingError(RPCError):
+    """A frame received on a stream could not be decoded, e.g. because it
+    exceeds the maximum allowed frame size."""
+
+
+class NewlineFramer(object):
+    """Incremental framer for newline-delimited messages.
+
+    Received data is appended to an internal buffer using
+    :py:func:`~tinyrpc.transports.tcp.NewlineFramer.feed`, complete frames are
+    then taken out using
+    :py:func:`~tinyrpc.transports.tcp.NewlineFramer.frames`. Partial frames
+    stay in the buffer until the rest of the data has arrived, so any number of
+    pipelined messages can be carried by a single read.
+
+    This is the framing used by Stratum. Empty lines are ignored.
+
+    :param max_frame_size: The maximum size of a single frame. A frame
+                           exceeding it raises a
+                           :py:exc:`~tinyrpc.transports.tcp.FramingError`.
+    """
+
+    delimiter = b'\n'
+
+    def __init__(self, max_frame_size=1024 * 1024):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._scan_pos = 0
+
+    def feed(self, data):
+        """Append received data to the buffer.
+
+        :param data: A string, :py:class:`bytearray` or :py:class:`memoryview`.
+        """
+        self._buffer += data
+
+    def frames(self):
+        """Yield all complete frames currently in the buffer.
+
+        Consumed data is removed from the buffer once, after the last complete
+        frame has been taken out.
+
+        :return: An iterator over frames, as strings, without the delimiter.
+        """
+        buf = self._buffer
+        start = 0
+        try:
+            while True:
+                end = buf.find(self.delimiter, self._scan_pos)
+                if end == -1:
+                    self._scan_pos = len(buf)
+                    break
+
+                if end - start > self.max_frame_size:
+                    raise FramingError('Frame exceeds maximum size')
+
+                frame = bytes(buf[start:end])
+                start = self._scan_pos = end + 1
+                if frame:
+                    yield frame
+        finally:
+            if start:
+                del buf[:start]
+                self._scan_pos -= start
+
+        if len(buf) > self.max_frame_size:
+            raise FramingError('Frame exceeds maximum size')
+
+    def frame(self, message):
+        """Frame an outgoing message.
+
+        Messages already ending in a newline (such as serialized Stratum
+        messages) are passed on unchanged.
+
+        :param message: The message to frame.
+        :return: The data to write to the stream.
+        """
+        if message.endswith(self.delimiter):
+            return message
+        return message + self.delimiter
+
+    def frame_stream(self, chunks):
+        """Frame an outgoing message produced in chunks.
+
+        :param chunks: An iterable of strings making up the message. If it is
+                       empty, nothing is sent.
+        :return: An iterator over the data to write to the stream, yielding
+                 every chunk as soon as it has been produced.
+        """
+        last = None
+        for chunk in chunks:
+            if chunk:
+                last = chunk
+                yield chunk
+
+        if last is not None and not last.endswith(self.delimiter):
+            yield self.delimiter
+
+
+class LengthPrefixFramer(object):
+    """Incremental framer for length-prefixed messages.
+
+    Every frame is preceeded by its size as a 4 byte unsigned integer in network
+    byte order. Messages may contain any byte, including newlines, making this
+    framing suitable for binary protocols.
+
+    The interface is the same as that of
+    :py:class:`~tinyrpc.transports.tcp.NewlineFramer`.
+
+    :param max_frame_size: The maximum size of a single frame.
+    """
+
+    _header = struct.Struct('!I')
+
+    def __init__(self, max_frame_size=1024 * 1024):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+
+    def frames(self):
+        buf = self._buffer
+        header_size = self._header.size
+        start = 0
+        try:
+            while len(buf) - start >= header_size:
+                size, = self._header.unpack_from(buf, start)
+                if size > self.max_frame_size:
+                    raise FramingError('Frame exceeds maximum size')
+
+                end = start + header_size + size
+                if end > len(buf):
+                    break
+
+                frame = bytes(buf[start + header_size:end])
+                start = end
+                yield frame
+        finally:
+            if start:
+                del buf[:start]
+
+    def frame(self, message):
+        return self._header.pack(len(message)) + message
+
+    def frame_stream(self, chunks):
+        # the size has to be known up front
+        message = ''.join(chunks)
+        if message:
+            yield self.frame(message)
+
+
+class _StreamConnection(object):
+    """Reply context of a pipelined connection.
+
+    Replies are written to the socket as soon as they are put, writes of
+    concurrently finishing requests are serialized by a lock.
+
+    Other replies cannot be written in the middle of a frame, so a streamed
+    reply would have to hold the lock while its chunks are produced. For a
+    streamed batch, producing a chunk means running a method, and one slow
+    batch would hold up all other replies of the connection. Streamed replies
+    are therefore produced completely before the lock is taken. They are not
+    sent incrementally, but never delay other replies.
+
+    Every message handed on takes one of ``max_in_flight`` slots, which is
+    given back by its reply. Taking a slot blocks while all are in use, which
+    stops the connection from being read.
+    """
+
+    def __init__(self, sock, address, framer, max_in_flight):
+        self.sock = sock
+        self.address = address
+        self.framer = framer
+        self._write_lock = Semaphore()
+        self._max_in_flight = max_in_flight
+        self._in_flight = Semaphore(max_in_flight)
+
+    def reserve(self):
+        """Wait for a free slot for the next message."""
+        self._in_flight.acquire()
+
+    def wait_idle(self, timeout):
+        """Wait until all messages have been answered.
+
+        :param timeout: The most seconds to wait.
+        :return: Whether or not all messages have been answered.
+        """
+        deadline = time.time() + timeout
+        for _ in xrange(self._max_in_flight):
+            if not self._in_flight.acquire(
+                    timeout=max(0, deadline - time.time())):
+                return False
+        return True
+
+    def put(self, reply):
+        try:
+            self._put_frame(self.framer.frame(reply))
+        finally:
+            self._in_flight.release()
+
+    def put_stream(self, chunks):
+        try:
+            data = ''.join(self.framer.frame_stream(chunks))
+            if data:
+                self._put_frame(data)
+        finally:
+            self._in_flight.release()
+
+    def _put_frame(self, data):
+        with self._write_lock:
+            try:
+                self.sock.sendall(data)
+            except socket.error:
+                log.debug('StreamServerTransport:socket error sending to %s',
+                          self.address)
 
 
 class StreamServerTransport(ServerTransport):
@@ -22,14 +244,46 @@ class StreamServerTransport(ServerTransport):
     for the chosen concurrency mechanism (i.e. when using :py:mod:`gevent`,
     set it to :py:class:`gevent.queue.Queue`).
 
+    Messages are delimited on the stream using ``framer_class``, which
+    defaults to newline-delimited framing as used by Stratum. Use
+    :py:class:`~tinyrpc.transports.tcp.LengthPrefixFramer` for binary
+    protocols.
+
+    By default, every connection handles one request at a time. If
+    ``pipelined`` is set, the handler keeps reading messages while earlier
+    ones are still being processed and every reply is written as soon as it
+    is sent. Replies may then arrive out of order, so this requires a protocol
+    that supports matching replies by id (such as JSON-RPC or Stratum) and a
+    server that handles messages concurrently, like
+    :py:class:`~tinyrpc.server.gevent.RPCServerGreenlets`. Replies sent using
+    :py:func:`~tinyrpc.transports.ServerTransport.send_reply_stream` are then
+    written once they are complete, so that a slow streamed batch does not
+    delay the replies to other messages.
+
+    A pipelined connection has at most ``max_in_flight`` messages handled at
+    once, further messages are not read until a reply has been sent. Every
+    message must therefore be replied to, as done by
+    :py:class:`~tinyrpc.server.RPCServer`. If the client closes the
+    connection or stops sending, the replies to messages still being handled
+    are sent before the connection is closed.
+
     :param queue_class: The Queue class to use.
+    :param framer_class: The framer class to use, see
+                         :py:class:`~tinyrpc.transports.tcp.NewlineFramer`.
+    :param pipelined: Whether to handle requests of a connection concurrently.
+    :param max_in_flight: The most messages of a pipelined connection handled
+                          at once.
     """
 
-    def __init__(self, queue_class=Queue.Queue):
+    def __init__(self, queue_class=Queue.Queue, framer_class=NewlineFramer,
+                 pipelined=False, max_in_flight=100):
         self._config_buffer = 4096
         self._config_timeout = 90
         self._socket_error = False
         self._queue_class = queue_class
+        self._framer_class = framer_class
+        self.pipelined = pipelined
+        self.max_in_flight = max_in_flight
         self.messages = queue_class()
 
     def receive_message(self):
@@ -41,35 +295,33 @@ class StreamServerTransport(ServerTransport):
 
         context.put(reply)
 
-    def _get_data(self, sock, address):
-        """ Retrieves a data chunk from the socket. """
+    def send_reply_stream(self, context, chunks):
+        if isinstance(context, _StreamConnection):
+            context.put_stream(chunks)
+        else:
+            _put_reply_stream(context, chunks)
+
+    def _get_data(self, sock, address, view):
+        """Reads a data chunk from the socket into ``view``.
+
+        :return: A tuple consisting of ``(nbytes, sock_error)``.
+        """
         sock_error = False
         try:
-            data = sock.recv(self._config_buffer)
+            nbytes = sock.recv_into(view)
         except socket.timeout:
             sock_error = True
-            data = None
+            nbytes = 0
             log.debug('StreamServerTransport:socket timeout from %s', address)
         except socket.error:
             sock_error = True
-            data = None
+            nbytes = 0
             log.debug('StreamServerTransport:socket error from %s', address)
 
-        return data, sock_error
-
-    def _get_msg(self, sock, address):
-        sock_error = False
-        chunks = []
-        while True:
-            data, sock_error = self._get_data(sock, address)
-            if not data:
-                break
-            chunks.append(data)
-            if len(data) < self._config_buffer:
-                break
+        if not nbytes:
+            sock_error = True
 
-        msg = ''.join(chunks)
-        return msg, sock_error
+        return nbytes, sock_error
 
     def handle(self, sock, address):
         """StreamServer handler function.
@@ -79,26 +331,64 @@ class StreamServerTransport(ServerTransport):
         concurrently running function sends a reply using
         :py:func:`~tinyrpc.transports.socket.StreamServerTransport.send_reply`.
 
-        The reply will then be sent to the client being handled and handle will
-        return.
+        The reply will then be sent to the client being handled and the next
+        message is read. If the connection is closed, handle will return.
+
+        In pipelined mode, handle does not wait for replies, unless
+        ``max_in_flight`` messages are pending or the connection is being
+        closed. All messages share the connection as their context and
+        replies are written by
+        :py:func:`~tinyrpc.transports.socket.StreamServerTransport.send_reply`
+        directly.
         """
 
         sock.settimeout(self._config_timeout)
 
+        framer = self._framer_class()
+        # receive buffer is reused for every read on this connection
+        view = memoryview(bytearray(self._config_buffer))
+
+        if self.pipelined:
+            connection = _StreamConnection(sock, address, framer,
+                                           self.max_in_flight)
+
         while True:
-            msg, sock_error = self._get_msg(sock, address)
-            if msg and len(msg):
-                log.debug('StreamServerTransport:%s', msg)
+            nbytes, sock_error = self._get_data(sock, address, view)
+            if nbytes:
+                framer.feed(view[:nbytes])
+                try:
+                    for msg in framer.frames():
+                        log.debug('StreamServerTransport:%s', msg)
+
+                        if self.pipelined:
+                            connection.reserve()
+                            self.messages.put((connection, msg))
+                            continue
 
-                # create new context
-                context = self._queue_class()
-                self.messages.put((context, msg))
-                # ...and send the reply
-                response = context.get()
-                sock.send(response)
+                        # create new context
+                        context = self._queue_class()
+                        self.messages.put((context, msg))
+                        # ...and send the reply
+                        response = _get_reply(context)
+                        if isinstance(response, basestring):
+                            sock.sendall(framer.frame(response))
+                        else:
+                            for data in framer.frame_stream(response):
+                                sock.sendall(data)
+                except FramingError:
+                    log.debug('StreamServerTransport:bad frame from %s',
+                              address)
+                    sock_error = True
+                except IOError:
+                    log.debug('StreamServerTransport:reply to %s failed',
+                              address)
+                    sock_error = True
 
             if sock_error:
-                log.debug('')
+                if self.pipelined and not connection.wait_idle(
+                        self._config_timeout):
+                    log.debug('StreamServerTransport:replies to %s pending '
+                              'while closing', address)
                 sock.close()
                 break
 
@@ -106,43 +396,79 @@ class StreamServerTransport(ServerTransport):
 class StreamClientTransport(ClientTransport):
     """TCP socket based client transport.
 
-    Requires :py:mod:`websocket-python`. Submits messages to a server using the body of
-    an ``HTTP`` ``WebSocket`` message. Replies are taken from the response of the websocket.
+    Submits messages to a server over a TCP connection, using the same framing
+    as the :py:class:`~tinyrpc.transports.tcp.StreamServerTransport`.
 
     The connection is establish on the ``__init__`` because the protocol is connection oriented,
     you need to close the connection calling the close method.
 
-    :param endpoint: The URL to connect the websocket.
-    :param kwargs: Additional parameters for :py:func:`websocket.send`.
+    Messages can be sent concurrently from multiple greenlets using
+    ``expect_reply=False``, replies are then read using
+    :py:func:`~tinyrpc.transports.tcp.StreamClientTransport.receive_reply`.
+
+    :param endpoint: The ``(host, port)`` address to connect to.
+    :param framer_class: The framer class to use, must match the server.
+    :param kwargs: Additional parameters for
+                   :py:func:`gevent.socket.create_connection`.
     """
-    def __init__(self, endpoint, **kwargs):
+    def __init__(self, endpoint, framer_class=NewlineFramer, **kwargs):
         self._config_timeout = 5
         self._config_buffer = 4096
         self.endpoint = endpoint
         self.request_kwargs = kwargs
+        self.framer = framer_class()
+        self._frames = iter(())
+        self._view = memoryview(bytearray(self._config_buffer))
+        self._write_lock = Semaphore()
         self.sock = gevent.socket.create_connection(self.endpoint, **kwargs)
         self.sock.settimeout(self._config_timeout)
 
+    def receive_reply(self):
+        """Wait for the next reply to a message sent using
+        ``expect_reply=False``.
+
+        The socket timeout does not apply, as the connection is idle while
+        no calls are pending. Use the timeouts of the
+        :py:class:`~tinyrpc.client.RPCClientMultiplexed` to limit the wait
+        for a reply.
+
+        :return: The next reply received, regardless of which message it
+                 answers.
+        """
+        while True:
+            try:
+                return self._receive()
+            except socket.timeout:
+                continue
+
+    def _receive(self):
+        # frames from an earlier read may still be buffered
+        for frame in self._frames:
+            return frame
+
+        while True:
+            try:
+                nbytes = self.sock.recv_into(self._view)
+            except socket.timeout:
+                log.debug('StreamClientTransport:socket timeout from server')
+                raise
+            if not nbytes:
+                raise socket.error('Connection closed by server')
+
+            self.framer.feed(self._view[:nbytes])
+            self._frames = self.framer.frames()
+            for frame in self._frames:
+                return frame
+
     def send_message(self, message, expect_reply=True):
         if not isinstance(message, basestring):
             raise TypeError('str expected')
 
-        self.sock.send(message)
+        data = self.framer.frame(message)
+        with self._write_lock:
+            self.sock.sendall(data)
         if expect_reply:
-            chunks = []
-            while True:
-                try:
-                    data = self.sock.recv(self._config_buffer)
-                except socket.timeout:
-                    log.debug('StreamClientTransport:socket timeout from server')
-                    break
-                if not data:
-                    break
-                chunks.append(data)
-                if len(data) < self._config_buffer:
-                    break
-            response = ''.join(chunks)
-            return response
+            return self._receive()
 
     def close(self):
         if self.sock is not None:
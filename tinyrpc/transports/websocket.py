@@ -2,9 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import Queue
+from collections import OrderedDict
 
-from . import ServerTransport
+from . import ServerTransport, _put_reply_stream, _get_reply
 from geventwebsocket.resource import WebSocketApplication, Resource
+from geventwebsocket.websocket import Header
 
 
 class WSServerTransport(ServerTransport):
@@ -39,9 +41,12 @@ class WSServerTransport(ServerTransport):
             start_response("200 OK", [("Content-Type", "text/html")])
             return 'Ready for WebSocket connection in /ws'
 
-        self.handle = Resource(
-            {'/': static_wsgi_app if wsgi_handler is None else wsgi_handler,
-             '/ws': WSApplicationFactory(self.messages, queue_class)})
+        factory = WSApplicationFactory(self.messages, queue_class)
+        # the first matching path wins, / matches every path
+        self.handle = Resource(OrderedDict([
+            ('/ws', factory.application_class()),
+            ('/', static_wsgi_app if wsgi_handler is None else wsgi_handler),
+        ]))
 
     def receive_message(self):
         return self.messages.get()
@@ -49,6 +54,10 @@ class WSServerTransport(ServerTransport):
     def send_reply(self, context, reply):
         context.put(reply)
 
+    def send_reply_stream(self, context, chunks):
+        # chunks are sent as fragments of a single WebSocket message
+        _put_reply_stream(context, chunks)
+
 
 class WSApplicationFactory(object):
     """
@@ -72,6 +81,19 @@ class WSApplicationFactory(object):
     def protocol(cls):
         return WebSocketApplication.protocol()
 
+    def application_class(self):
+        """
+        Returns a WSApplication subclass bound to the queues of the factory.
+
+        :py:class:`geventwebsocket.resource.Resource` only hands WebSocket
+        requests to subclasses of
+        :py:class:`geventwebsocket.resource.WebSocketApplication`, not to
+        factories.
+        """
+        return type('WSApplication', (WSApplication,), {
+            'messages': self.messages, '_queue_class': self._queue_class
+        })
+
 
 class WSApplication(WebSocketApplication):
     """
@@ -80,8 +102,36 @@ class WSApplication(WebSocketApplication):
     :py:class:`geventwebsocket.resource.WebSocketApplication`
     """
     def on_message(self, msg, *args, **kwargs):
+        if msg is None:
+            # the connection was closed
+            return
+
         # create new context
         context = self._queue_class()
         self.messages.put((context, msg))
-        response = context.get()
-        self.ws.send(response, *args, **kwargs)
+        response = _get_reply(context)
+        if isinstance(response, basestring):
+            self.ws.send(response, *args, **kwargs)
+        else:
+            self._send_fragments(response)
+
+    def _send_fragments(self, chunks):
+        # the last chunk is only known once the next one has been asked for
+        opcode = self.ws.OPCODE_TEXT
+        previous = None
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if previous is not None:
+                self._send_fragment(previous, opcode, fin=False)
+                opcode = self.ws.OPCODE_CONTINUATION
+            previous = chunk
+
+        if previous is not None:
+            self._send_fragment(previous, opcode, fin=True)
+
+    def _send_fragment(self, data, opcode, fin):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        header = Header.encode_header(fin, opcode, b'', len(data), 0)
+        self.ws.raw_write(header + data)
@@ -2,10 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import Queue
+from functools import partial
 
 from werkzeug.wrappers import Response, Request
 
-from . import ServerTransport
+from . import ServerTransport, _put_reply_stream, _get_reply
+from .compression import get_encodings, negotiate, DecompressionError
 
 
 class WsgiServerTransport(ServerTransport):
@@ -31,13 +33,37 @@ class WsgiServerTransport(ServerTransport):
     :param queue_class: The Queue class to use.
     :param allow_origin: The ``Access-Control-Allow-Origin`` header. Defaults
                          to ``*`` (so change it if you need actual security).
+    :param chunk_size: If set, request bodies are not read before being
+                       passed on. Messages are iterables reading the body
+                       ``chunk_size`` bytes at a time instead, allowing
+                       servers to handle large batch requests while they are
+                       being received, see
+                       :py:func:`~tinyrpc.server.RPCServer.handle_message`.
+    :param compress_threshold: If set, replies of at least this many bytes
+                               are compressed using the encoding preferred
+                               by the client among ``encodings``, as
+                               negotiated by its ``Accept-Encoding`` header.
+                               Streamed replies are always compressed if the
+                               client accepts it. If ``None``, replies are
+                               sent uncompressed.
+    :param encodings: The names of the content encodings to use, in order of
+                      preference, see
+                      :py:func:`~tinyrpc.transports.compression.get_encodings`.
+                      Requests compressed using any of them are accepted
+                      regardless of ``compress_threshold``. Their size after
+                      decompression is limited by ``max_content_length`` as
+                      well.
     """
 
-    def __init__(self, max_content_length=4096, queue_class=Queue.Queue, allow_origin='*'):
+    def __init__(self, max_content_length=4096, queue_class=Queue.Queue, allow_origin='*',
+                 chunk_size=None, compress_threshold=None, encodings=None):
         self._queue_class = queue_class
         self.messages = queue_class()
         self.max_content_length = max_content_length
         self.allow_origin = allow_origin
+        self.chunk_size = chunk_size
+        self.compress_threshold = compress_threshold
+        self.encodings = get_encodings(encodings)
 
     def receive_message(self):
         return self.messages.get()
@@ -48,6 +74,9 @@ class WsgiServerTransport(ServerTransport):
 
         context.put(reply)
 
+    def send_reply_stream(self, context, chunks):
+        _put_reply_stream(context, chunks)
+
     def handle(self, environ, start_response):
         """WSGI handler function.
 
@@ -57,7 +86,10 @@ class WsgiServerTransport(ServerTransport):
         :py:func:`~tinyrpc.transports.WsgiServerTransport.send_reply`.
 
         The reply will then be sent to the client being handled and handle will
-        return.
+        return. Replies sent using
+        :py:func:`~tinyrpc.transports.WsgiServerTransport.send_reply_stream`
+        are passed on to the WSGI server as they are produced, which uses
+        chunked transfer encoding to send them.
         """
         request = Request(environ)
         request.max_content_length = self.max_content_length
@@ -72,8 +104,16 @@ class WsgiServerTransport(ServerTransport):
             response = Response(headers=access_control_headers)
 
         elif request.method == 'POST':
-            # message is encoded in POST, read it...
-            msg = request.stream.read()
+            # errors decompressing chunks are raised while the message is
+            # handled, the server answers them like other errors reading it
+            errors = []
+            try:
+                msg = self._read_message(request, errors)
+            except LookupError:
+                return Response('Unsupported content encoding',
+                                415)(environ, start_response)
+            except DecompressionError:
+                return _decompression_failed()(environ, start_response)
 
             # create new context
             context = self._queue_class()
@@ -81,9 +121,76 @@ class WsgiServerTransport(ServerTransport):
             self.messages.put((context, msg))
 
             # ...and send the reply
-            response = Response(context.get(), headers=access_control_headers)
+            reply = _get_reply(context)
+            if errors and isinstance(reply, basestring):
+                return _decompression_failed()(environ, start_response)
+            response = Response(reply, headers=access_control_headers)
+            if self.compress_threshold is not None:
+                self._compress(request, response)
         else:
             # nothing else supported at the moment
             response = Response('Only POST supported', 405)
 
         return response(environ, start_response)
+
+    def _read_message(self, request, errors):
+        # message is encoded in POST, read it...
+        if self.chunk_size:
+            msg = iter(partial(request.stream.read, self.chunk_size), '')
+        else:
+            msg = request.stream.read()
+
+        content_encoding = request.headers.get('Content-Encoding', 'identity')
+        if content_encoding == 'identity':
+            return msg
+
+        for encoding in self.encodings:
+            if encoding.name == content_encoding:
+                break
+        else:
+            raise LookupError(content_encoding)
+
+        if self.chunk_size:
+            return _recording_errors(
+                encoding.decompress_iter(msg, self.max_content_length), errors
+            )
+        return encoding.decompress(msg, self.max_content_length)
+
+    def _compress(self, request, response):
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.headers.get('Accept-Encoding'),
+                             self.encodings)
+        if encoding is None:
+            return
+
+        if response.is_streamed:
+            compressor = encoding.compressor()
+            chunks = response.response
+            response.response = _compress_iter(compressor, chunks)
+        elif len(response.get_data()) >= self.compress_threshold:
+            response.set_data(encoding.compress(response.get_data()))
+        else:
+            return
+
+        response.headers['Content-Encoding'] = encoding.name
+
+
+def _decompression_failed():
+    return Response('Invalid or too large compressed content', 413)
+
+
+def _recording_errors(chunks, errors):
+    try:
+        for chunk in chunks:
+            yield chunk
+    except DecompressionError as e:
+        errors.append(e)
+        raise
+
+
+def _compress_iter(compressor, chunks):
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -2,30 +2,70 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import  # needed for zmq import
+import collections
+import itertools
+import logging
+import Queue
+import threading
+import time
+
 import zmq
 
 from . import ServerTransport, ClientTransport
 
+log = logging.getLogger('ZmqBroker')
+
+# commands exchanged between broker and workers, the first frame after the
+# identity of the worker
+_READY = '\x01'
+_REQUEST = '\x02'
+_REPLY = '\x03'
+_HEARTBEAT = '\x04'
+
+
+def _is_green(socket):
+    return type(socket).__module__.startswith('zmq.green')
+
+
+def _poller(socket):
+    if _is_green(socket):
+        from zmq.green import Poller
+        return Poller()
+    return zmq.Poller()
+
 
 class ZmqServerTransport(ServerTransport):
     """Server transport based on a :py:const:`zmq.ROUTER` socket.
 
+    If ``copy`` is false, messages are received without copying them out of
+    the :py:class:`zmq.Frame` they arrived in. They are passed on as a
+    :py:class:`memoryview` of the frame instead, which codecs that accept
+    buffers (such as MessagePack) parse directly. Replies are sent without
+    copying as well. ZeroMQ copies small messages regardless, as this is
+    faster for them, so the mode pays off for large messages.
+
     :param socket: A :py:const:`zmq.ROUTER` socket instance, bound to an
                    endpoint.
+    :param copy: Whether or not to copy messages.
     """
 
-    def __init__(self, socket):
+    def __init__(self, socket, copy=True):
         self.socket = socket
+        self.copy = copy
 
     def receive_message(self):
-        msg = self.socket.recv_multipart()
-        return msg[:-1], msg[-1]
+        if self.copy:
+            msg = self.socket.recv_multipart()
+            return msg[:-1], msg[-1]
+
+        frames = self.socket.recv_multipart(copy=False)
+        return frames[:-1], frames[-1].buffer
 
     def send_reply(self, context, reply):
-        self.socket.send_multipart(context + [reply])
+        self.socket.send_multipart(context + [reply], copy=self.copy)
 
     @classmethod
-    def create(cls, zmq_context, endpoint):
+    def create(cls, zmq_context, endpoint, copy=True):
         """Create new server transport.
 
         Instead of creating the socket yourself, you can call this function and
@@ -36,10 +76,11 @@ class ZmqServerTransport(ServerTransport):
 
         :param zmq_context: A 0mq context.
         :param endpoint: The endpoint clients will connect to.
+        :param copy: Whether or not to copy messages.
         """
         socket = zmq_context.socket(zmq.ROUTER)
         socket.bind(endpoint)
-        return cls(socket)
+        return cls(socket, copy)
 
 
 class ZmqClientTransport(ClientTransport):
@@ -47,19 +88,25 @@ class ZmqClientTransport(ClientTransport):
 
     :param socket: A :py:const:`zmq.REQ` socket instance, connected to the
                    server socket.
+    :param copy: Whether or not to copy messages, see
+                 :py:class:`~tinyrpc.transports.zmq.ZmqServerTransport`.
+                 If false, replies are returned as a :py:class:`memoryview`.
     """
 
-    def __init__(self, socket):
+    def __init__(self, socket, copy=True):
         self.socket = socket
+        self.copy = copy
 
     def send_message(self, message, expect_reply=True):
-        self.socket.send(message)
+        self.socket.send(message, copy=self.copy)
 
         if expect_reply:
-            return self.socket.recv()
+            if self.copy:
+                return self.socket.recv()
+            return self.socket.recv(copy=False).buffer
 
     @classmethod
-    def create(cls, zmq_context, endpoint):
+    def create(cls, zmq_context, endpoint, copy=True):
         """Create new client transport.
 
         Instead of creating the socket yourself, you can call this function and
@@ -70,7 +117,500 @@ class ZmqClientTransport(ClientTransport):
 
         :param zmq_context: A 0mq context.
         :param endpoint: The endpoint the server is bound to.
+        :param copy: Whether or not to copy messages.
         """
         socket = zmq_context.socket(zmq.REQ)
         socket.connect(endpoint)
-        return cls(socket)
+        return cls(socket, copy)
+
+
+class ZmqDealerClientTransport(ClientTransport):
+    """Client transport based on a :py:const:`zmq.DEALER` socket.
+
+    Unlike a :py:const:`zmq.REQ` socket, a :py:const:`zmq.DEALER` socket does
+    not wait for the reply to a message before sending the next one. Messages
+    sent using ``expect_reply=False`` are answered in whatever order the
+    server finishes them, replies are read using
+    :py:func:`~tinyrpc.transports.zmq.ZmqDealerClientTransport.receive_reply`.
+    Combined with a :py:class:`~tinyrpc.client.RPCClientMultiplexed`, which
+    matches replies to calls by their unique id, any number of calls can be
+    in flight at once. Messages are sent in the envelope of a
+    :py:const:`zmq.REQ` socket, so the
+    :py:class:`~tinyrpc.transports.zmq.ZmqServerTransport` serves both.
+
+    The transport can be shared by multiple threads or greenlets. As 0mq
+    sockets are not thread safe, the socket is only used by an I/O thread
+    (or greenlet, for sockets from :py:mod:`zmq.green`) started along with
+    the transport. Senders hand their messages to it through an inproc
+    :py:const:`zmq.PUSH` socket of their thread. The I/O thread waits for
+    both messages to send and replies, so neither waits for the other.
+
+    Messages sent using ``expect_reply=True`` carry a tag in an additional
+    envelope frame, which servers and brokers return with the reply. The
+    reply is handed to the sender of the message, even if other threads are
+    waiting for replies at the same time.
+
+    :param socket: A :py:const:`zmq.DEALER` socket instance, connected to the
+                   server socket. It must not be used by anything else.
+    :param copy: Whether or not to copy messages, see
+                 :py:class:`~tinyrpc.transports.zmq.ZmqServerTransport`.
+    """
+
+    _inbox_ids = itertools.count()
+
+    def __init__(self, socket, copy=True):
+        self.socket = socket
+        self.copy = copy
+        self._closed = False
+        self._tags = itertools.count()
+        self._waiting = {}
+        self._local = threading.local()
+        self._outboxes = []
+        self._outboxes_lock = threading.Lock()
+
+        self._endpoint = 'inproc://tinyrpc-dealer-%d' % next(self._inbox_ids)
+        self._inbox = socket.context.socket(zmq.PULL)
+        self._inbox.bind(self._endpoint)
+
+        if _is_green(socket):
+            import gevent
+            import gevent.queue
+            self._queue_class = gevent.queue.Queue
+            self._replies = self._queue_class()
+            self._io = gevent.spawn(self._run)
+        else:
+            self._queue_class = Queue.Queue
+            self._replies = self._queue_class()
+            self._io = threading.Thread(target=self._run,
+                                        name='ZmqDealerClientTransport')
+            self._io.daemon = True
+            self._io.start()
+
+    def send_message(self, message, expect_reply=True):
+        if not isinstance(message, str):
+            raise TypeError('str expected')
+        if self._closed:
+            raise zmq.ZMQError(zmq.ENOTSOCK, 'Transport closed')
+
+        if not expect_reply:
+            self._outbox().send_multipart(['', message], copy=self.copy)
+            return
+
+        tag = str(next(self._tags))
+        reply = self._waiting[tag] = self._queue_class()
+        self._outbox().send_multipart([tag, '', message], copy=self.copy)
+        return self._get(reply)
+
+    def receive_reply(self):
+        """Wait for the next reply to a message sent using
+        ``expect_reply=False``.
+
+        :return: The next reply received, regardless of which message it
+                 answers.
+        """
+        return self._get(self._replies)
+
+    def close(self):
+        """Stop the I/O thread and close all sockets.
+
+        Threads waiting for replies get a :py:class:`zmq.ZMQError`.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        self._outbox().send('')
+        self._io.join()
+        with self._outboxes_lock:
+            for outbox in self._outboxes:
+                outbox.close()
+
+    def _outbox(self):
+        outbox = getattr(self._local, 'socket', None)
+        if outbox is None:
+            outbox = self._local.socket = self.socket.context.socket(zmq.PUSH)
+            outbox.connect(self._endpoint)
+            with self._outboxes_lock:
+                self._outboxes.append(outbox)
+        return outbox
+
+    def _get(self, queue):
+        reply = queue.get()
+        if isinstance(reply, Exception):
+            # let other receivers fail as well
+            queue.put(reply)
+            raise reply
+        return reply
+
+    def _run(self):
+        poller = _poller(self.socket)
+        poller.register(self.socket, zmq.POLLIN)
+        poller.register(self._inbox, zmq.POLLIN)
+
+        try:
+            running = True
+            while running:
+                events = dict(poller.poll())
+                if self.socket in events:
+                    self._receive_replies()
+                if self._inbox in events:
+                    running = self._send_messages()
+        finally:
+            self._inbox.close()
+            self.socket.close()
+
+            error = zmq.ZMQError(zmq.ENOTSOCK, 'Transport closed')
+            for reply in self._waiting.values():
+                reply.put(error)
+            self._waiting.clear()
+            self._replies.put(error)
+
+    def _send_messages(self):
+        # send everything handed over since the last poll
+        while True:
+            try:
+                frames = self._inbox.recv_multipart(zmq.NOBLOCK,
+                                                    copy=self.copy)
+            except zmq.Again:
+                return True
+
+            if len(frames) == 1:
+                # sent by close
+                return False
+            self.socket.send_multipart(frames, copy=self.copy)
+
+    def _receive_replies(self):
+        while True:
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK,
+                                                    copy=self.copy)
+            except zmq.Again:
+                return
+
+            if self.copy:
+                tag, reply = frames[0], frames[-1]
+            else:
+                tag, reply = frames[0].bytes, frames[-1].buffer
+
+            if len(frames) < 3:
+                self._replies.put(reply)
+                continue
+
+            waiting = self._waiting.pop(tag, None)
+            if waiting is not None:
+                waiting.put(reply)
+
+    @classmethod
+    def create(cls, zmq_context, endpoint, copy=True):
+        """Create new client transport.
+
+        :param zmq_context: A 0mq context, imported from :py:mod:`zmq.green`
+                            for use with :py:mod:`gevent`.
+        :param endpoint: The endpoint the server is bound to.
+        :param copy: Whether or not to copy messages.
+        """
+        socket = zmq_context.socket(zmq.DEALER)
+        socket.connect(endpoint)
+        return cls(socket, copy)
+
+
+class _Worker(object):
+    def __init__(self, identity, capacity):
+        self.identity = identity
+        self.capacity = capacity
+        self.requests = set()
+        self.expires = None
+
+    @property
+    def free(self):
+        return self.capacity - len(self.requests)
+
+
+class ZmqBroker(object):
+    """Load balancing broker between clients and a pool of workers.
+
+    Clients connect to the ``frontend`` :py:const:`zmq.ROUTER` socket exactly
+    like they connect to a
+    :py:class:`~tinyrpc.transports.zmq.ZmqServerTransport`, using a
+    :py:class:`~tinyrpc.transports.zmq.ZmqClientTransport` or
+    :py:class:`~tinyrpc.transports.zmq.ZmqDealerClientTransport`. Workers
+    connect to the ``backend`` :py:const:`zmq.ROUTER` socket using a
+    :py:class:`~tinyrpc.transports.zmq.ZmqWorkerTransport`, each one serving
+    an :py:class:`~tinyrpc.server.RPCServer`. Workers can run in other
+    threads, processes or hosts and come and go at any time.
+
+    Each request is routed to the worker with the most free capacity,
+    the least recently used one among equals. If all workers are busy,
+    requests wait in the broker until one becomes free.
+
+    Broker and workers exchange heartbeats every ``heartbeat_interval``
+    seconds. A worker that has not been heard of for ``heartbeat_liveness``
+    intervals is considered dead, the requests it was handling are sent to
+    other workers. If a worker dies because of a request, every worker it is
+    sent to dies as well, the broker does not detect this.
+
+    :param frontend: A :py:const:`zmq.ROUTER` socket instance, bound to the
+                     endpoint clients connect to.
+    :param backend: A :py:const:`zmq.ROUTER` socket instance, bound to the
+                    endpoint workers connect to.
+    :param heartbeat_interval: Seconds between heartbeats.
+    :param heartbeat_liveness: Number of heartbeats that may be missed before
+                               a worker is considered dead.
+    """
+
+    drain_limit = 100
+    """The most messages taken from each socket after a poll."""
+
+    def __init__(self, frontend, backend, heartbeat_interval=1.0,
+                 heartbeat_liveness=3):
+        self.frontend = frontend
+        self.backend = backend
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_liveness = heartbeat_liveness
+
+        self._workers = collections.OrderedDict()
+        # request id -> (client envelope, message, worker or None)
+        self._requests = {}
+        self._pending = collections.deque()
+        self._ids = itertools.count()
+        self._poller = _poller(frontend)
+        self._poller.register(frontend, zmq.POLLIN)
+        self._poller.register(backend, zmq.POLLIN)
+        self._next_heartbeat = time.time() + heartbeat_interval
+        self._running = False
+
+    def serve_forever(self):
+        """Route messages until :py:func:`stop` is called."""
+        self._running = True
+        while self._running:
+            self.poll(self.heartbeat_interval)
+
+    def stop(self):
+        """Make :py:func:`serve_forever` return.
+
+        It returns after at most one heartbeat interval.
+        """
+        self._running = False
+
+    def poll(self, timeout=None):
+        """Handle the messages arriving within ``timeout`` seconds.
+
+        Heartbeats are sent and dead workers are removed as well.
+
+        :param timeout: Seconds to wait for messages, ``None`` waits until
+                        the next heartbeat is due.
+        """
+        now = time.time()
+        wait = self._next_heartbeat - now
+        if timeout is not None:
+            wait = min(wait, timeout)
+
+        events = dict(self._poller.poll(max(0, int(wait * 1000))))
+        if events.get(self.backend):
+            self._drain(self.backend, self._handle_worker)
+        if events.get(self.frontend):
+            self._drain(self.frontend, self._handle_client)
+
+        now = time.time()
+        self._remove_dead_workers(now)
+        if now >= self._next_heartbeat:
+            for identity in self._workers:
+                self.backend.send_multipart([identity, _HEARTBEAT])
+            self._next_heartbeat = now + self.heartbeat_interval
+
+    def _drain(self, socket, handle):
+        # take all waiting messages without polling again for every one,
+        # up to a limit so that the other socket is not starved
+        for _ in xrange(self.drain_limit):
+            try:
+                frames = socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            handle(frames)
+
+    def _handle_client(self, frames):
+        request_id = str(next(self._ids))
+        self._requests[request_id] = (frames[:-1], frames[-1], None)
+        self._pending.append(request_id)
+        self._dispatch()
+
+    def _handle_worker(self, frames):
+        identity, command = frames[:2]
+        worker = self._workers.get(identity)
+
+        if command == _READY:
+            if worker is None:
+                worker = self._workers[identity] = _Worker(identity, 1)
+            worker.capacity = int(frames[2])
+        elif command == _REPLY:
+            self._handle_reply(frames[2], frames[3])
+        elif command != _HEARTBEAT:
+            log.warning('Invalid command from worker: %r', command)
+
+        if worker is not None:
+            worker.expires = time.time() + \
+                self.heartbeat_interval * self.heartbeat_liveness
+            self._dispatch()
+
+    def _handle_reply(self, request_id, reply):
+        try:
+            envelope, message, worker = self._requests.pop(request_id)
+        except KeyError:
+            # already answered by another worker
+            return
+
+        if worker is None:
+            # answered by a worker considered dead before
+            self._pending.remove(request_id)
+        else:
+            worker.requests.discard(request_id)
+        self.frontend.send_multipart(envelope + [reply])
+
+    def _dispatch(self):
+        while self._pending:
+            worker = None
+            for candidate in self._workers.itervalues():
+                if candidate.free > 0 and \
+                        (worker is None or candidate.free > worker.free):
+                    worker = candidate
+            if worker is None:
+                return
+
+            request_id = self._pending.popleft()
+            envelope, message, _ = self._requests[request_id]
+            self._requests[request_id] = (envelope, message, worker)
+            worker.requests.add(request_id)
+            # move to the end, making it the most recently used one
+            del self._workers[worker.identity]
+            self._workers[worker.identity] = worker
+            self.backend.send_multipart(
+                [worker.identity, _REQUEST, request_id, message]
+            )
+
+    def _remove_dead_workers(self, now):
+        dead = [worker for worker in self._workers.itervalues()
+                if worker.expires < now]
+        for worker in dead:
+            log.warning('Worker %r died, requeueing %d requests',
+                        worker.identity, len(worker.requests))
+            del self._workers[worker.identity]
+            for request_id in worker.requests:
+                envelope, message, _ = self._requests[request_id]
+                self._requests[request_id] = (envelope, message, None)
+                self._pending.appendleft(request_id)
+
+        if dead:
+            self._dispatch()
+
+    def close(self):
+        """Close both sockets."""
+        self.frontend.close()
+        self.backend.close()
+
+    @classmethod
+    def create(cls, zmq_context, frontend_endpoint, backend_endpoint,
+               **kwargs):
+        """Create new broker.
+
+        :param zmq_context: A 0mq context, imported from :py:mod:`zmq.green`
+                            for use with :py:mod:`gevent`.
+        :param frontend_endpoint: The endpoint clients connect to.
+        :param backend_endpoint: The endpoint workers connect to.
+
+        All other keyword arguments are passed on to the constructor.
+        """
+        frontend = zmq_context.socket(zmq.ROUTER)
+        frontend.bind(frontend_endpoint)
+        backend = zmq_context.socket(zmq.ROUTER)
+        backend.bind(backend_endpoint)
+        return cls(frontend, backend, **kwargs)
+
+
+class ZmqWorkerTransport(ServerTransport):
+    """Server transport receiving requests from a
+    :py:class:`~tinyrpc.transports.zmq.ZmqBroker`.
+
+    The worker announces itself to the broker when created, and again if it
+    has not heard of the broker for ``heartbeat_liveness`` intervals, for
+    example because the broker was restarted.
+
+    Heartbeats are sent while waiting in
+    :py:func:`~tinyrpc.transports.zmq.ZmqWorkerTransport.receive_message`.
+    Handle requests concurrently using green sockets from
+    :py:mod:`zmq.green` and a server such as
+    :py:class:`~tinyrpc.server.gevent.RPCServerGreenlets`, or make sure
+    handling a request takes less than ``heartbeat_liveness`` intervals.
+    Otherwise the broker considers the worker dead.
+
+    :param socket: A :py:const:`zmq.DEALER` socket instance, connected to the
+                   backend endpoint of the broker.
+    :param capacity: The number of requests the worker handles at once.
+    :param heartbeat_interval: Seconds between heartbeats, the same as the
+                               one of the broker.
+    :param heartbeat_liveness: Number of heartbeats of the broker that may be
+                               missed before announcing the worker again.
+    :param copy: Whether or not to copy messages, see
+                 :py:class:`~tinyrpc.transports.zmq.ZmqServerTransport`.
+    """
+
+    def __init__(self, socket, capacity=1, heartbeat_interval=1.0,
+                 heartbeat_liveness=3, copy=True):
+        self.socket = socket
+        self.capacity = capacity
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_liveness = heartbeat_liveness
+        self.copy = copy
+        self._ready()
+
+    def _ready(self):
+        self.socket.send_multipart([_READY, str(self.capacity)])
+        now = time.time()
+        self._next_heartbeat = now + self.heartbeat_interval
+        self._broker_expires = now + \
+            self.heartbeat_interval * self.heartbeat_liveness
+
+    def receive_message(self):
+        while True:
+            now = time.time()
+            if now >= self._broker_expires:
+                log.warning('Broker not responding, announcing worker again')
+                self._ready()
+            elif now >= self._next_heartbeat:
+                self.socket.send_multipart([_HEARTBEAT])
+                self._next_heartbeat = now + self.heartbeat_interval
+
+            wait = min(self._next_heartbeat, self._broker_expires) - now
+            if not self.socket.poll(max(0, int(wait * 1000))):
+                continue
+
+            frames = self.socket.recv_multipart(copy=self.copy)
+            self._broker_expires = time.time() + \
+                self.heartbeat_interval * self.heartbeat_liveness
+            if not self.copy:
+                command = frames[0].bytes
+                if command == _REQUEST:
+                    return frames[1].bytes, frames[2].buffer
+            else:
+                command = frames[0]
+                if command == _REQUEST:
+                    return frames[1], frames[2]
+
+            if command != _HEARTBEAT:
+                log.warning('Invalid command from broker: %r', command)
+
+    def send_reply(self, context, reply):
+        self.socket.send_multipart([_REPLY, context, reply], copy=self.copy)
+
+    @classmethod
+    def create(cls, zmq_context, endpoint, **kwargs):
+        """Create new worker transport.
+
+        :param zmq_context: A 0mq context, imported from :py:mod:`zmq.green`
+                            for use with :py:mod:`gevent`.
+        :param endpoint: The backend endpoint of the broker.
+
+        All other keyword arguments are passed on to the constructor.
+        """
+        socket = zmq_context.socket(zmq.DEALER)
+        socket.connect(endpoint)
+        return cls(socket, **kwargs)